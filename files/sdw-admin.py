@@ -13,6 +13,7 @@ import sys
 
 from qubesadmin import Qubes
 
+from sdw_updater import History, Preflight
 from sdw_util.config_types import ValidationError
 
 # The max concurrency reduction (4->2) was required to avoid "did not return clean data"
@@ -77,9 +78,38 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Configure SecureDrop Workstation",
     )
+    parser.add_argument(
+        "--skip-storage-check",
+        default=False,
+        required=False,
+        action="store_true",
+        help="During apply action, don't check for enough free storage beforehand",
+    )
     return parser.parse_args()
 
 
+def check_storage() -> None:
+    """
+    Checks that the default storage pool has room for the configuration to be
+    applied, based on the storage used by earlier runs of the updater. Exits
+    if it does not.
+    """
+    expected_growth = History.expected_pool_growth(History.read_history(), "apply_all")
+    shortages = Preflight.check_storage(
+        pool_growth=(
+            expected_growth
+            if expected_growth is not None
+            else Preflight.DEFAULT_FULL_INSTALL_GROWTH
+        )
+    )
+    if shortages:
+        print("Not enough storage to apply configuration. Please free up space and try again.")
+        for shortage in shortages:
+            print(shortage)
+        print("To apply the configuration regardless, use --skip-storage-check.")
+        sys.exit(1)
+
+
 def copy_config() -> None:
     """
     Copies config.json and sd-journalist.sec to /srv/salt/securedrop_salt
@@ -578,6 +608,8 @@ def main() -> None:
             if response.lower() != "y":
                 print("Exiting.")
                 sys.exit(0)
+        if not args.skip_storage_check:
+            check_storage()
         print("Applying configuration...")
         validate_config(SCRIPTS_PATH)
         copy_config()
@@ -13,7 +13,7 @@ except ImportError:
     from PyQt5.QtWidgets import QApplication  # type: ignore [no-redef]
 
 from sdw_notify import Notify, NotifyApp
-from sdw_updater import Updater, UpdaterApp
+from sdw_updater import StatusServer, Updater, UpdaterApp
 from sdw_util import Util
 
 Util.configure_logging(Notify.LOG_FILE)
@@ -33,6 +33,9 @@ def main() -> None:
 
     if Util.can_obtain_lock(Updater.LOCK_FILE) is False:
         # Preflight updater is already running. Logged.
+        status = StatusServer.read_status()
+        if status is not None:
+            log.info(f"Updater is running: {StatusServer.describe(status)}")
         sys.exit(1)
 
     # Hold on to lock handle during execution
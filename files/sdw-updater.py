@@ -1,16 +1,13 @@
 #!/usr/bin/python3
 import argparse
+import json
 import sys
 
-try:
-    from PyQt6.QtWidgets import QApplication
-except ImportError:
-    from PyQt5.QtWidgets import QApplication  # type: ignore [no-redef]
-
-
-from sdw_updater import Updater
-from sdw_updater.Updater import is_qubes_mid_upgrade, should_launch_updater
-from sdw_updater.UpdaterApp import UpdaterApp, launch_securedrop_inbox
+# Only lightweight modules are imported here: PyQt (for the GUI) and dnf and
+# qubesadmin (to detect an in-place upgrade) are imported only when needed,
+# so that launching the inbox when updates are current stays fast.
+from sdw_updater import Checkpoint, Inbox, Updater
+from sdw_updater.Updater import is_qubes_mid_upgrade, launch_securedrop_inbox, should_launch_updater
 from sdw_util import Util
 
 DEFAULT_INTERVAL = 28800  # 8hr default for update interval
@@ -18,8 +15,52 @@ DEFAULT_INTERVAL = 28800  # 8hr default for update interval
 
 def parse_argv(argv: list[str]) -> argparse.Namespace:
     parser = argparse.ArgumentParser()
-    parser.add_argument("--skip-delta", type=int)
+    parser.add_argument("--skip-delta", type=int, default=DEFAULT_INTERVAL)
     parser.add_argument("--skip-netcheck", action="store_true")
+    parser.add_argument(
+        "--force-dom0-state",
+        action="store_true",
+        help="Apply the dom0 state even if its inputs are unchanged since the last update",
+    )
+    parser.add_argument(
+        "--refresh-all-templates",
+        action="store_true",
+        help="Update all templates, even those that appear to be up to date",
+    )
+    parser.add_argument(
+        "--prefetch",
+        action="store_true",
+        help="Download available updates in the background without installing them",
+    )
+    parser.add_argument(
+        "--background",
+        action="store_true",
+        help="Update templates in the background if the workstation is idle: sd-app is "
+        "halted and the machine is on AC power",
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="Apply updates without a GUI, reporting progress and results on stdout as "
+        "JSON lines; the exit code is the overall update status",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print statistics on the duration of previous updater runs",
+    )
+    parser.add_argument(
+        "--status",
+        action="store_true",
+        help="Print the status of the running updater as JSON; the exit code is 1 if no "
+        "updater is running",
+    )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="With --status, print the status again each time it changes, until the run "
+        "has completed",
+    )
     return parser.parse_args(argv)
 
 
@@ -27,6 +68,13 @@ def launch_updater(should_skip_netcheck: bool = False) -> None:
     """
     Start the updater GUI.
     """
+    # PyQt is only imported when needed, so that headless mode runs without it
+    try:
+        from PyQt6.QtWidgets import QApplication
+    except ImportError:
+        from PyQt5.QtWidgets import QApplication  # type: ignore [no-redef]
+
+    from sdw_updater.UpdaterApp import UpdaterApp
 
     app = QApplication(sys.argv)
     form = UpdaterApp(should_skip_netcheck)
@@ -34,39 +82,161 @@ def launch_updater(should_skip_netcheck: bool = False) -> None:
     sys.exit(app.exec())
 
 
+def print_status(follow: bool = False) -> None:
+    """
+    Print the status of the running updater, as served by it, and exit.
+    """
+    from sdw_updater import StatusServer
+
+    if follow:
+        statuses = StatusServer.subscribe()
+    else:
+        status = StatusServer.read_status()
+        statuses = iter([status] if status is not None else [])
+
+    running = False
+    for status in statuses:
+        running = True
+        print(json.dumps(status), flush=True)
+    sys.exit(0 if running else 1)
+
+
+def prefetch_updates() -> None:
+    """
+    Download updates without installing them, unless the updater is running.
+    """
+    sdlog = Util.get_logger()
+
+    lock_handle = Util.obtain_lock(Updater.PREFETCH_LOCK_FILE)
+    if lock_handle is None or not Util.can_obtain_lock(Updater.LOCK_FILE):
+        # Background download or updater already running. Logged.
+        sys.exit(1)
+
+    if is_qubes_mid_upgrade():
+        sdlog.info("Detected inplace upgrade in process. Exiting!")
+        sys.exit(0)
+
+    result = Updater.prefetch_updates()
+    sys.exit(0 if result == Updater.UpdateStatus.UPDATES_OK else 1)
+
+
+def update_in_background() -> None:
+    """
+    Update templates if the workstation is idle, unless the updater is running.
+    The update is cancelled once the updater is started.
+    """
+    sdlog = Util.get_logger()
+
+    lock_handle = Util.obtain_lock(Updater.BACKGROUND_LOCK_FILE)
+    if lock_handle is None or not Util.can_obtain_lock(Updater.LOCK_FILE):
+        # Background update or updater already running. Logged.
+        sys.exit(1)
+
+    if is_qubes_mid_upgrade():
+        sdlog.info("Detected inplace upgrade in process. Exiting!")
+        sys.exit(0)
+
+    from sdw_updater import BackgroundUpdate
+
+    result = BackgroundUpdate.run()
+    sys.exit(0 if result in {None, Updater.UpdateStatus.UPDATES_OK} else 1)
+
+
+def launch_inbox_if_up_to_date(interval: int) -> None:
+    """
+    Launch the inbox and exit if updates are current, else return so that the
+    updater runs.
+    """
+    sdlog = Util.get_logger()
+
+    # If the inbox is likely to be launched, start sd-proxy right away so that
+    # Tor can bootstrap while the checks below run
+    warmup = None
+    if Updater.inbox_launch_expected(interval):
+        warmup = Inbox.QubeWarmup()
+        warmup.start()
+
+    # A background update is cancelled now that the updater is running, and
+    # may record the update status until it has stopped
+    Updater.wait_for_background_update()
+
+    # Decide from the update status first. In the common case, updates are
+    # current and the inbox can be launched right away, unless dom0 packages
+    # have changed since, which may be due to an in-place upgrade.
+    if not should_launch_updater(interval):
+        if Updater.dom0_packages_changed_since_status_update() and is_qubes_mid_upgrade():
+            sdlog.info("Detected inplace upgrade in process. Exiting!")
+            if warmup:
+                warmup.cancel()
+            sys.exit(0)
+        launch_securedrop_inbox(warmup)
+
+    if warmup:
+        warmup.cancel()
+
+
+def log_running_updater_status() -> None:
+    from sdw_updater import StatusServer
+
+    status = StatusServer.read_status()
+    if status is not None:
+        Util.get_logger().info(f"Updater is already running: {StatusServer.describe(status)}")
+
+
 def main(argv: list[str]) -> None:
     Util.configure_logging(Updater.LOG_FILE)
     Util.configure_logging(Updater.DETAIL_LOG_FILE, Updater.DETAIL_LOGGER_PREFIX, backup_count=10)
     sdlog = Util.get_logger()
 
+    args = parse_argv(argv)
+
+    if args.stats:
+        from sdw_updater import History
+
+        print(History.format_stats(History.read_history()))
+        sys.exit(0)
+
+    if args.status:
+        print_status(args.follow)
+
+    if args.prefetch:
+        prefetch_updates()
+
+    if args.background:
+        update_in_background()
+
     lock_handle = Util.obtain_lock(Updater.LOCK_FILE)
     if lock_handle is None:
         # Preflight updater already running or problems accessing lockfile.
         # Logged.
+        log_running_updater_status()
         sys.exit(1)
 
-    if is_qubes_mid_upgrade():
-        sdlog.info("Detected inplace upgrade in process. Exiting!")
-        sys.exit(0)
-
     sdlog.info("Starting SecureDrop Launcher")
 
-    args = parse_argv(argv)
+    interval = args.skip_delta
 
-    try:
-        args.skip_delta
-    except NameError:
-        args.skip_delta = DEFAULT_INTERVAL
+    if args.force_dom0_state:
+        Updater.clear_dom0_state_digest()
+    if args.refresh_all_templates:
+        Updater.clear_template_fingerprints()
+    if args.force_dom0_state or args.refresh_all_templates:
+        # Do not resume a previous run, which may have skipped these
+        Checkpoint.clear()
+
+    if not args.headless:
+        launch_inbox_if_up_to_date(interval)
+
+    if is_qubes_mid_upgrade():
+        sdlog.info("Detected inplace upgrade in process. Exiting!")
+        sys.exit(0)
 
-    if args.skip_delta is None:
-        args.skip_delta = DEFAULT_INTERVAL
+    if args.headless:
+        from sdw_updater import Pipeline
 
-    interval = int(args.skip_delta)
+        sys.exit(Pipeline.run_headless(args.skip_netcheck))
 
-    if should_launch_updater(interval):
-        launch_updater(args.skip_netcheck)
-    else:
-        launch_securedrop_inbox()
+    launch_updater(args.skip_netcheck)
 
 
 if __name__ == "__main__":
@@ -40,6 +40,16 @@ def mocked_qubes_vm_update(tmp_path, monkeypatch):
     return _mocked_qubes_vm_update
 
 
+@pytest.fixture(autouse=True)
+def dom0_home(tmp_path, monkeypatch):
+    """
+    Keep state written by the updater during tests (e.g. Salt state durations)
+    out of the real home directory
+    """
+    monkeypatch.setenv("HOME", str(tmp_path))
+    return tmp_path
+
+
 @pytest.fixture
 def tmpdir():
     """Run the test in a temporary directory"""
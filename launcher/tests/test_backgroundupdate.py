@@ -0,0 +1,163 @@
+from unittest import mock
+
+import pytest
+
+from sdw_updater import BackgroundUpdate, Updater
+from sdw_updater.Updater import UpdateStatus
+
+
+@pytest.fixture
+def power_supplies(tmp_path):
+    """
+    Fakes /sys/class/power_supply: call with the (type, online) of each
+    power supply.
+    """
+
+    def add(*supplies):
+        for i, (supply_type, online) in enumerate(supplies):
+            supply = tmp_path / f"supply{i}"
+            supply.mkdir()
+            (supply / "type").write_text(f"{supply_type}\n")
+            if online is not None:
+                (supply / "online").write_text(f"{online}\n")
+
+    with mock.patch("sdw_updater.BackgroundUpdate.POWER_SUPPLY_DIR", str(tmp_path)):
+        yield add
+
+
+@pytest.mark.parametrize(
+    ("supplies", "on_ac_power"),
+    [
+        ([], True),
+        ([("Mains", 1), ("Battery", None)], True),
+        ([("Mains", 0), ("Battery", None)], False),
+        ([("Battery", None)], False),
+        ([("USB", 1), ("Battery", None)], True),
+    ],
+)
+def test_is_on_ac_power(power_supplies, supplies, on_ac_power):
+    power_supplies(*supplies)
+    assert BackgroundUpdate.is_on_ac_power() == on_ac_power
+
+
+def test_is_on_ac_power_unknown():
+    with mock.patch("sdw_updater.BackgroundUpdate.POWER_SUPPLY_DIR", "/nonexistent"):
+        assert BackgroundUpdate.is_on_ac_power()
+
+
+@pytest.fixture
+def idle():
+    with (
+        mock.patch("sdw_updater.BackgroundUpdate.is_on_ac_power", return_value=True),
+        mock.patch("sdw_util.Util.is_sdapp_halted", return_value=True),
+        mock.patch("sdw_util.Util.can_obtain_lock", return_value=True) as can_obtain_lock,
+        mock.patch("sdw_updater.Preflight.is_netcheck_successful", return_value=True),
+        mock.patch("sdw_updater.Preflight.get_pool_free_space", return_value=None),
+    ):
+        yield can_obtain_lock
+
+
+@pytest.fixture
+def dom0_up_to_date():
+    with mock.patch("sdw_updater.Updater.is_dom0_up_to_date", return_value=True) as up_to_date:
+        yield up_to_date
+
+
+@mock.patch("sdw_updater.Pipeline.UpdatePipeline.run_templates")
+@mock.patch("sdw_updater.BackgroundUpdate.is_on_ac_power", return_value=False)
+@mock.patch("sdw_util.Util.is_sdapp_halted", return_value=False)
+@mock.patch("sdw_updater.BackgroundUpdate.logger.info")
+def test_run_not_idle(mocked_info, sd_app_halted, on_ac_power, run_templates):
+    """
+    When the workstation is in use or on battery
+    Then templates are not updated
+    """
+    assert BackgroundUpdate.run() is None
+    assert not run_templates.called
+    mocked_info.assert_called_once_with(
+        "Skipping background update: running on battery, sd-app is not halted"
+    )
+
+
+@mock.patch(
+    "sdw_updater.Pipeline.UpdatePipeline.run_templates", return_value=UpdateStatus.UPDATES_OK
+)
+def test_run_idle(run_templates, idle, dom0_up_to_date):
+    """
+    When the workstation is idle
+      And templates are updated in the background
+      And dom0 is up to date
+    Then the system is recorded as up to date
+      And the next launch opens the inbox
+    """
+    assert BackgroundUpdate.run() == UpdateStatus.UPDATES_OK
+    run_templates.assert_called_once_with()
+    assert Updater.read_dom0_update_flag_from_disk()["status"] == UpdateStatus.UPDATES_OK.value
+    assert not Updater.should_launch_updater(3600)
+
+
+@pytest.mark.parametrize(
+    ("template_status", "is_dom0_up_to_date", "status"),
+    [
+        (UpdateStatus.UPDATES_OK, False, UpdateStatus.UPDATES_REQUIRED),
+        (UpdateStatus.UPDATES_FAILED, True, UpdateStatus.UPDATES_FAILED),
+    ],
+)
+def test_run_idle_update_required(
+    idle, dom0_up_to_date, template_status, is_dom0_up_to_date, status
+):
+    """
+    When templates are updated in the background
+      And they fail to update, or dom0 is not up to date
+    Then the updater is required
+    """
+    dom0_up_to_date.return_value = is_dom0_up_to_date
+    with mock.patch(
+        "sdw_updater.Pipeline.UpdatePipeline.run_templates", return_value=template_status
+    ):
+        assert BackgroundUpdate.run() == template_status
+    assert Updater.read_dom0_update_flag_from_disk()["status"] == status.value
+    assert Updater.should_launch_updater(3600)
+
+
+@mock.patch(
+    "sdw_updater.Pipeline.UpdatePipeline.run_templates", return_value=UpdateStatus.UPDATES_OK
+)
+@mock.patch("sdw_updater.Updater.last_required_reboot_performed", return_value=False)
+def test_run_idle_reboot_pending(reboot_performed, run_templates, idle, dom0_up_to_date):
+    """
+    When templates are updated in the background
+      And a reboot is pending
+    Then the update status is left unchanged
+    """
+    Updater._write_updates_status_flag_to_disk(UpdateStatus.REBOOT_REQUIRED)
+    assert BackgroundUpdate.run() == UpdateStatus.UPDATES_OK
+    assert Updater.read_dom0_update_flag_from_disk()["status"] == UpdateStatus.REBOOT_REQUIRED.value
+    assert not dom0_up_to_date.called
+
+
+def test_run_cancelled(idle, dom0_up_to_date):
+    """
+    When the updater is started during a background update
+    Then the background update is cancelled
+      And the update status is left to the updater
+    """
+    can_obtain_lock = idle
+    Updater._write_updates_status_flag_to_disk(UpdateStatus.UPDATES_REQUIRED)
+
+    def run_templates(pipeline):
+        assert not pipeline.cancel()
+        can_obtain_lock.return_value = False
+        assert pipeline.cancel()
+        return UpdateStatus.UPDATES_FAILED
+
+    with mock.patch(
+        "sdw_updater.Pipeline.UpdatePipeline.run_templates",
+        autospec=True,
+        side_effect=run_templates,
+    ):
+        assert BackgroundUpdate.run() is None
+    can_obtain_lock.assert_called_with(Updater.LOCK_FILE, log=False)
+    assert (
+        Updater.read_dom0_update_flag_from_disk()["status"] == UpdateStatus.UPDATES_REQUIRED.value
+    )
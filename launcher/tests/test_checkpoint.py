@@ -0,0 +1,95 @@
+import json
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+
+from sdw_updater import Checkpoint
+from sdw_updater.Updater import DATE_FORMAT, UpdateStatus, get_dom0_path
+
+
+@pytest.fixture(autouse=True)
+def template_fingerprints():
+    with mock.patch(
+        "sdw_updater.Updater._get_template_fingerprint", side_effect=lambda t: f"{t}-sources"
+    ) as fingerprint:
+        yield fingerprint
+
+
+def test_checkpoint_roundtrip():
+    checkpoint = Checkpoint.load()
+    assert checkpoint.completed("dom0", lambda: "rpmdb:1") is None
+
+    checkpoint.complete("dom0", "rpmdb:1", UpdateStatus.UPDATES_OK)
+    checkpoint.complete_templates({"fedora-41": UpdateStatus.UPDATES_OK})
+
+    resumed = Checkpoint.load()
+    assert resumed.started == checkpoint.started
+    assert resumed.completed("dom0", lambda: "rpmdb:1") == UpdateStatus.UPDATES_OK
+    assert resumed.completed_templates() == {"fedora-41"}
+
+
+def test_checkpoint_inputs_changed():
+    Checkpoint.load().complete("apply_dom0", "digest", UpdateStatus.UPDATES_OK)
+    checkpoint = Checkpoint.load()
+    assert checkpoint.completed("apply_dom0", lambda: "other digest") is None
+    assert checkpoint.completed("apply_dom0", lambda: None) is None
+
+
+def test_checkpoint_unknown_inputs_not_recorded():
+    Checkpoint.load().complete("dom0", None, UpdateStatus.UPDATES_OK)
+    assert Checkpoint.load().phases == {}
+
+
+def test_checkpoint_templates():
+    """
+    When templates were updated during an incomplete run
+    Then only the successful ones are considered complete
+      And only while their package sources are unchanged
+    """
+    Checkpoint.load().complete_templates(
+        {"sd-large": UpdateStatus.UPDATES_OK, "sd-small": UpdateStatus.UPDATES_FAILED}
+    )
+    assert Checkpoint.load().completed_templates() == {"sd-large"}
+
+    with mock.patch("sdw_updater.Updater._get_template_fingerprint", return_value="changed"):
+        assert Checkpoint.load().completed_templates() == set()
+
+
+@pytest.mark.parametrize(("uptime", "expected"), [(1, UpdateStatus.UPDATES_OK), (3, None)])
+def test_checkpoint_reboot_required(uptime, expected):
+    """
+    When dom0 updates that require a reboot were applied an hour ago
+    Then the reboot is still required, unless dom0 has rebooted since
+    """
+    checkpoint = Checkpoint.load()
+    checkpoint.complete("dom0", "rpmdb:1", UpdateStatus.REBOOT_REQUIRED)
+    checkpoint.phases["dom0"]["completed"] = (datetime.now() - timedelta(hours=2)).strftime(
+        DATE_FORMAT
+    )
+    with mock.patch("sdw_updater.Updater._get_uptime", return_value=timedelta(hours=uptime)):
+        status = checkpoint.completed("dom0", lambda: "rpmdb:1")
+    assert status == (expected or UpdateStatus.REBOOT_REQUIRED)
+
+
+def test_checkpoint_too_old():
+    checkpoint = Checkpoint.Checkpoint(
+        started=(datetime.now() - Checkpoint.CHECKPOINT_MAX_AGE).strftime(DATE_FORMAT)
+    )
+    checkpoint.complete("dom0", "rpmdb:1", UpdateStatus.UPDATES_OK)
+    assert Checkpoint.load().phases == {}
+
+
+def test_checkpoint_unreadable():
+    checkpoint_file = get_dom0_path(Checkpoint.CHECKPOINT_FILE)
+    Checkpoint.load().complete("dom0", "rpmdb:1", UpdateStatus.UPDATES_OK)
+    with open(checkpoint_file, "w") as f:
+        json.dump({"phases": {}}, f)
+    assert Checkpoint.load().phases == {}
+
+
+def test_checkpoint_clear():
+    Checkpoint.load().complete("dom0", "rpmdb:1", UpdateStatus.UPDATES_OK)
+    Checkpoint.clear()
+    assert Checkpoint.load().phases == {}
+    Checkpoint.clear()
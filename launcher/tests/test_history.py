@@ -0,0 +1,182 @@
+import json
+from unittest import mock
+
+import pytest
+
+from sdw_updater import History, Updater
+from sdw_updater.Updater import UpdateStatus
+
+RESULTS_OK = {
+    "dom0": UpdateStatus.UPDATES_OK,
+    "apply_dom0": UpdateStatus.UPDATES_OK,
+    "apply_all": UpdateStatus.UPDATES_OK,
+    "templates": UpdateStatus.UPDATES_OK,
+}
+
+
+def _record_run(phases, templates, results=RESULTS_OK):
+    record = History.RunRecord()
+    record.phases.update(phases)
+    record.templates.update(templates)
+    History.record_run(record, results)
+
+
+def test_record_run():
+    """
+    When a run is recorded
+    Then its results and timings are appended to the history file
+    """
+    record = History.RunRecord()
+    with record.phase("templates"):
+        record.templates["sd-app"] = 12.34
+    History.record_run(record, RESULTS_OK)
+
+    [run] = History.read_history()
+    assert run["results"]["templates"] == UpdateStatus.UPDATES_OK.value
+    assert run["templates"] == {"sd-app": 12.3}
+    assert "templates" in run["phases"]
+    assert run["started"] <= run["finished"]
+
+
+def test_record_run_retention():
+    with mock.patch("sdw_updater.History.MAX_HISTORY_RUNS", 3):
+        for duration in range(5):
+            _record_run({"dom0_apply": duration}, {})
+
+    runs = History.read_history()
+    assert [run["phases"]["dom0_apply"] for run in runs] == [2, 3, 4]
+
+
+def test_read_history_skips_unreadable_lines():
+    _record_run({"dom0_apply": 1}, {})
+    with open(Updater.get_dom0_path(History.HISTORY_FILE), "a") as f:
+        f.write('{"truncated": \n')
+    _record_run({"dom0_apply": 2}, {})
+
+    assert len(History.read_history()) == 2
+
+
+@pytest.mark.parametrize(
+    ("percent", "expected"),
+    [(0, 1), (50, 5), (90, 9), (100, 10)],
+)
+def test_percentile(percent, expected):
+    assert History.percentile([10, 1, 2, 3, 4, 5, 6, 7, 8, 9], percent) == expected
+
+
+def test_format_stats_empty():
+    assert History.format_stats([]) == "No updater runs recorded yet."
+
+
+def test_format_stats():
+    """
+    When runs have been recorded
+    Then every phase and template is summarized
+      And the trend compares the most recent runs with earlier ones
+    """
+    for _ in range(History.RECENT_RUNS):
+        _record_run({"dom0_apply": 10, "templates": 600}, {"sd-app": 300})
+    for _ in range(History.RECENT_RUNS):
+        _record_run({"dom0_apply": 20, "templates": 600}, {"sd-app": 300})
+    _record_run({"dom0_apply": 20}, {}, results={"dom0": UpdateStatus.UPDATES_FAILED})
+
+    stats = History.format_stats(History.read_history())
+    lines = {line.split()[0]: line.split()[1:] for line in stats.splitlines()[3:]}
+
+    assert stats.startswith(f"{2 * History.RECENT_RUNS + 1} updater runs")
+    assert f"{2 * History.RECENT_RUNS} successful" in stats
+    assert lines["dom0_apply"] == ["21", "20s", "20s", "20s", "+100%"]
+    assert lines["templates"] == ["20", "10m00s", "10m00s", "10m00s", "+0%"]
+    assert lines["sd-app"][0] == "20"
+    assert "apply_all" not in lines
+
+
+def test_history_file_is_json_lines():
+    _record_run({"dom0_apply": 1}, {"sd-app": 2})
+    _record_run({"dom0_apply": 1}, {"sd-app": 2})
+    with open(Updater.get_dom0_path(History.HISTORY_FILE)) as f:
+        assert all(json.loads(line)["templates"] == {"sd-app": 2} for line in f)
+
+
+def _record_concurrency_run(concurrency, templates_duration, results=RESULTS_OK):
+    record = History.RunRecord()
+    record.phases["templates"] = templates_duration
+    record.templates.update({"sd-app": 1, "sd-large": 1})
+    record.template_concurrency.append(concurrency)
+    History.record_run(record, results)
+
+
+def test_best_template_concurrency():
+    """
+    When templates were updated faster at a lower concurrency than at a higher
+    one, over enough successful runs
+    Then the lower concurrency is preferred
+    """
+    for _ in range(History.MIN_CONCURRENCY_RUNS):
+        _record_concurrency_run(2, 400)
+        _record_concurrency_run(4, 600)
+        _record_concurrency_run(1, 800)
+    # Failed runs are not compared
+    _record_concurrency_run(4, 10, results={"templates": UpdateStatus.UPDATES_FAILED})
+
+    assert History.read_history()[0]["template_concurrency"] == 2
+    assert History.best_template_concurrency(History.read_history()) == 2
+
+
+def test_best_template_concurrency_unknown():
+    """
+    When the highest concurrency was fastest, or too few runs were recorded
+    Then no concurrency is preferred
+    """
+    for _ in range(History.MIN_CONCURRENCY_RUNS):
+        _record_concurrency_run(2, 600)
+        _record_concurrency_run(4, 400)
+    _record_concurrency_run(6, 600)
+    _record_run({"templates": 600}, {"sd-app": 300})
+
+    assert History.best_template_concurrency(History.read_history()) is None
+
+
+def test_measure_growth():
+    """
+    When storage usage is measured around the full Salt run and template updates
+    Then the growth of the default pool, and of templates updated successfully,
+      is recorded
+    """
+    record = History.RunRecord()
+    results: dict[str, UpdateStatus] = {}
+    with (
+        mock.patch("sdw_updater.Preflight.get_pool_usage", side_effect=[100, 250]),
+        record.measure_pool_growth("apply_all"),
+    ):
+        pass
+    with (
+        mock.patch(
+            "sdw_updater.Preflight.get_root_volume_usage",
+            side_effect=[{"sd-app": 100, "sd-large": 100}, {"sd-app": 300}],
+        ) as get_usage,
+        record.measure_template_growth(["sd-app", "sd-large"], results),
+    ):
+        results.update({"sd-app": UpdateStatus.UPDATES_OK, "sd-large": UpdateStatus.UPDATES_FAILED})
+    get_usage.assert_called_with(["sd-app"])
+    History.record_run(record, RESULTS_OK)
+
+    [run] = History.read_history()
+    assert run["pool_growth"] == {"apply_all": 150}
+    assert run["template_growth"] == {"sd-app": 200}
+
+
+def test_expected_growth():
+    for growth in range(1, 11):
+        record = History.RunRecord()
+        record.template_growth["sd-app"] = growth * 100
+        record.pool_growth["apply_all"] = growth * 1000
+        History.record_run(record, RESULTS_OK)
+    # Runs recorded by earlier versions
+    _record_run({}, {})
+
+    runs = History.read_history()
+    assert History.expected_template_growth(runs) == {"sd-app": 900}
+    assert History.expected_pool_growth(runs, "apply_all") == 9000
+    assert History.expected_pool_growth(runs, "templates") is None
+    assert History.expected_template_growth([]) == {}
@@ -0,0 +1,231 @@
+import subprocess
+import threading
+import time
+from unittest import mock
+
+from sdw_updater import Inbox
+
+
+def _fake_qvm(delay=0.0, failing=(), stuck=()):
+    """
+    Returns a side effect for `subprocess.run` that records the qvm-* calls
+    made, taking `delay` seconds to start each qube, failing for the qubes in
+    `failing`, and timing out for those in `stuck`.
+    """
+    calls = []
+    lock = threading.Lock()
+
+    def run(cmd, *args, **kwargs):
+        with lock:
+            calls.append(cmd)
+        if cmd[0] == "qvm-start":
+            assert kwargs["timeout"] == Inbox.QUBE_START_TIMEOUT
+            time.sleep(delay)
+            if cmd[-1] in failing:
+                raise subprocess.CalledProcessError(1, cmd)
+            if cmd[-1] in stuck:
+                raise subprocess.TimeoutExpired(cmd, kwargs["timeout"])
+        return subprocess.CompletedProcess(cmd, 0)
+
+    return run, calls
+
+
+def _started(calls):
+    return [cmd[-1] for cmd in calls if cmd[0] == "qvm-start"]
+
+
+@mock.patch("sdw_updater.Inbox.sdlog")
+def test_launch(mocked_log):
+    """
+    When the inbox is launched
+    Then sd-log is started before the qubes that depend on it
+      And the inbox is launched once sd-app is ready
+      And the time-to-inbox is logged
+    """
+    run, calls = _fake_qvm()
+    with mock.patch("subprocess.run", side_effect=run):
+        assert Inbox.launch()
+
+    assert _started(calls)[0] == "sd-log"
+    assert sorted(_started(calls)) == sorted(Inbox.INBOX_QUBE_DEPENDENCIES)
+    launch_cmd = ["qvm-run", "--no-autostart", "sd-app", Inbox.INBOX_LAUNCH_CMD]
+    assert calls.index(launch_cmd) > calls.index(
+        ["qvm-run", "--no-autostart", "--no-gui", "--pass-io", "--quiet", "sd-app", "true"]
+    )
+    messages = [call.args[0] for call in mocked_log.info.call_args_list]
+    assert any(message.startswith("SecureDrop Inbox launched in") for message in messages)
+    assert any(message.startswith("Time until qubes were ready: sd-log") for message in messages)
+    assert not mocked_log.error.called
+
+
+@mock.patch("sdw_updater.Inbox.sdlog")
+def test_launch_parallel(mocked_log):
+    """
+    When qubes take a while to start
+    Then qubes that do not depend on each other are started in parallel
+    """
+    run, _ = _fake_qvm(delay=0.2)
+    start = time.monotonic()
+    with mock.patch("subprocess.run", side_effect=run):
+        assert Inbox.launch()
+    # sd-log, then sd-gpg, sd-proxy and sd-app in parallel
+    assert time.monotonic() - start < 0.2 * len(Inbox.INBOX_QUBE_DEPENDENCIES) - 0.1
+
+
+@mock.patch("sdw_updater.Inbox.sdlog")
+def test_launch_inbox_qube_fails(mocked_log):
+    run, calls = _fake_qvm(failing=["sd-app"])
+    with mock.patch("subprocess.run", side_effect=run):
+        assert not Inbox.launch()
+
+    assert not any(Inbox.INBOX_LAUNCH_CMD in cmd for cmd in calls)
+    assert mocked_log.error.call_args_list[0] == mock.call("Error starting sd-app")
+    messages = [call.args[0] for call in mocked_log.info.call_args_list]
+    assert any("sd-app failed" in message for message in messages)
+
+
+@mock.patch("sdw_updater.Inbox.sdlog")
+def test_launch_dependency_fails(mocked_log):
+    """
+    When a qube the others depend on fails to start
+    Then the other qubes are still started
+      And the inbox is still launched
+    """
+    run, calls = _fake_qvm(failing=["sd-log"])
+    with mock.patch("subprocess.run", side_effect=run):
+        assert Inbox.launch()
+    assert sorted(_started(calls)) == sorted(Inbox.INBOX_QUBE_DEPENDENCIES)
+
+
+@mock.patch("sdw_updater.Inbox.sdlog")
+def test_launch_qube_start_times_out(mocked_log):
+    """
+    When a qube does not finish starting in time
+    Then the launch does not hang
+      And the inbox is not launched if that qube is sd-app
+    """
+    run, calls = _fake_qvm(stuck=["sd-app"])
+    with mock.patch("subprocess.run", side_effect=run):
+        assert not Inbox.launch()
+    assert not any(Inbox.INBOX_LAUNCH_CMD in cmd for cmd in calls)
+    assert mocked_log.error.call_args_list[0] == mock.call("Error starting sd-app")
+
+
+@mock.patch("sdw_updater.Inbox.sdlog")
+def test_launch_waits_for_warmup(mocked_log):
+    """
+    When sd-proxy is being started ahead of launching the inbox
+    Then the launch waits for that start to finish before starting sd-proxy
+    """
+    run, calls = _fake_qvm()
+    warmup = mock.Mock(qube="sd-proxy")
+    warmup.wait.side_effect = lambda: calls.append(["warmup finished"])
+    with mock.patch("subprocess.run", side_effect=run):
+        assert Inbox.launch(warmup)
+    warmup.wait.assert_called_once_with()
+    assert calls.index(["warmup finished"]) < calls.index(
+        ["qvm-start", "--skip-if-running", "sd-proxy"]
+    )
+
+
+@mock.patch("sdw_updater.Inbox.sdlog")
+@mock.patch("subprocess.run", side_effect=FileNotFoundError("qvm-start"))
+def test_launch_not_on_qubes(mocked_run, mocked_log):
+    assert not Inbox.launch()
+    mocked_log.error.assert_any_call("Error starting sd-app")
+
+
+def _fake_warmup_qvm(running=False):
+    """
+    Returns a side effect for `subprocess.run` for a warm-up, and an event set
+    by `qvm-start` once it is called, which waits until `release` is set.
+    """
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def run(cmd, *args, **kwargs):
+        calls.append(cmd)
+        if cmd[0] == "qvm-check":
+            return subprocess.CompletedProcess(cmd, 0 if running else 1)
+        if cmd[0] == "qvm-start":
+            assert kwargs["timeout"] == Inbox.QUBE_START_TIMEOUT
+            started.set()
+            if not release.wait(min(kwargs["timeout"], 5)):
+                raise subprocess.TimeoutExpired(cmd, kwargs["timeout"])
+        return subprocess.CompletedProcess(cmd, 0)
+
+    return run, calls, started, release
+
+
+@mock.patch("sdw_updater.Inbox.sdlog")
+def test_warmup(mocked_log):
+    run, calls, _, release = _fake_warmup_qvm()
+    release.set()
+    with mock.patch("subprocess.run", side_effect=run):
+        warmup = Inbox.QubeWarmup()
+        warmup.start()
+        warmup.wait()
+    assert ["qvm-start", "--skip-if-running", "sd-proxy"] in calls
+    assert not any(cmd[0] == "qvm-shutdown" for cmd in calls)
+    # The launcher can exit while the qube is still starting
+    assert warmup._thread.daemon
+
+
+@mock.patch("sdw_updater.Inbox.sdlog")
+def test_warmup_times_out(mocked_log):
+    run, calls, _, _ = _fake_warmup_qvm()
+    with (
+        mock.patch("subprocess.run", side_effect=run),
+        mock.patch("sdw_updater.Inbox.QUBE_START_TIMEOUT", 0.1),
+    ):
+        warmup = Inbox.QubeWarmup()
+        warmup.start()
+        warmup.wait()
+    mocked_log.error.assert_any_call("Error starting sd-proxy ahead of launching the inbox")
+
+
+@mock.patch("sdw_updater.Inbox.sdlog")
+def test_warmup_cancelled_while_starting(mocked_log):
+    """
+    When the warm-up is cancelled while the qube is starting
+    Then cancelling does not wait for the qube to start
+      And the qube is shut down once it has started
+    """
+    run, calls, started, release = _fake_warmup_qvm()
+    with mock.patch("subprocess.run", side_effect=run):
+        warmup = Inbox.QubeWarmup()
+        warmup.start()
+        assert started.wait(5)
+        warmup.cancel()
+        assert not any(cmd[0] == "qvm-shutdown" for cmd in calls)
+        release.set()
+        warmup._thread.join()
+    assert calls[-1] == ["qvm-shutdown", "sd-proxy"]
+
+
+@mock.patch("sdw_updater.Inbox.sdlog")
+def test_warmup_cancelled_after_start(mocked_log):
+    run, calls, _, release = _fake_warmup_qvm()
+    release.set()
+    with mock.patch("subprocess.run", side_effect=run):
+        warmup = Inbox.QubeWarmup()
+        warmup.start()
+        warmup._thread.join()
+        warmup.cancel()
+    assert calls[-1] == ["qvm-shutdown", "sd-proxy"]
+
+
+@mock.patch("sdw_updater.Inbox.sdlog")
+def test_warmup_already_running(mocked_log):
+    """
+    When the qube was already running
+    Then cancelling the warm-up leaves it running
+    """
+    run, calls, _, _ = _fake_warmup_qvm(running=True)
+    with mock.patch("subprocess.run", side_effect=run):
+        warmup = Inbox.QubeWarmup()
+        warmup.start()
+        warmup._thread.join()
+        warmup.cancel()
+    assert [cmd[0] for cmd in calls] == ["qvm-check"]
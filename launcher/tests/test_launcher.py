@@ -0,0 +1,248 @@
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from sdw_updater import Updater
+from sdw_updater.Updater import UpdateStatus
+from sdw_util import Util
+
+LAUNCHER_DIR = Path(__file__).parent.parent
+LAUNCHER_SCRIPT = LAUNCHER_DIR.parent / "files" / "sdw-updater.py"
+
+# Modules that are slow to import, and not needed to launch the inbox
+HEAVY_MODULES = ["PyQt5", "PyQt6", "dnf", "qubesadmin"]
+
+# Runs the launcher script, then reports how long it took and which heavy
+# modules it imported
+BENCHMARK_DRIVER = """
+import json, os, runpy, sys, time
+start = time.perf_counter()
+sys.argv = [os.environ["LAUNCHER_SCRIPT"]]
+from sdw_util import Util
+from sdw_updater import Updater
+Util.LOCK_DIRECTORY = os.environ["LOCK_DIRECTORY"]
+Updater.RPMDB_PATHS = [os.environ["RPMDB_PATH"]]
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+except SystemExit as e:
+    exit_code = e.code
+print(json.dumps({
+    "exit_code": exit_code,
+    "elapsed": time.perf_counter() - start,
+    "modules": [m for m in json.loads(os.environ["HEAVY_MODULES"]) if m in sys.modules],
+}))
+"""
+
+
+@pytest.fixture
+def launcher():
+    spec = importlib.util.spec_from_file_location("sdw_updater_launcher", LAUNCHER_SCRIPT)
+    assert spec is not None
+    assert spec.loader is not None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    with (
+        mock.patch("sdw_util.Util.configure_logging"),
+        mock.patch("sdw_util.Util.obtain_lock", return_value=mock.Mock()),
+    ):
+        yield module
+
+
+@pytest.fixture
+def rpmdb(tmp_path):
+    """
+    A fake RPM database, last modified before the update status is written
+    """
+    rpmdb = tmp_path / "rpmdb.sqlite"
+    rpmdb.touch()
+    os.utime(rpmdb, (time.time() - 60, time.time() - 60))
+    with mock.patch("sdw_updater.Updater.RPMDB_PATHS", [str(rpmdb)]):
+        yield rpmdb
+
+
+@mock.patch("sdw_updater.Inbox.QubeWarmup")
+@mock.patch("sdw_updater.Updater.is_qubes_mid_upgrade")
+@mock.patch("sdw_updater.Inbox.launch")
+def test_launcher_fast_path(launch_inbox, mid_upgrade, warmup, launcher, rpmdb):
+    """
+    When updates are current
+     And dom0 packages have not changed since
+    Then sd-proxy is started ahead of the inbox
+     And the inbox is launched without checking for an in-place upgrade
+    """
+    Updater._write_updates_status_flag_to_disk(UpdateStatus.UPDATES_OK)
+    with pytest.raises(SystemExit) as e:
+        launcher.main([])
+    assert e.value.code == 0
+    assert not mid_upgrade.called
+    launch_inbox.assert_called_once_with(warmup.return_value)
+    warmup.return_value.start.assert_called_once_with()
+    assert not warmup.return_value.cancel.called
+
+
+@mock.patch("sdw_updater.Inbox.QubeWarmup")
+@mock.patch("sdw_updater.Updater.is_qubes_mid_upgrade", return_value=True)
+@mock.patch("sdw_updater.Inbox.launch")
+def test_launcher_mid_upgrade(launch_inbox, mid_upgrade, warmup, launcher, rpmdb):
+    """
+    When updates are current
+     And dom0 packages have changed since, due to an in-place upgrade
+    Then the inbox is not launched
+     And the start of sd-proxy is cancelled
+    """
+    Updater._write_updates_status_flag_to_disk(UpdateStatus.UPDATES_OK)
+    rpmdb.touch()
+    with (
+        mock.patch.object(launcher, "is_qubes_mid_upgrade", mid_upgrade),
+        pytest.raises(SystemExit) as e,
+    ):
+        launcher.main([])
+    assert e.value.code == 0
+    assert mid_upgrade.called
+    assert not launch_inbox.called
+    warmup.return_value.cancel.assert_called_once_with()
+
+
+@mock.patch("sdw_updater.Inbox.QubeWarmup")
+@mock.patch("sdw_updater.Inbox.launch")
+def test_launcher_updates_required(launch_inbox, warmup, launcher, rpmdb):
+    """
+    When updates are required
+    Then sd-proxy is not started ahead of time
+     And the updater checks for an in-place upgrade before launching the GUI
+    """
+    Updater._write_updates_status_flag_to_disk(UpdateStatus.UPDATES_REQUIRED)
+    with (
+        mock.patch.object(launcher, "is_qubes_mid_upgrade", return_value=False) as mid_upgrade,
+        mock.patch.object(launcher, "launch_updater") as launch_updater,
+    ):
+        launcher.main([])
+    assert mid_upgrade.called
+    launch_updater.assert_called_once_with(False)
+    assert not launch_inbox.called
+    assert not warmup.called
+
+
+@mock.patch("sdw_updater.Inbox.QubeWarmup")
+@mock.patch("sdw_updater.Inbox.launch")
+def test_launcher_warmup_cancelled(launch_inbox, warmup, launcher, rpmdb):
+    """
+    When updates are current, so sd-proxy is started ahead of time
+     And the updater is launched nonetheless
+    Then the start of sd-proxy is cancelled
+    """
+    Updater._write_updates_status_flag_to_disk(UpdateStatus.UPDATES_OK)
+    with (
+        mock.patch.object(launcher, "should_launch_updater", return_value=True),
+        mock.patch.object(launcher, "is_qubes_mid_upgrade", return_value=False),
+        mock.patch.object(launcher, "launch_updater") as launch_updater,
+    ):
+        launcher.main([])
+    warmup.return_value.start.assert_called_once_with()
+    warmup.return_value.cancel.assert_called_once_with()
+    assert launch_updater.called
+
+
+@mock.patch("sdw_updater.Inbox.QubeWarmup")
+@mock.patch("sdw_updater.Inbox.launch")
+def test_launcher_during_background_update(launch_inbox, warmup, launcher, rpmdb):
+    """
+    When the launcher is started during a background update
+    Then it takes the updater's lock, cancelling the background update
+     And waits for the background update to stop
+     And launches the inbox
+    """
+    Updater._write_updates_status_flag_to_disk(UpdateStatus.UPDATES_OK)
+    with (
+        mock.patch(
+            "sdw_util.Util.can_obtain_lock",
+            side_effect=lambda basename, log=True: basename != Updater.BACKGROUND_LOCK_FILE,
+        ),
+        mock.patch("sdw_util.Util.wait_for_lock") as wait_for_lock,
+        pytest.raises(SystemExit) as e,
+    ):
+        launcher.main([])
+    assert e.value.code == 0
+    Util.obtain_lock.assert_called_once_with(Updater.LOCK_FILE)
+    wait_for_lock.assert_called_once_with(Updater.BACKGROUND_LOCK_FILE)
+    launch_inbox.assert_called_once_with(warmup.return_value)
+
+
+@pytest.mark.parametrize(
+    ("statuses", "exit_code"), [([], 1), ([{"phase": "dom0"}, {"phase": "templates"}], 0)]
+)
+def test_launcher_status(launcher, capsys, statuses, exit_code):
+    """
+    When the status of the running updater is requested
+    Then each status it serves is printed as JSON
+      And the exit code tells whether an updater is running
+    """
+    with (
+        mock.patch("sdw_updater.StatusServer.subscribe", return_value=iter(statuses)),
+        pytest.raises(SystemExit) as exit_info,
+    ):
+        launcher.main(["--status", "--follow"])
+    assert exit_info.value.code == exit_code
+    assert [json.loads(line) for line in capsys.readouterr().out.splitlines()] == statuses
+
+
+def _total_import_time(importtime_output: str) -> float:
+    """
+    Total time (seconds) spent importing modules, from the output of
+    `python -X importtime`: the sum of cumulative times of top-level imports,
+    whose names are not indented further.
+    """
+    total = 0
+    for line in importtime_output.splitlines():
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            total += int(cumulative)
+    return total / 1e6
+
+
+def test_launcher_benchmark(tmp_path, rpmdb):
+    """
+    Benchmark: launching the inbox when updates are current imports none of
+    the GUI and package manager modules, and completes quickly.
+    """
+    Updater._write_updates_status_flag_to_disk(UpdateStatus.UPDATES_OK)
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for command in ["qvm-check", "qvm-start", "qvm-run"]:
+        (bin_dir / command).write_text("#!/bin/sh\n")
+        (bin_dir / command).chmod(0o755)
+
+    env = dict(
+        os.environ,
+        PATH=f"{bin_dir}:{os.environ['PATH']}",
+        PYTHONPATH=str(LAUNCHER_DIR),
+        LAUNCHER_SCRIPT=str(LAUNCHER_SCRIPT),
+        LOCK_DIRECTORY=str(tmp_path),
+        RPMDB_PATH=str(rpmdb),
+        HEAVY_MODULES=json.dumps(HEAVY_MODULES),
+    )
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", BENCHMARK_DRIVER],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    wall_clock = time.perf_counter() - start
+    result = json.loads(proc.stdout)
+    import_time = _total_import_time(proc.stderr)
+
+    assert result["exit_code"] == 0
+    assert result["modules"] == []
+    assert result["elapsed"] < 5, (
+        f"Inbox launch: {wall_clock:.3f}s wall clock including interpreter startup, "
+        f"{result['elapsed']:.3f}s in launcher, {import_time:.3f}s importing modules"
+    )
@@ -1,15 +1,17 @@
 import datetime
+import json
+import os
 import re
 from unittest import mock
 
 import pytest
 
 from sdw_notify import Notify
-from sdw_updater import Updater
+from sdw_util import State, Util
 
-# Regex for warning log if the last-updated timestamp does not exist (updater
-# has never run)
-NO_TIMESTAMP_REGEX = r"Timestamp file '.*' does not exist."
+# Regex for warning log if no successful update has been recorded (updater has
+# never run)
+NO_TIMESTAMP_REGEX = r"No successful update recorded in '.*'."
 
 # Regex for warning log if we've updated too long ago, and grace period has elapsed
 UPDATER_WARNING_REGEX = (
@@ -29,34 +31,32 @@ NO_WARNING_REGEX = (
     r"Last successful update \(.* hours ago\) is below the warning threshold " r"\(.* hours\)."
 )
 
-# Regex for bad contents in `sdw-last-updated` file
+# Regex for bad contents in the updater state file
 BAD_TIMESTAMP_REGEX = r"Data in .* not in the expected format."
 
 
 @mock.patch("sdw_notify.Notify.sdlog.error")
 @mock.patch("sdw_notify.Notify.sdlog.warning")
 @mock.patch("sdw_notify.Notify.sdlog.info")
-def test_warning_shown_if_updater_never_ran(mocked_info, mocked_warning, mocked_error, tmp_path):
+def test_warning_shown_if_updater_never_ran(mocked_info, mocked_warning, mocked_error):
     """
     Test whether we're correctly going to show a warning if the updater has
     never run.
     """
-    # We're going to look for a nonexistent file in an existing temporary directoryr
-    with mock.patch("sdw_notify.Notify.LAST_UPDATED_FILE", tmp_path / "not-a-file"):
-        warning_should_be_shown = Notify.is_update_check_necessary()
+    warning_should_be_shown = Notify.is_update_check_necessary()
 
-        # No handled errors should occur
-        assert not mocked_error.called
+    # No handled errors should occur
+    assert not mocked_error.called
 
-        # We display a warning, because this file should always exist
-        assert warning_should_be_shown is True
+    # We display a warning, because an update should always have been recorded
+    assert warning_should_be_shown is True
 
-        # A warning should also be logged
-        mocked_warning.assert_called_once()
+    # A warning should also be logged
+    mocked_warning.assert_called_once()
 
-        # Ensure warning matches expected output
-        warning_string = mocked_warning.call_args[0][0]
-        assert re.search(NO_TIMESTAMP_REGEX, warning_string) is not None
+    # Ensure warning matches expected output
+    warning_string = mocked_warning.call_args[0][0]
+    assert re.search(NO_TIMESTAMP_REGEX, warning_string) is not None
 
 
 @pytest.mark.parametrize(
@@ -67,7 +67,7 @@ def test_warning_shown_if_updater_never_ran(mocked_info, mocked_warning, mocked_
 @mock.patch("sdw_notify.Notify.sdlog.warning")
 @mock.patch("sdw_notify.Notify.sdlog.info")
 def test_warning_shown_if_warning_threshold_exceeded(
-    mocked_info, mocked_warning, mocked_error, tmp_path, uptime, warning_expected
+    mocked_info, mocked_warning, mocked_error, uptime, warning_expected
 ):
     """
     Primary use case for the notifier: are we showing the warning if the
@@ -75,70 +75,90 @@ def test_warning_shown_if_warning_threshold_exceeded(
     threshold? Expected result varies based on whether system uptime exceeds
     a grace period (for the user to launch the app on their own).
     """
-    with mock.patch("sdw_notify.Notify.LAST_UPDATED_FILE", tmp_path / "sdw-last-updated"):
-        # Write a "last successfully updated" date well in the past for check
-        historic_date = datetime.date(2013, 6, 5).strftime(Updater.DATE_FORMAT)
-        with open(Notify.LAST_UPDATED_FILE, "w") as f:
-            f.write(historic_date)
-
-        with mock.patch("sdw_notify.Notify.get_uptime_seconds") as mocked_uptime:
-            mocked_uptime.return_value = uptime
-            warning_should_be_shown = Notify.is_update_check_necessary()
-        assert warning_should_be_shown is warning_expected
-        # No handled errors should occur
-        assert not mocked_error.called
-        # A warning should also be logged
-        if warning_expected is True:
-            mocked_warning.assert_called_once()
-            warning_string = mocked_warning.call_args[0][0]
-            assert re.search(UPDATER_WARNING_REGEX, warning_string) is not None
-        else:
-            assert not mocked_warning.called
-            mocked_info.assert_called_once()
-            info_string = mocked_info.call_args[0][0]
-            assert re.search(GRACE_PERIOD_REGEX, info_string) is not None
+    # Record a "last successfully updated" date well in the past for check
+    State.write(State.UpdaterState(last_updated=datetime.datetime(2013, 6, 5)))
+
+    with mock.patch("sdw_notify.Notify.get_uptime_seconds") as mocked_uptime:
+        mocked_uptime.return_value = uptime
+        warning_should_be_shown = Notify.is_update_check_necessary()
+    assert warning_should_be_shown is warning_expected
+    # No handled errors should occur
+    assert not mocked_error.called
+    # A warning should also be logged
+    if warning_expected is True:
+        mocked_warning.assert_called_once()
+        warning_string = mocked_warning.call_args[0][0]
+        assert re.search(UPDATER_WARNING_REGEX, warning_string) is not None
+    else:
+        assert not mocked_warning.called
+        mocked_info.assert_called_once()
+        info_string = mocked_info.call_args[0][0]
+        assert re.search(GRACE_PERIOD_REGEX, info_string) is not None
 
 
 @mock.patch("sdw_notify.Notify.sdlog.error")
 @mock.patch("sdw_notify.Notify.sdlog.warning")
 @mock.patch("sdw_notify.Notify.sdlog.info")
 def test_warning_not_shown_if_warning_threshold_not_exceeded(
-    mocked_info, mocked_warning, mocked_error, tmp_path
+    mocked_info, mocked_warning, mocked_error
 ):
     """
     Another high priority case: we don't want to warn the user if they've
     recently run the updater successfully.
     """
-    with mock.patch("sdw_notify.Notify.LAST_UPDATED_FILE", tmp_path / "sdw-last-updated"):
-        # Write current timestamp into the file
-        just_now = datetime.datetime.now().strftime(Updater.DATE_FORMAT)
-        with open(Notify.LAST_UPDATED_FILE, "w") as f:
-            f.write(just_now)
-        warning_should_be_shown = Notify.is_update_check_necessary()
-        assert warning_should_be_shown is False
-        assert not mocked_error.called
-        assert not mocked_warning.called
-        info_string = mocked_info.call_args[0][0]
-        assert re.search(NO_WARNING_REGEX, info_string) is not None
+    # Record the current time as the last update
+    State.write_last_updated()
+    warning_should_be_shown = Notify.is_update_check_necessary()
+    assert warning_should_be_shown is False
+    assert not mocked_error.called
+    assert not mocked_warning.called
+    info_string = mocked_info.call_args[0][0]
+    assert re.search(NO_WARNING_REGEX, info_string) is not None
 
 
-@mock.patch("sdw_notify.Notify.sdlog.error")
 @mock.patch("sdw_notify.Notify.sdlog.warning")
 @mock.patch("sdw_notify.Notify.sdlog.info")
-def test_corrupt_timestamp_file_handled(mocked_info, mocked_warning, mocked_error, tmp_path):
+def test_last_updated_migrated_from_legacy_file(mocked_info, mocked_warning):
     """
-    The LAST_UPDATED_FILE must contain a timestamp in a specified format;
-    if it doesn't, we show the warning and log the error.
+    The time of the last update, as written by earlier versions of the
+    updater, is still honored.
     """
-    with mock.patch("sdw_notify.Notify.LAST_UPDATED_FILE", tmp_path / "sdw-last-updated"):
-        with open(Notify.LAST_UPDATED_FILE, "w") as f:
-            # With apologies to HAL 9000
-            f.write("daisy, daisy, give me your answer do")
-        warning_should_be_shown = Notify.is_update_check_necessary()
-        assert warning_should_be_shown is True
-        mocked_error.assert_called_once()
-        error_string = mocked_error.call_args[0][0]
-        assert re.search(BAD_TIMESTAMP_REGEX, error_string) is not None
+    legacy_file = State.get_state_path(State.LEGACY_LAST_UPDATED_FILE)
+    os.makedirs(os.path.dirname(legacy_file))
+    with open(legacy_file, "w") as f:
+        f.write(datetime.datetime.now().strftime(Util.DATE_FORMAT))
+
+    assert Notify.is_update_check_necessary() is False
+    assert not mocked_warning.called
+    assert not os.path.exists(legacy_file)
+
+
+@mock.patch("sdw_util.State.sdlog.error")
+@mock.patch("sdw_notify.Notify.sdlog.warning")
+@mock.patch("sdw_notify.Notify.sdlog.info")
+def test_corrupt_timestamp_file_handled(mocked_info, mocked_warning, mocked_error):
+    """
+    The state file must contain a timestamp in a specified format; if it
+    doesn't, we show the warning and log the error.
+    """
+    state_file = State.get_state_path()
+    os.makedirs(os.path.dirname(state_file))
+    with open(state_file, "w") as f:
+        # With apologies to HAL 9000
+        json.dump(
+            {
+                "version": State.STATE_VERSION,
+                "status": None,
+                "status_updated": None,
+                "last_updated": "daisy, daisy, give me your answer do",
+            },
+            f,
+        )
+    warning_should_be_shown = Notify.is_update_check_necessary()
+    assert warning_should_be_shown is True
+    mocked_error.assert_called_once()
+    error_string = mocked_error.call_args[0][0]
+    assert re.search(BAD_TIMESTAMP_REGEX, error_string) is not None
 
 
 def test_uptime_is_sane():
@@ -0,0 +1,206 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from sdw_updater import Pipeline
+from sdw_updater.Updater import UpdateStatus
+
+
+@pytest.fixture
+def successful_update():
+    with (
+        mock.patch("sdw_updater.Preflight.get_pool_free_space", return_value=None),
+        mock.patch("sdw_updater.Updater.apply_updates_dom0", return_value=UpdateStatus.UPDATES_OK),
+        mock.patch("sdw_updater.Updater.apply_dom0_state", return_value=UpdateStatus.UPDATES_OK),
+        mock.patch("sdw_updater.Updater.migration_is_required", return_value=False),
+        mock.patch(
+            "sdw_updater.Updater.apply_updates_templates", return_value=UpdateStatus.UPDATES_OK
+        ),
+    ):
+        yield
+
+
+def test_pipeline_run(successful_update):
+    """
+    When all phases succeed
+    Then the update status and date are written to disk
+      And the overall status is recommended
+    """
+    with (
+        mock.patch("sdw_updater.Updater._write_updates_status_flag_to_disk") as write_status,
+        mock.patch("sdw_updater.Updater._write_last_updated_flags_to_disk") as write_updated,
+    ):
+        results = Pipeline.UpdatePipeline().run()
+
+    assert results["recommended_action"] == UpdateStatus.UPDATES_OK
+    assert results["templates"] == UpdateStatus.UPDATES_OK
+    write_status.assert_called_once_with(UpdateStatus.UPDATES_OK)
+    assert write_updated.called
+
+
+def test_pipeline_status(successful_update):
+    """
+    When the pipeline runs
+    Then its phases, progress and result are recorded in its status
+    """
+    with (
+        mock.patch("sdw_updater.Updater._write_updates_status_flag_to_disk"),
+        mock.patch("sdw_updater.Updater._write_last_updated_flags_to_disk"),
+        mock.patch("sdw_updater.StatusServer.StatusServer.start") as start,
+    ):
+        pipeline = Pipeline.UpdatePipeline(serve_status=True)
+        pipeline.run()
+
+    start.assert_called_once()
+    status = pipeline.status.snapshot()[1]
+    assert status["phase"] == "templates"
+    assert status["result"] == {
+        "status": UpdateStatus.UPDATES_OK.value,
+        "results": dict.fromkeys(
+            ["dom0", "apply_dom0", "apply_all", "templates"], UpdateStatus.UPDATES_OK.value
+        ),
+    }
+
+
+def test_pipeline_run_templates(successful_update):
+    """
+    When only the template phase is run
+    Then no other phase runs
+      And the update status is left to the caller
+    """
+    with (
+        mock.patch("sdw_updater.Updater._write_updates_status_flag_to_disk") as write_status,
+        mock.patch("sdw_updater.History.record_run") as record_run,
+    ):
+        pipeline = Pipeline.UpdatePipeline()
+        assert pipeline.run_templates() == UpdateStatus.UPDATES_OK
+
+    assert not Pipeline.Updater.apply_updates_dom0.called
+    assert not write_status.called
+    assert not record_run.called
+    assert pipeline.status.snapshot()[1]["result"] == {
+        "status": UpdateStatus.UPDATES_OK.value,
+        "results": {"templates": UpdateStatus.UPDATES_OK.value},
+    }
+
+
+@pytest.fixture
+def checkpoint_inputs():
+    with (
+        mock.patch("sdw_updater.Updater.get_dom0_packages_key", return_value="rpmdb:1"),
+        mock.patch("sdw_updater.Updater._get_dom0_state_digest", return_value="digest"),
+        mock.patch("sdw_updater.Updater._get_template_fingerprint", return_value="sources"),
+        mock.patch("sdw_updater.Updater._write_updates_status_flag_to_disk"),
+        mock.patch("sdw_updater.Updater._write_last_updated_flags_to_disk"),
+        mock.patch("sdw_updater.Updater.migration_is_required", return_value=False),
+    ):
+        yield
+
+
+def test_pipeline_resumes_after_failure(checkpoint_inputs):
+    """
+    When the dom0 state fails to apply after dom0 updates were applied
+    Then the next run resumes with the dom0 state
+    """
+    with (
+        mock.patch(
+            "sdw_updater.Updater.apply_updates_dom0", return_value=UpdateStatus.UPDATES_OK
+        ) as apply_updates_dom0,
+        mock.patch(
+            "sdw_updater.Updater.apply_dom0_state",
+            side_effect=[UpdateStatus.UPDATES_FAILED] + [UpdateStatus.UPDATES_OK] * 2,
+        ) as apply_dom0_state,
+        mock.patch(
+            "sdw_updater.Updater.apply_updates_templates", return_value=UpdateStatus.UPDATES_OK
+        ),
+    ):
+        results = Pipeline.UpdatePipeline().run()
+        assert results["recommended_action"] == UpdateStatus.UPDATES_FAILED
+
+        results = Pipeline.UpdatePipeline().run()
+        assert results["recommended_action"] == UpdateStatus.UPDATES_OK
+        assert results["dom0"] == UpdateStatus.UPDATES_OK
+        assert apply_updates_dom0.call_count == 1
+        assert apply_dom0_state.call_count == 2
+
+        # The run completed, so the next one starts over
+        Pipeline.UpdatePipeline().run()
+        assert apply_updates_dom0.call_count == 2
+
+
+def test_pipeline_retries_failed_templates(checkpoint_inputs):
+    """
+    When some templates fail to update
+    Then the next run only updates those templates
+    """
+
+    def apply_updates_templates(*args, completed, results, **kwargs):
+        results.update(
+            {
+                "fedora-41": UpdateStatus.UPDATES_OK,
+                "sd-large": UpdateStatus.UPDATES_FAILED,
+            }
+        )
+        return UpdateStatus.UPDATES_FAILED
+
+    with (
+        mock.patch("sdw_updater.Updater.apply_updates_dom0", return_value=UpdateStatus.UPDATES_OK),
+        mock.patch("sdw_updater.Updater.apply_dom0_state", return_value=UpdateStatus.UPDATES_OK),
+        mock.patch(
+            "sdw_updater.Updater.apply_updates_templates", side_effect=apply_updates_templates
+        ) as apply_templates,
+    ):
+        Pipeline.UpdatePipeline().run()
+        Pipeline.UpdatePipeline().run()
+
+    assert apply_templates.call_args_list[0].kwargs["completed"] == set()
+    assert apply_templates.call_args_list[1].kwargs["completed"] == {"fedora-41"}
+
+
+def test_pipeline_does_not_import_qt():
+    """
+    Headless mode must run without PyQt and a display
+    """
+    code = (
+        "import sys; from sdw_updater import Pipeline; "
+        "sys.exit(any(m.startswith(('PyQt5', 'PyQt6')) for m in sys.modules))"
+    )
+    subprocess.check_call([sys.executable, "-c", code], cwd=Path(__file__).parent.parent)
+
+
+@mock.patch("sdw_updater.Updater._write_updates_status_flag_to_disk")
+@mock.patch("sdw_updater.Updater._write_last_updated_flags_to_disk")
+def test_run_headless(write_updated, write_status, successful_update, capsys):
+    """
+    When updates are run headless
+    Then each phase, progress and the result are written to stdout as JSON lines
+      And the overall status is returned as exit code
+    """
+    assert Pipeline.run_headless(should_skip_netcheck=True) == 0
+
+    events = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [event["phase"] for event in events if event["event"] == "phase"] == [
+        "dom0",
+        "apply_dom0",
+        "templates",
+    ]
+    assert any(event["event"] == "progress" for event in events)
+    assert events[-1]["event"] == "result"
+    assert events[-1]["status"] == UpdateStatus.UPDATES_OK.value
+    assert events[-1]["results"]["apply_all"] == UpdateStatus.UPDATES_OK.value
+
+
+@mock.patch("sdw_updater.Preflight.is_netcheck_successful", return_value=False)
+@mock.patch("sdw_updater.Preflight.get_pool_free_space", return_value=None)
+@mock.patch("sdw_updater.Updater.apply_updates_dom0")
+def test_run_headless_no_network(apply_updates_dom0, pool_space, netcheck, capsys):
+    assert Pipeline.run_headless() == int(UpdateStatus.UPDATES_FAILED.value)
+    assert not apply_updates_dom0.called
+
+    [event] = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert event["event"] == "result"
+    assert event["error"] == "network"
@@ -0,0 +1,169 @@
+import time
+from unittest import mock
+
+import pytest
+
+from sdw_updater import Preflight
+
+
+@mock.patch("sdw_util.Util.get_qubes_version", return_value="4.1")
+@mock.patch("sdw_updater.Preflight.subprocess.check_output", return_value=b"none")
+def test_netcheck_no_network_should_fail(mocked_output, mocked_qubes_version):
+    """
+    When the host machine has no network connectivity
+    Then the error is logged
+     And netcheck returns False
+    """
+    assert not Preflight.is_netcheck_successful()
+
+
+@mock.patch("sdw_util.Util.get_qubes_version", return_value=None)
+@mock.patch("sdw_updater.Preflight.logger.error")
+def test_netcheck_no_qubes_should_fail_with_error(mocked_error, mocked_qubes_version):
+    """
+    When the network connectivity check is run outside of Qubes
+    Then the check should return not succeed
+     And an error should be logged
+    """
+    assert not Preflight.is_netcheck_successful()
+    assert mocked_error.called
+
+
+@mock.patch("subprocess.check_output", return_value=b"full")
+@mock.patch("sdw_util.Util.get_qubes_version", return_value="4.1")
+def test_netcheck_should_succeed(mocked_qubes_version, mocked_output):
+    """
+    When the network connectivity check is run in Qubes
+     And nmcli detects a connection
+    Then the network check should succeed
+    """
+    assert Preflight.is_netcheck_successful()
+
+
+@pytest.fixture
+def slow_checks():
+    """
+    Network and storage pool checks that each take a while
+    """
+
+    def slow(result):
+        def check():
+            time.sleep(0.3)
+            return result
+
+        return check
+
+    with (
+        mock.patch(
+            "sdw_updater.Preflight.is_netcheck_successful", side_effect=slow(True)
+        ) as netcheck,
+        mock.patch(
+            "sdw_updater.Preflight.get_pool_free_space", side_effect=slow(20 * 1024**3)
+        ) as pool_space,
+    ):
+        yield netcheck, pool_space
+
+
+def test_run_preflight_concurrently(slow_checks):
+    """
+    When pre-flight checks are run
+    Then they run concurrently
+      And their results are combined
+    """
+    start = time.monotonic()
+    result = Preflight.run_preflight()
+    assert time.monotonic() - start < 0.5
+
+    assert result.should_update
+    assert result.network_ok
+    assert result.pool_free_space == 20 * 1024**3
+
+
+def test_run_preflight_skip_netcheck(slow_checks):
+    netcheck, _ = slow_checks
+    result = Preflight.run_preflight(should_skip_netcheck=True)
+    assert result.should_update
+    assert result.network_ok is None
+    assert not netcheck.called
+
+
+def test_run_preflight_no_network(slow_checks):
+    netcheck, _ = slow_checks
+    netcheck.side_effect = None
+    netcheck.return_value = False
+    assert not Preflight.run_preflight().should_update
+
+
+@mock.patch("sdw_updater.Preflight.logger.warning")
+def test_run_preflight_low_pool_space(mocked_warning, slow_checks):
+    with mock.patch("sdw_updater.Preflight.get_pool_free_space", return_value=1024**3):
+        result = Preflight.run_preflight()
+    assert result.should_update
+    assert mocked_warning.called
+
+
+@pytest.fixture
+def qubes_storage():
+    """
+    Fakes the Qubes admin API: templates tpl1 and tpl2 have root volumes of
+    10 GiB in pool "varlibqubes", the default pool, and tpl3 in pool "ssd"
+    """
+    pools = {
+        "varlibqubes": mock.Mock(size=100 * 1024**3, usage=90 * 1024**3),
+        "ssd": mock.Mock(size=100 * 1024**3, usage=0),
+    }
+    templates = {
+        "tpl1": mock.Mock(volumes={"root": mock.Mock(pool="varlibqubes", size=10 * 1024**3)}),
+        "tpl2": mock.Mock(volumes={"root": mock.Mock(pool="varlibqubes", size=10 * 1024**3)}),
+        "tpl3": mock.Mock(volumes={"root": mock.Mock(pool="ssd", size=10 * 1024**3)}),
+    }
+    for template in templates.values():
+        template.volumes["root"].usage = 5 * 1024**3
+    app = mock.Mock(default_pool="varlibqubes", pools=pools, domains=templates)
+    qubesadmin = mock.Mock()
+    qubesadmin.Qubes.return_value = app
+    with mock.patch.dict("sys.modules", {"qubesadmin": qubesadmin}):
+        yield pools, templates
+
+
+def test_check_storage(qubes_storage):
+    assert Preflight.check_storage(["tpl1", "tpl2", "tpl3"], {"tpl1": 2 * 1024**3}) == []
+    assert Preflight.get_pool_usage() == 90 * 1024**3
+    assert Preflight.get_root_volume_usage(["tpl1"]) == {"tpl1": 5 * 1024**3}
+
+
+def test_check_storage_root_volume(qubes_storage):
+    """
+    When a template's root volume does not have room for its expected growth
+    Then the shortage is reported
+    """
+    shortages = Preflight.check_storage(["tpl1", "tpl3"], {"tpl3": 4 * 1024**3})
+    assert shortages == [
+        "Not enough space in root volume of tpl3: 6.0 GiB required, 5.0 GiB available"
+    ]
+
+
+def test_check_storage_pool(qubes_storage):
+    """
+    When the growth of templates in a pool, and of the default pool, exceeds
+    the pool's free space
+    Then the shortage is reported
+    """
+    assert Preflight.check_storage(pool_growth=6 * 1024**3) == []
+    shortages = Preflight.check_storage(["tpl1", "tpl2", "tpl3"], pool_growth=6 * 1024**3)
+    assert shortages == [
+        "Not enough space in storage pool varlibqubes: 12.0 GiB required, 10.0 GiB available"
+    ]
+
+
+@mock.patch("sdw_updater.Preflight.logger.warning")
+def test_check_storage_unknown(mocked_warning):
+    """
+    When storage cannot be checked
+    Then no shortage is reported
+    """
+    with mock.patch.dict("sys.modules", {"qubesadmin": None}):
+        assert Preflight.check_storage(["tpl1"], pool_growth=1024**3) == []
+        assert Preflight.get_pool_usage() is None
+        assert Preflight.get_root_volume_usage(["tpl1"]) == {}
+    assert mocked_warning.called
@@ -0,0 +1,208 @@
+import threading
+from unittest import mock
+
+import pytest
+
+from sdw_updater import Progress
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _run(phases, templates=None):
+    return {"phases": phases, "templates": templates or {}}
+
+
+RUNS = [
+    _run(
+        {"dom0_apply": 300, "apply_dom0": 100, "templates": 600},
+        {"sd-large-bookworm-template": 400, "sd-small-bookworm-template": 200},
+    ),
+    _run({"dom0_apply": 100, "apply_dom0": 100, "templates": 600}),
+    _run({"dom0_apply": 100, "apply_dom0": 100, "templates": 600}),
+]
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_expected_durations_from_history():
+    model = Progress.ProgressModel(RUNS)
+    assert model.expected == {
+        "dom0": 100,
+        "apply_dom0": 100,
+        "apply_all": Progress.DEFAULT_PHASE_DURATIONS["apply_all"],
+        "templates": 600,
+    }
+    assert model.template_durations == {
+        "sd-large-bookworm-template": 400,
+        "sd-small-bookworm-template": 200,
+    }
+
+
+def test_expected_durations_without_history():
+    assert Progress.ProgressModel([]).expected == Progress.DEFAULT_PHASE_DURATIONS
+
+
+def test_progress_on_schedule(clock):
+    """
+    When phases take as long as they did before
+    Then progress is the share of the expected total time that has elapsed
+    """
+    model = Progress.ProgressModel(RUNS, clock=clock)
+    model.skip("apply_all")
+    assert model.remaining() == 800
+
+    model.start("dom0")
+    clock.now = 100
+    model.start("apply_dom0")
+    assert model.remaining() == 700
+    assert model.percent() == 12
+
+    clock.now = 150
+    model.update(0.5)
+    assert model.remaining() == 650
+
+    clock.now = 200
+    model.start("templates")
+    clock.now = 500
+    model.update(0.5)
+    assert model.remaining() == 300
+    assert model.percent() == 62
+
+
+def test_estimate_follows_slower_progress(clock):
+    """
+    When a phase progresses more slowly than expected
+    Then its observed rate replaces the historical estimate
+      And the remaining phases are expected to be slower too
+    """
+    model = Progress.ProgressModel(RUNS, clock=clock)
+    model.skip("apply_all")
+    model.start("dom0")
+    clock.now = 200
+    model.start("apply_dom0")
+    # The dom0 phase took twice as long as expected
+    assert model.remaining() == 2 * 700
+
+    clock.now = 300
+    model.update(0.25)
+    assert model.remaining() == 300 + 2 * 600
+
+
+def test_percent_never_decreases(clock):
+    model = Progress.ProgressModel(RUNS, clock=clock)
+    model.skip("apply_all")
+    model.start("dom0")
+    clock.now = 90
+    before = model.percent()
+    assert before > 0
+
+    # Barely any progress is reported, suggesting the phase will take much longer
+    clock.now = 91
+    model.update(0.01)
+    assert model.remaining() > 1000
+    assert model.percent() == before
+
+
+def test_percent_capped_before_completion(clock):
+    model = Progress.ProgressModel(RUNS, clock=clock)
+    model.skip("apply_all")
+    model.start("dom0")
+    model.start("apply_dom0")
+    model.start("templates")
+    clock.now = 10_000
+    assert model.remaining() == 0
+    assert model.percent() == 99
+
+
+def test_estimate_consistent(clock):
+    """
+    When the progress and remaining time are read together
+    Then they are those reported separately
+    """
+    model = Progress.ProgressModel(RUNS, clock=clock)
+    model.start("dom0")
+    clock.now = 50
+    model.update(0.5)
+    assert model.estimate() == (model.percent(), model.remaining())
+
+
+def test_estimate_during_phase_changes():
+    """
+    When phases change in one thread while progress is read in another
+    Then each estimate is consistent with the phases at the time
+    """
+    model = Progress.ProgressModel(RUNS)
+    stop = threading.Event()
+
+    def change_phases():
+        while not stop.is_set():
+            for phase in Progress.PHASES:
+                model.start(phase)
+                model.update(0.5)
+
+    worker = threading.Thread(target=change_phases)
+    worker.start()
+    try:
+        for _ in range(1000):
+            percent, remaining = model.estimate()
+            assert 0 <= percent <= 99
+            assert remaining >= 0
+    finally:
+        stop.set()
+        worker.join()
+
+
+def test_coalesced_progress_only_emits_changes(clock):
+    callback = mock.Mock()
+    progress = Progress.CoalescedProgress(callback, clock=clock)
+    for value in [1, 1, 1, 2, 2]:
+        clock.now += 1
+        progress(value)
+    progress.flush()
+
+    assert callback.call_args_list == [mock.call(1), mock.call(2)]
+
+
+def test_coalesced_progress_rate_limit(clock):
+    """
+    When progress changes faster than the maximum rate
+    Then changes within the minimum interval are held back
+      And the latest change is passed on once the interval has passed
+      And the final change is passed on by flushing
+    """
+    callback = mock.Mock()
+    progress = Progress.CoalescedProgress(callback, max_rate=2, clock=clock)
+    progress(1)
+    clock.now = 0.1
+    progress(2)
+    progress(3)
+    clock.now = 0.6
+    progress(4)
+    clock.now = 0.7
+    progress(5)
+    assert callback.call_args_list == [mock.call(1), mock.call(4)]
+
+    progress.flush()
+    assert callback.call_args_list[-1] == mock.call(5)
+    assert progress.emitted == 3
+
+
+def test_coalesced_progress_flush_without_pending_change(clock):
+    callback = mock.Mock()
+    progress = Progress.CoalescedProgress(callback, clock=clock)
+    progress(1)
+    clock.now = 0.01
+    progress(2)
+    progress(1)
+    progress.flush()
+
+    callback.assert_called_once_with(1)
@@ -0,0 +1,84 @@
+from unittest import mock
+
+from sdw_updater import SaltProgress
+
+HIGHSTATE_OUTPUT = """\
+local:
+----------
+          ID: dom0-rpm-test-key
+    Function: file.managed
+        Name: /etc/pki/rpm-gpg/RPM-GPG-KEY-securedrop-workstation-test
+      Result: True
+     Comment: File /etc/pki/rpm-gpg/RPM-GPG-KEY-securedrop-workstation-test is in the correct state
+     Started: 10:00:00.000000
+    Duration: 12.5 ms
+     Changes:
+----------
+          ID: sd-app
+    Function: qvm.vm
+      Result: True
+     Comment: ====== ['present'] ======
+     Started: 10:00:00.100000
+    Duration: 2500.0 ms
+     Changes:
+
+Summary for local
+--------------
+Succeeded: 2
+Failed:    0
+--------------
+Total states run:     2
+Total run time:   2.513 s
+sd-log:
+  Name: /etc/rsyslog.d/sdlog.conf - Function: file.managed - Result: Clean - Started: 10:01:00.000000 - Duration: 3.0 ms
+sd-log: OK
+"""  # noqa: E501
+
+
+def _feed(progress, output):
+    for line in output.splitlines():
+        progress.feed(line)
+
+
+def test_counts_states_and_records_durations():
+    progress = SaltProgress.SaltProgress()
+    _feed(progress, HIGHSTATE_OUTPUT)
+
+    assert progress.completed_states == 3
+    assert progress.durations == {
+        "dom0:dom0-rpm-test-key": 12.5,
+        "dom0:sd-app": 2500.0,
+        "sd-log:/etc/rsyslog.d/sdlog.conf": 3.0,
+    }
+    assert progress.current_target == "sd-log"
+    assert progress.slowest_states(1) == [("dom0:sd-app", 2500.0)]
+
+
+def test_reports_progress_against_expected_states():
+    callback = mock.Mock()
+    progress = SaltProgress.SaltProgress(expected_states=4, progress_callback=callback)
+    _feed(progress, HIGHSTATE_OUTPUT)
+
+    assert callback.call_args_list == [mock.call(25), mock.call(50), mock.call(75)]
+
+
+def test_progress_never_reports_completion():
+    """
+    When a run completes more states than the previous one
+    Then progress is capped below 100 until the command has exited
+    """
+    callback = mock.Mock()
+    progress = SaltProgress.SaltProgress(expected_states=1, progress_callback=callback)
+    _feed(progress, HIGHSTATE_OUTPUT)
+
+    assert callback.call_args_list == [mock.call(99)]
+
+
+@mock.patch("sdw_updater.SaltProgress.sdlog")
+def test_reports_target_being_configured(mocked_log):
+    progress = SaltProgress.SaltProgress()
+    _feed(progress, HIGHSTATE_OUTPUT)
+
+    mocked_log.info.assert_any_call("Configuring target: 'dom0'")
+    mocked_log.info.assert_any_call("Configuring target: 'sd-log'")
+    mocked_log.info.assert_any_call("Salt configuration complete for target: 'sd-log'")
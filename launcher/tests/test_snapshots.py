@@ -0,0 +1,136 @@
+from unittest import mock
+
+import pytest
+
+from sdw_updater import Snapshots
+
+
+class FakeVolume:
+    """
+    Root volume that adds a revision of its state each time its template
+    shuts down, pruning revisions beyond `revisions_to_keep`.
+    """
+
+    def __init__(self, revisions):
+        self.revisions = list(revisions)
+        self.revisions_to_keep = 1
+        self.reverted_to = None
+
+    def shutdown(self, revision):
+        self.revisions.append(revision)
+        del self.revisions[: -self.revisions_to_keep]
+
+    def revert(self, revision):
+        assert revision in self.revisions
+        self.reverted_to = revision
+
+
+@pytest.fixture
+def qubes_templates():
+    templates = {
+        name: mock.Mock(volumes={"root": FakeVolume(["rev1"])}, **{"is_halted.return_value": True})
+        for name in ["tpl1", "tpl2"]
+    }
+    qubesadmin = mock.Mock()
+    qubesadmin.Qubes.return_value.domains = templates
+    with mock.patch.dict("sys.modules", {"qubesadmin": qubesadmin}):
+        yield templates
+
+
+def test_revert_to_state_before_update(qubes_templates):
+    """
+    When templates fail to update, after several attempts
+    Then they are reverted to their state before the update
+      And enough revisions are kept for that state to be retained
+    """
+    snapshots = Snapshots.record(["tpl1", "tpl2"])
+    assert snapshots == {
+        "tpl1": Snapshots.Snapshot(["rev1"], 1),
+        "tpl2": Snapshots.Snapshot(["rev1"], 1),
+    }
+    volume = qubes_templates["tpl1"].volumes["root"]
+    assert volume.revisions_to_keep == Snapshots.REVISIONS_TO_KEEP
+    for attempt in ["before-update", "attempt1", "attempt2"]:
+        volume.shutdown(attempt)
+
+    assert Snapshots.revert(snapshots, ["tpl1"]) == ["tpl1"]
+    assert volume.reverted_to == "before-update"
+    assert qubes_templates["tpl2"].volumes["root"].reverted_to is None
+
+
+def test_revert_unchanged(qubes_templates):
+    """
+    When a template fails to update before it was changed
+    Then it is not reverted
+    """
+    snapshots = Snapshots.record(["tpl1"])
+    assert Snapshots.revert(snapshots, ["tpl1"]) == []
+    assert qubes_templates["tpl1"].volumes["root"].reverted_to is None
+
+
+@mock.patch("sdw_updater.Snapshots.sdlog.error")
+def test_revert_running(mocked_error, qubes_templates):
+    snapshots = Snapshots.record(["tpl1"])
+    qubes_templates["tpl1"].volumes["root"].shutdown("before-update")
+    qubes_templates["tpl1"].is_halted.return_value = False
+
+    assert Snapshots.revert(snapshots, ["tpl1"]) == []
+    mocked_error.assert_called_once_with("Cannot revert template 'tpl1' while it is running")
+
+
+@mock.patch("sdw_updater.Snapshots.sdlog.error")
+def test_revert_fails(mocked_error, qubes_templates):
+    snapshots = Snapshots.record(["tpl1", "tpl2"])
+    for template in qubes_templates.values():
+        template.volumes["root"].shutdown("before-update")
+    qubes_templates["tpl1"].volumes["root"].revert = mock.Mock(side_effect=Exception("qubesd"))
+
+    assert Snapshots.revert(snapshots, ["tpl1", "tpl2"]) == ["tpl2"]
+    mocked_error.assert_has_calls([mock.call("Error reverting template 'tpl1'")])
+
+
+def test_release_restores_revisions_to_keep(qubes_templates):
+    """
+    When the update is over
+    Then the revisions kept of each template are restored
+    """
+    snapshots = Snapshots.record(["tpl1"])
+    Snapshots.release(snapshots)
+    assert qubes_templates["tpl1"].volumes["root"].revisions_to_keep == 1
+
+
+@pytest.mark.parametrize("revisions_to_keep", [Snapshots.REVISIONS_TO_KEEP, 10])
+def test_release_leaves_revisions_to_keep(qubes_templates, revisions_to_keep):
+    """
+    When a template already keeps enough revisions
+    Then its revisions kept are left alone
+    """
+    volume = qubes_templates["tpl1"].volumes["root"]
+    volume.revisions_to_keep = revisions_to_keep
+    snapshots = Snapshots.record(["tpl1"])
+    assert snapshots == {"tpl1": Snapshots.Snapshot(["rev1"])}
+    assert volume.revisions_to_keep == revisions_to_keep
+    Snapshots.release(snapshots)
+    assert volume.revisions_to_keep == revisions_to_keep
+
+
+def test_release_changed_in_meantime(qubes_templates):
+    """
+    When the revisions kept of a template were changed during the update
+    Then they are not restored
+    """
+    snapshots = Snapshots.record(["tpl1"])
+    volume = qubes_templates["tpl1"].volumes["root"]
+    volume.revisions_to_keep = 2
+    Snapshots.release(snapshots)
+    assert volume.revisions_to_keep == 2
+
+
+@mock.patch("sdw_updater.Snapshots.sdlog.warning")
+def test_record_without_qubesadmin(mocked_warning):
+    with mock.patch.dict("sys.modules", {"qubesadmin": None}):
+        snapshots = Snapshots.record(["tpl1"])
+        assert snapshots == {}
+        assert Snapshots.revert(snapshots, ["tpl1"]) == []
+        Snapshots.release(snapshots)
+    assert mocked_warning.called
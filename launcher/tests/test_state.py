@@ -0,0 +1,132 @@
+import json
+import os
+from datetime import datetime
+from unittest import mock
+
+import pytest
+
+from sdw_util import State
+
+
+def _write_legacy_files(status=None, last_updated=None):
+    os.makedirs(os.path.dirname(State.get_state_path()), exist_ok=True)
+    if status is not None:
+        with open(State.get_state_path(State.LEGACY_STATUS_FILE), "w") as f:
+            f.write(status)
+    if last_updated is not None:
+        with open(State.get_state_path(State.LEGACY_LAST_UPDATED_FILE), "w") as f:
+            f.write(last_updated)
+
+
+def test_state_roundtrip():
+    State.write_status("2")
+    State.write_last_updated()
+
+    state = State.read()
+    assert state.status == "2"
+    assert state.status_updated is not None
+    assert state.last_updated is not None
+
+    with open(State.get_state_path()) as f:
+        assert json.load(f)["version"] == State.STATE_VERSION
+
+
+def test_state_not_recorded():
+    state = State.read()
+    assert state.status is None
+    assert state.status_updated is None
+    assert state.last_updated is None
+    assert not os.path.exists(State.get_state_path())
+
+
+@pytest.mark.parametrize(
+    "contents",
+    [
+        "not json",
+        json.dumps({"version": State.STATE_VERSION + 1, "status": "0"}),
+        json.dumps(
+            {
+                "version": State.STATE_VERSION,
+                "status": "0",
+                "status_updated": "yesterday",
+                "last_updated": None,
+            }
+        ),
+        json.dumps(["a list"]),
+    ],
+)
+@mock.patch("sdw_util.State.sdlog.error")
+def test_state_unreadable(mocked_error, contents):
+    os.makedirs(os.path.dirname(State.get_state_path()))
+    with open(State.get_state_path(), "w") as f:
+        f.write(contents)
+
+    state = State.read()
+    assert state.status is None
+    assert state.last_updated is None
+    assert mocked_error.called
+
+
+def test_write_is_atomic():
+    State.write_status("0")
+    with open(State.get_state_path()) as f:
+        previous = f.read()
+
+    with (
+        mock.patch("os.replace", side_effect=OSError("os_error")),
+        pytest.raises(OSError, match="os_error"),
+    ):
+        State.write_status("3")
+
+    # The previous state is left in place, and no temporary file remains
+    with open(State.get_state_path()) as f:
+        assert f.read() == previous
+    assert os.listdir(os.path.dirname(State.get_state_path())) == [State.STATE_FILE]
+
+
+def test_write_syncs_to_disk():
+    with mock.patch("os.fsync", wraps=os.fsync) as mocked_fsync:
+        State.write_status("0")
+    # Once for the file, once for its directory
+    assert mocked_fsync.call_count == 2
+
+
+def test_migrate_legacy_files():
+    _write_legacy_files(
+        status=json.dumps({"last_status_update": "2024-03-01 10:00:00", "status": "2"}),
+        last_updated="2024-03-01 10:00:00",
+    )
+
+    state = State.read()
+    assert state.status == "2"
+    assert state.status_updated == datetime(2024, 3, 1, 10, 0, 0)
+    assert state.last_updated == datetime(2024, 3, 1, 10, 0, 0)
+
+    # Legacy files are replaced by the state file
+    assert not os.path.exists(State.get_state_path(State.LEGACY_STATUS_FILE))
+    assert not os.path.exists(State.get_state_path(State.LEGACY_LAST_UPDATED_FILE))
+    with open(State.get_state_path()) as f:
+        assert json.load(f)["status"] == "2"
+
+
+@mock.patch("sdw_util.State.sdlog.warning")
+def test_migrate_unreadable_legacy_file(mocked_warning):
+    _write_legacy_files(status="{truncated", last_updated="2024-03-01 10:00:00")
+
+    state = State.read()
+    assert state.status is None
+    assert state.last_updated == datetime(2024, 3, 1, 10, 0, 0)
+    mocked_warning.assert_called_once()
+    assert not os.path.exists(State.get_state_path(State.LEGACY_STATUS_FILE))
+
+
+@mock.patch("sdw_util.State.sdlog.error")
+def test_migrate_write_fails(mocked_error):
+    _write_legacy_files(last_updated="2024-03-01 10:00:00")
+
+    with mock.patch("os.replace", side_effect=OSError("os_error")):
+        state = State.read()
+    assert state.last_updated == datetime(2024, 3, 1, 10, 0, 0)
+    # Legacy files are kept until the state file has been written
+    assert os.path.exists(State.get_state_path(State.LEGACY_LAST_UPDATED_FILE))
+    mocked_error.assert_has_calls([mock.call("Error migrating updater state")])
@@ -0,0 +1,123 @@
+import json
+import os
+import socket
+import tempfile
+from unittest import mock
+
+import pytest
+
+from sdw_updater import StatusServer
+from sdw_updater.Updater import UpdateStatus
+
+
+@pytest.fixture
+def lock_directory():
+    # UNIX socket paths are limited in length, so pytest's tmp_path may be too long
+    with (
+        tempfile.TemporaryDirectory(prefix="sdw") as directory,
+        mock.patch("sdw_util.Util.LOCK_DIRECTORY", directory),
+    ):
+        yield directory
+
+
+@pytest.fixture
+def status_server(lock_directory):
+    server = StatusServer.StatusServer()
+    server.start()
+    yield server
+    server.stop()
+
+
+def test_read_status_not_running(lock_directory):
+    assert StatusServer.read_status() is None
+    assert list(StatusServer.subscribe()) == []
+
+
+def test_read_status(status_server):
+    status_server.set_phase("templates")
+    status_server.set_progress(42, 600)
+    status_server.set_template_progress("sd-large-bookworm-template", 50)
+
+    status = StatusServer.read_status()
+    assert status["phase"] == "templates"
+    assert status["percent"] == 42
+    assert status["remaining"] == 600
+    assert status["templates"] == {"sd-large-bookworm-template": 50}
+    assert status["result"] is None
+    assert StatusServer.describe(status) == "in phase 'templates', 42% complete"
+
+
+def test_subscribe(status_server):
+    """
+    When a client subscribes to the status
+    Then it is sent each status update until the run has completed
+    """
+    statuses = StatusServer.subscribe()
+    assert next(statuses)["phase"] is None
+
+    status_server.set_phase("dom0")
+    assert next(statuses)["phase"] == "dom0"
+
+    status_server.set_result(UpdateStatus.UPDATES_OK, {"dom0": UpdateStatus.UPDATES_OK})
+    status = next(statuses)
+    assert status["result"] == {"status": "0", "results": {"dom0": "0"}}
+    assert StatusServer.describe(status) == "completed with status 0"
+    assert list(statuses) == []
+
+
+def test_subscribers_disconnected_on_stop(status_server):
+    statuses = StatusServer.subscribe()
+    next(statuses)
+
+    status_server.stop()
+    assert list(statuses) == []
+    assert not os.path.exists(StatusServer.get_socket_path())
+
+
+def test_unknown_request(status_server):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(StatusServer.get_socket_path())
+        sock.sendall(b"shutdown\n")
+        assert "error" in json.loads(sock.makefile("rb").readline())
+
+
+def test_stale_socket_replaced(lock_directory):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+        stale.bind(StatusServer.get_socket_path())
+
+    server = StatusServer.StatusServer()
+    server.start()
+    try:
+        assert StatusServer.read_status() is not None
+    finally:
+        server.stop()
+
+
+def test_stop_leaves_socket_of_next_run(lock_directory):
+    """
+    When an updater run starts serving its status before the previous run has stopped
+    Then the previous run leaves the socket of the next run in place
+    """
+    previous = StatusServer.StatusServer()
+    previous.start()
+    server = StatusServer.StatusServer()
+    server.start()
+    try:
+        server.set_phase("templates")
+        previous.stop()
+        status = StatusServer.read_status()
+        assert status is not None
+        assert status["phase"] == "templates"
+    finally:
+        server.stop()
+    assert not os.path.exists(StatusServer.get_socket_path())
+
+
+@mock.patch("sdw_updater.StatusServer.sdlog.error")
+def test_start_fails(mocked_error, lock_directory):
+    with mock.patch("sdw_util.Util.LOCK_DIRECTORY", os.path.join(lock_directory, "missing")):
+        server = StatusServer.StatusServer()
+        server.start()
+        server.set_phase("dom0")
+        server.stop()
+    mocked_error.assert_has_calls([mock.call("Error starting updater status server")])
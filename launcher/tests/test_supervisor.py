@@ -0,0 +1,137 @@
+import subprocess
+import sys
+
+import pytest
+
+from sdw_updater import Supervisor
+
+
+def _python(code):
+    return [sys.executable, "-c", code]
+
+
+def test_run_dispatches_lines_from_both_streams():
+    stdout_lines = []
+    stderr_lines = []
+    returncode = Supervisor.run(
+        _python(
+            "import sys\n"
+            "print('out 1'); print('out 2')\n"
+            "print('err 1', file=sys.stderr)\n"
+            "sys.exit(3)\n"
+        ),
+        stdout_lines.append,
+        stderr_lines.append,
+    )
+    assert returncode == 3
+    assert stdout_lines == ["out 1", "out 2"]
+    assert stderr_lines == ["err 1"]
+
+
+def test_run_merges_stderr_without_handler():
+    lines = []
+    Supervisor.run(
+        _python("import sys; print('out'); sys.stdout.flush(); sys.exit('err')"), lines.append
+    )
+    assert lines == ["out", "err"]
+
+
+def test_run_reassembles_lines_split_across_reads():
+    """
+    When a line is written in several chunks
+    Then the handler receives it once, complete
+      And a final line without a trailing newline is still delivered
+    """
+    lines = []
+    Supervisor.run(
+        _python(
+            "import sys, time\n"
+            "sys.stdout.write('par'); sys.stdout.flush(); time.sleep(0.05)\n"
+            "sys.stdout.write('tial\\nlast'); sys.stdout.flush()\n"
+        ),
+        lines.append,
+    )
+    assert lines == ["partial", "last"]
+
+
+def test_run_decodes_with_replacement():
+    lines = []
+    Supervisor.run(
+        _python("import sys; sys.stdout.buffer.write(b'caf\\xc3\\xa9\\n')"),
+        lines.append,
+        encoding="ascii",
+    )
+    assert lines == ["caf��"]
+
+
+def test_check_run_raises_on_failure():
+    with pytest.raises(subprocess.CalledProcessError):
+        Supervisor.check_run(_python("import sys; sys.exit(1)"), lambda line: None)
+
+
+def test_supervise_watchdog_terminates():
+    """
+    When the watchdog reports a problem with a process that is still producing output
+    Then the process is terminated
+      And supervision ends without waiting for the process to finish
+    """
+    lines = []
+    checks = []
+    proc = Supervisor.start(
+        _python("import time\nwhile True:\n    print('tick', flush=True)\n    time.sleep(0.01)\n")
+    )
+    returncode = Supervisor.supervise(
+        proc,
+        {proc.stdout: lines.append, proc.stderr: lines.append},
+        watchdog=lambda: checks.append(len(lines)) or len(checks) < 3,
+        watchdog_interval=0.05,
+    )
+    assert returncode != 0
+    assert len(checks) == 3
+    assert lines
+
+
+def test_supervise_watchdog_checks_silent_process():
+    """
+    When a process produces no output
+    Then the watchdog is still checked
+    """
+    proc = Supervisor.start(_python("import time; time.sleep(60)"))
+    returncode = Supervisor.supervise(
+        proc, {proc.stdout: print, proc.stderr: print}, watchdog=lambda: False, watchdog_interval=0
+    )
+    assert returncode != 0
+
+
+def test_supervise_handler_raises():
+    """
+    When a line handler raises
+    Then the process is terminated
+      And its streams are closed
+      And the exception is propagated
+    """
+
+    def fail(line):
+        raise ValueError(line)
+
+    proc = Supervisor.start(_python("import time; print('line', flush=True); time.sleep(60)"))
+    with pytest.raises(ValueError, match="line"):
+        Supervisor.supervise(proc, {proc.stdout: fail, proc.stderr: fail})
+    assert proc.returncode is not None
+    assert proc.stdout.closed
+    assert proc.stderr.closed
+
+
+def test_terminate_kills_unresponsive_process():
+    proc = Supervisor.start(
+        _python(
+            "import signal, sys, time\n"
+            "signal.signal(signal.SIGTERM, signal.SIG_IGN)\n"
+            "print('ready', flush=True)\n"
+            "time.sleep(60)\n"
+        )
+    )
+    assert proc.stdout is not None
+    proc.stdout.readline()
+    Supervisor.terminate(proc, grace_period=0.1)
+    assert proc.returncode == -9
@@ -1,6 +1,8 @@
 import json
 import os
+import selectors
 import subprocess
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
 from unittest import mock
@@ -8,8 +10,9 @@ from unittest.mock import call
 
 import pytest
 
-from sdw_updater import Updater
+from sdw_updater import Progress, Snapshots, Updater
 from sdw_updater.Updater import UpdateStatus
+from sdw_util import State
 
 debian_based_vms = [
     "sd-app",
@@ -62,46 +65,39 @@ def test__get_current_templates():
 @mock.patch("sdw_updater.Updater._write_updates_status_flag_to_disk")
 @mock.patch("sdw_updater.Updater._write_last_updated_flags_to_disk")
 @mock.patch("sdw_updater.Updater._apply_updates_dom0", return_value=UpdateStatus.UPDATES_OK)
-@mock.patch("sdw_updater.Updater._check_updates_dom0", return_value=UpdateStatus.UPDATES_REQUIRED)
 @mock.patch("sdw_updater.Updater.sdlog.error")
 @mock.patch("sdw_updater.Updater.sdlog.info")
-def test_apply_updates_dom0_updates_available(
-    mocked_info, mocked_error, check_dom0, apply_dom0, write_updated, write_status
-):
-    assert Updater.apply_updates_dom0() == UpdateStatus.UPDATES_OK
-    assert not mocked_error.called
-    # Ensure we check for updates, and apply them (with no parameters)
-    check_dom0.assert_called_once_with()
-    apply_dom0.assert_called_once_with()
-
-
-@mock.patch("sdw_updater.Updater._write_updates_status_flag_to_disk")
-@mock.patch("sdw_updater.Updater._write_last_updated_flags_to_disk")
-@mock.patch("sdw_updater.Updater._apply_updates_dom0")
-@mock.patch("sdw_updater.Updater._check_updates_dom0", return_value=UpdateStatus.UPDATES_OK)
-@mock.patch("sdw_updater.Updater.sdlog.error")
-@mock.patch("sdw_updater.Updater.sdlog.info")
-def test_apply_updates_dom0_no_updates(
-    mocked_info, mocked_error, check_dom0, apply_dom0, write_updated, write_status
-):
+def test_apply_updates_dom0(mocked_info, mocked_error, apply_dom0, write_updated, write_status):
     assert Updater.apply_updates_dom0() == UpdateStatus.UPDATES_OK
     assert not mocked_error.called
-    # We check for updates, but do not attempt to apply them
-    check_dom0.assert_called_once_with()
-    assert not apply_dom0.called
+    # Updates are applied in a single pass, without checking for them first
+    apply_dom0.assert_called_once_with(from_cache=False)
 
 
-@mock.patch("sdw_updater.Updater._get_current_templates", return_value=[])
+@mock.patch("sdw_updater.Updater._get_templates_to_update", return_value=[])
 @mock.patch("sdw_updater.Updater._write_updates_status_flag_to_disk")
 @mock.patch("sdw_updater.Updater._write_last_updated_flags_to_disk")
+@mock.patch("sdw_updater.Supervisor.supervise", return_value=0)
 @mock.patch("sdw_updater.Updater._start_qubes_updater_proc")
 @mock.patch("sdw_updater.Updater.sdlog.error")
 @mock.patch("sdw_updater.Updater.sdlog.info")
 def test_apply_templates_success(
-    mocked_info, mocked_error, mock_proc, write_updated, write_status, mocked_templates
+    mocked_info,
+    mocked_error,
+    mock_proc,
+    mock_supervise,
+    write_updated,
+    write_status,
+    mocked_templates,
 ):
+    """
+    When no template requires updates
+    Then the Qubes updater is not started
+      And template updates are successful
+    """
     result = Updater.apply_updates_templates()
-    mock_proc.assert_called_once()
+    assert not mock_proc.called
+    assert not mock_supervise.called
     assert result == UpdateStatus.UPDATES_OK
     assert not mocked_error.called
 
@@ -134,36 +130,80 @@ def test_apply_templates(
 ):
     mocked_qubes_vm_update(stderr=qubes_upd_stderr, retcode=qubes_upd_retcode)
     with (
-        mock.patch("time.sleep"),  # skip time.sleep in polling to speed up test
+        mock.patch("time.sleep"),  # Failed templates are retried
         mock.patch("sdw_updater.Updater._get_current_templates", return_value=templates),
+        mock.patch(
+            "sdw_updater.Updater._get_templates_to_update",
+            side_effect=lambda templates, completed: sorted(templates),
+        ),
     ):
         result = Updater.apply_updates_templates()
     assert result == expected
 
 
+def test_apply_templates_returns_without_polling(mocked_qubes_vm_update):
+    """
+    When qubes-vm-update exits
+    Then apply_updates_templates returns as soon as its pipes drain
+      And the supervising thread only wakes up when there is output to read
+    """
+    stderr_lines = [f"tpl updating {percent}" for percent in range(0, 100, 10)]
+    stderr_lines.append("tpl done success")
+    stdout_lines = [f"Get:{n} https://deb.debian.org/debian trixie" for n in range(10)]
+    mocked_qubes_vm_update(stderr="\n".join(stderr_lines), stdout="\n".join(stdout_lines))
+
+    wakeups = 0
+    original_select = selectors.DefaultSelector.select
+
+    def counting_select(self, timeout=None):
+        nonlocal wakeups
+        wakeups += 1
+        return original_select(self, timeout)
+
+    with (
+        mock.patch("sdw_updater.Updater._get_current_templates", return_value=["tpl"]),
+        mock.patch(
+            "sdw_updater.Updater._get_templates_to_update",
+            side_effect=lambda templates, completed: sorted(templates),
+        ),
+        mock.patch.object(selectors.DefaultSelector, "select", counting_select),
+        mock.patch("time.sleep") as mocked_sleep,
+    ):
+        start = time.monotonic()
+        result = Updater.apply_updates_templates()
+        elapsed = time.monotonic() - start
+
+    assert result == UpdateStatus.UPDATES_OK
+    assert not mocked_sleep.called
+    # The former polling loop added up to a full second after the process exited
+    assert elapsed < 1
+    # At most one wakeup per line, plus one per stream for EOF
+    assert wakeups <= len(stderr_lines) + len(stdout_lines) + 2
+
+
 @pytest.mark.parametrize("status", UpdateStatus)
 @mock.patch("sdw_updater.Updater.sdlog.error")
 @mock.patch("sdw_updater.Updater.sdlog.info")
 def test_write_updates_status_flag_to_disk(mocked_info, mocked_error, status, tmp_path):
     with mock.patch("os.path.expanduser", return_value=tmp_path):
-        flag_file_dom0 = Updater.get_dom0_path(Updater.FLAG_FILE_STATUS_DOM0)
+        state_file = State.get_state_path()
 
         Updater._write_updates_status_flag_to_disk(status)
 
-    assert os.path.exists(flag_file_dom0)
-    with open(flag_file_dom0) as f:
+    assert os.path.exists(state_file)
+    with open(state_file) as f:
         contents = json.load(f)
         assert contents["status"] == status.value
-    assert "tmp" in flag_file_dom0
+    assert "tmp" in state_file
     assert not mocked_error.called
 
 
 @pytest.mark.parametrize("status", UpdateStatus)
-@mock.patch("os.path.exists", side_effect=OSError("os_error"))
+@mock.patch("os.replace", side_effect=OSError("os_error"))
 @mock.patch("sdw_updater.Updater.sdlog.error")
 @mock.patch("sdw_updater.Updater.sdlog.info")
 def test_write_updates_status_flag_to_disk_failure_dom0(
-    mocked_info, mocked_error, mocked_open, status, tmp_path
+    mocked_info, mocked_error, mocked_replace, status, tmp_path
 ):
     error_calls = [call("Error writing update status flag to dom0"), call("os_error")]
     with mock.patch("os.path.expanduser", return_value=tmp_path):
@@ -175,23 +215,24 @@ def test_write_updates_status_flag_to_disk_failure_dom0(
 @mock.patch("sdw_updater.Updater.sdlog.info")
 def test_write_last_updated_flags_to_disk(mocked_info, mocked_error, tmp_path):
     with mock.patch("os.path.expanduser", return_value=tmp_path):
-        flag_file_dom0 = Updater.get_dom0_path(Updater.FLAG_FILE_LAST_UPDATED_DOM0)
-        current_time = str(datetime.now().strftime(Updater.DATE_FORMAT))
+        state_file = State.get_state_path()
+        current_time = datetime.now().replace(microsecond=0)
 
         Updater._write_last_updated_flags_to_disk()
     assert not mocked_error.called
-    assert os.path.exists(flag_file_dom0)
-    with open(flag_file_dom0) as f:
-        contents = f.read()
+    assert os.path.exists(state_file)
+    with open(state_file) as f:
+        contents = json.load(f)
 
-    assert contents == current_time
+    last_updated = datetime.strptime(contents["last_updated"], Updater.DATE_FORMAT)
+    assert timedelta(0) <= last_updated - current_time < timedelta(seconds=2)
 
 
-@mock.patch("os.path.exists", side_effect=OSError("os_error"))
+@mock.patch("os.replace", side_effect=OSError("os_error"))
 @mock.patch("sdw_updater.Updater.sdlog.error")
 @mock.patch("sdw_updater.Updater.sdlog.info")
 def test_write_last_updated_flags_to_disk_fails(
-    mocked_info, mocked_error, mocked_path_exists, tmp_path
+    mocked_info, mocked_error, mocked_replace, tmp_path
 ):
     error_log = [
         call("Error writing last updated flag to dom0"),
@@ -202,59 +243,167 @@ def test_write_last_updated_flags_to_disk_fails(
     mocked_error.assert_has_calls(error_log)
 
 
+def test_write_flags_preserve_each_other():
+    Updater._write_last_updated_flags_to_disk()
+    Updater._write_updates_status_flag_to_disk(UpdateStatus.REBOOT_REQUIRED)
+
+    state = State.read()
+    assert state.status == UpdateStatus.REBOOT_REQUIRED.value
+    assert state.last_updated is not None
+
+
+def _rpm_packages(*package_lists):
+    """
+    Returns a side effect for `subprocess.check_output` listing the given
+    installed packages on each successive call.
+    """
+    return ["".join(f"{package}\n" for package in packages).encode() for packages in package_lists]
+
+
+DOM0_PACKAGES = ["bash 0:5.2.26-3.fc41.x86_64", "kernel 1000:6.6.48-1.qubes.fc41.x86_64"]
+
+
 @mock.patch("subprocess.check_call")
-@mock.patch("sdw_updater.Updater._check_updates_dom0", return_value=UpdateStatus.UPDATES_REQUIRED)
+@mock.patch(
+    "subprocess.check_output",
+    side_effect=_rpm_packages(
+        DOM0_PACKAGES,
+        DOM0_PACKAGES + ["kernel 1000:6.6.63-1.qubes.fc41.x86_64"],
+    ),
+)
 @mock.patch("sdw_updater.Updater.sdlog.error")
 @mock.patch("sdw_updater.Updater.sdlog.info")
 def test_apply_updates_dom0_updates_applied(
     mocked_info,
     mocked_error,
-    check_dom0,
+    mocked_output,
     mocked_call,
 ):
     result = Updater._apply_updates_dom0()
     assert result == UpdateStatus.REBOOT_REQUIRED
     mocked_call.assert_called_once_with(["sudo", "qubes-dom0-update", "-y"])
+    mocked_info.assert_any_call("dom0 packages changed: kernel")
     assert not mocked_error.called
 
 
-@mock.patch("subprocess.check_call", side_effect=subprocess.CalledProcessError(1, "check_call"))
+@mock.patch("subprocess.check_call")
+@mock.patch(
+    "subprocess.check_output",
+    side_effect=_rpm_packages(
+        DOM0_PACKAGES,
+        ["bash 0:5.2.32-1.fc41.x86_64", DOM0_PACKAGES[1], "jq 0:1.7.1-8.fc41.x86_64"],
+    ),
+)
 @mock.patch("sdw_updater.Updater.sdlog.error")
 @mock.patch("sdw_updater.Updater.sdlog.info")
-def test_apply_updates_dom0_failure(mocked_info, mocked_error, mocked_call):
-    result = Updater._apply_updates_dom0()
-    error_log = [
-        call("An error has occurred updating dom0. Please contact your administrator."),
-        call("Command 'check_call' returned non-zero exit status 1."),
-    ]
-
-    assert mocked_call.called
-    assert result == UpdateStatus.UPDATES_FAILED
-    mocked_error.assert_has_calls(error_log)
+def test_apply_updates_dom0_no_reboot_required(
+    mocked_info, mocked_error, mocked_output, mocked_call
+):
+    """
+    When only packages that do not need a reboot to take effect are updated
+    Then no reboot is required
+    """
+    assert Updater._apply_updates_dom0() == UpdateStatus.UPDATES_OK
+    mocked_info.assert_any_call("dom0 packages changed: bash, jq")
+    assert not mocked_error.called
 
 
-@mock.patch("subprocess.check_call", side_effect=subprocess.CalledProcessError(1, "check_call"))
+@mock.patch("subprocess.check_call")
+@mock.patch("subprocess.check_output", side_effect=_rpm_packages(DOM0_PACKAGES, DOM0_PACKAGES))
 @mock.patch("sdw_updater.Updater.sdlog.error")
 @mock.patch("sdw_updater.Updater.sdlog.info")
-def test_check_dom0_updates_available(mocked_info, mocked_error, mocked_call):
-    result = Updater._check_updates_dom0()
+def test_apply_updates_dom0_no_updates(mocked_info, mocked_error, mocked_output, mocked_call):
+    assert Updater._apply_updates_dom0() == UpdateStatus.UPDATES_OK
+    mocked_call.assert_called_once_with(["sudo", "qubes-dom0-update", "-y"])
+    mocked_info.assert_called_with("No updates available for dom0")
+    assert not mocked_error.called
 
-    error_calls = [
-        call("dom0 updates required, or cannot check for updates"),
-        call("Command 'check_call' returned non-zero exit status 1."),
+
+@mock.patch("subprocess.check_call")
+@mock.patch("subprocess.check_output", side_effect=_rpm_packages(DOM0_PACKAGES, DOM0_PACKAGES))
+def test_apply_updates_dom0_from_cache(mocked_output, mocked_call):
+    """
+    When dom0 updates were downloaded in the background
+    Then they are installed from the local cache, without downloading them again
+    """
+    assert Updater._apply_updates_dom0(from_cache=True) == UpdateStatus.UPDATES_OK
+    mocked_call.assert_called_once_with(Updater.DOM0_UPDATE_CACHED_CMD)
+
+
+@mock.patch(
+    "subprocess.check_call",
+    side_effect=[subprocess.CalledProcessError(1, "qubes-dom0-update"), None],
+)
+@mock.patch("subprocess.check_output", side_effect=_rpm_packages(DOM0_PACKAGES, DOM0_PACKAGES))
+@mock.patch("sdw_updater.Updater.sdlog.warning")
+def test_apply_updates_dom0_from_cache_fails(mocked_warning, mocked_output, mocked_call):
+    """
+    When dom0 updates cannot be installed from the local cache
+    Then they are downloaded and installed again
+    """
+    assert Updater._apply_updates_dom0(from_cache=True) == UpdateStatus.UPDATES_OK
+    assert mocked_call.call_args_list == [
+        call(Updater.DOM0_UPDATE_CACHED_CMD),
+        call(["sudo", "qubes-dom0-update", "-y"]),
     ]
-    mocked_error.assert_has_calls(error_calls)
-    assert result == UpdateStatus.UPDATES_REQUIRED
+    mocked_warning.assert_any_call(
+        "Cannot install dom0 updates from the local cache, downloading them again"
+    )
 
 
 @mock.patch("subprocess.check_call")
+@mock.patch(
+    "subprocess.check_output",
+    side_effect=[subprocess.CalledProcessError(1, "rpm"), b"bash 0:5.2.26-3.fc41.x86_64\n"],
+)
+@mock.patch("sdw_updater.Updater.sdlog.warning")
+@mock.patch("sdw_updater.Updater.sdlog.error")
+def test_apply_updates_dom0_unknown_changes(
+    mocked_error, mocked_warning, mocked_output, mocked_call
+):
+    """
+    When the installed packages cannot be listed
+    Then a reboot is assumed to be required
+    """
+    assert Updater._apply_updates_dom0() == UpdateStatus.REBOOT_REQUIRED
+    assert mocked_warning.called
+
+
+@pytest.mark.parametrize(
+    ("package", "requires_reboot"),
+    [
+        ("kernel", True),
+        ("kernel-latest-qubes-vm", True),
+        ("xen-hypervisor", True),
+        ("linux-firmware", True),
+        ("microcode_ctl", True),
+        ("glibc", True),
+        ("systemd", True),
+        ("libvirt-daemon", True),
+        ("glibc-langpack-en", False),
+        ("systemd-libs", False),
+        ("qubes-core-dom0", False),
+        ("securedrop-workstation-dom0-config", False),
+    ],
+)
+def test_dom0_reboot_packages(package, requires_reboot):
+    assert bool(Updater.DOM0_REBOOT_PACKAGES_REGEX.match(package)) == requires_reboot
+
+
+@mock.patch("subprocess.check_call", side_effect=subprocess.CalledProcessError(1, "check_call"))
+@mock.patch("subprocess.check_output", return_value=b"")
 @mock.patch("sdw_updater.Updater.sdlog.error")
 @mock.patch("sdw_updater.Updater.sdlog.info")
-def test_check_dom0_no_updates_available(mocked_info, mocked_error, mocked_call):
-    result = Updater._check_updates_dom0()
-    assert not mocked_error.called
-    mocked_info.assert_called_once_with("No updates available for dom0")
-    assert result == UpdateStatus.UPDATES_OK
+def test_apply_updates_dom0_failure(mocked_info, mocked_error, mocked_output, mocked_call):
+    result = Updater._apply_updates_dom0()
+    error_log = [
+        call("An error has occurred updating dom0. Please contact your administrator."),
+        call("Command 'check_call' returned non-zero exit status 1."),
+    ]
+
+    assert mocked_call.called
+    assert result == UpdateStatus.UPDATES_FAILED
+    mocked_error.assert_has_calls(error_log)
 
 
 @mock.patch("sdw_updater.Updater.sdlog.error")
@@ -317,13 +466,13 @@ def test_read_dom0_update_flag_from_disk(mocked_error, status, tmp_path):
     with mock.patch("os.path.expanduser", return_value=tmp_path):
         Updater._write_updates_status_flag_to_disk(status)
 
-        flag_file_dom0 = Updater.get_dom0_path(Updater.FLAG_FILE_STATUS_DOM0)
+        state_file = State.get_state_path()
 
-        assert os.path.exists(flag_file_dom0)
-        with open(flag_file_dom0) as f:
+        assert os.path.exists(state_file)
+        with open(state_file) as f:
             contents = json.load(f)
             assert contents["status"] == status.value
-        assert "tmp" in flag_file_dom0
+        assert "tmp" in state_file
 
         json_values = Updater.read_dom0_update_flag_from_disk()
     assert json_values["status"] == status.value
@@ -334,13 +483,10 @@ def test_read_dom0_update_flag_from_disk(mocked_error, status, tmp_path):
 @mock.patch("sdw_updater.Updater.sdlog.error")
 @mock.patch("sdw_updater.Updater.sdlog.info")
 def test_read_dom0_update_flag_from_disk_fails(mocked_info, mocked_error, tmp_path):
-    with mock.patch(
-        "sdw_updater.Updater.get_dom0_path",
-        return_value=tmp_path / Path(Updater.FLAG_FILE_STATUS_DOM0),
-    ):
-        flag_file_dom0 = Path(Updater.get_dom0_path(Updater.FLAG_FILE_STATUS_DOM0))
-        flag_file_dom0.parent.mkdir()
-        with open(flag_file_dom0, "w") as f:
+    with mock.patch("os.path.expanduser", return_value=tmp_path):
+        state_file = Path(State.get_state_path())
+        state_file.parent.mkdir()
+        with open(state_file, "w") as f:
             f.write("something")
         info_calls = [call("Cannot read dom0 status flag, assuming first run")]
         assert Updater.read_dom0_update_flag_from_disk() is None
@@ -348,6 +494,11 @@ def test_read_dom0_update_flag_from_disk_fails(mocked_info, mocked_error, tmp_pa
         mocked_info.assert_has_calls(info_calls)
 
 
+def test_read_dom0_update_flag_from_disk_unknown_status():
+    State.write_status("42")
+    assert Updater.read_dom0_update_flag_from_disk() is None
+
+
 @pytest.mark.parametrize(
     ("qubes_ver", "agent_ver", "is_mid_upgrade"),
     [
@@ -375,6 +526,59 @@ def test_is_qubes_mid_upgrade(qubes_ver, agent_ver, is_mid_upgrade, mocker, mock
     assert Updater.is_qubes_mid_upgrade() == is_mid_upgrade
 
 
+@pytest.fixture
+def mid_upgrade_inputs(tmp_path):
+    """
+    Fake inputs for the in-place upgrade check, and a mocked check
+    """
+    inputs = [tmp_path / "qubes-release", tmp_path / "qubes.xml"]
+    for path in inputs:
+        path.touch()
+    with (
+        mock.patch("sdw_updater.Updater.MID_UPGRADE_INPUT_PATHS", [*map(str, inputs), "/404"]),
+        mock.patch(
+            "sdw_updater.Updater._detect_qubes_mid_upgrade", return_value=False
+        ) as mocked_detect,
+    ):
+        yield inputs, mocked_detect
+
+
+def test_is_qubes_mid_upgrade_cached(mid_upgrade_inputs):
+    """
+    When the in-place upgrade check has run before
+     And none of its inputs have changed since
+    Then its result is reused
+    """
+    _, detect = mid_upgrade_inputs
+    assert not Updater.is_qubes_mid_upgrade()
+    assert not Updater.is_qubes_mid_upgrade()
+    detect.assert_called_once_with()
+
+
+def test_is_qubes_mid_upgrade_cache_invalidated(mid_upgrade_inputs):
+    """
+    When the qubesd store is modified, e.g. a template's agent version changes
+    Then the in-place upgrade check runs again
+    """
+    (release, qubes_xml), detect = mid_upgrade_inputs
+    assert not Updater.is_qubes_mid_upgrade()
+
+    detect.return_value = True
+    os.utime(qubes_xml, ns=(0, 0))
+    assert Updater.is_qubes_mid_upgrade()
+    assert Updater.is_qubes_mid_upgrade()
+    assert detect.call_count == 2
+
+
+def test_is_qubes_mid_upgrade_not_cached_without_access(mid_upgrade_inputs):
+    _, detect = mid_upgrade_inputs
+    with mock.patch("os.stat", side_effect=PermissionError()):
+        Updater.is_qubes_mid_upgrade()
+        Updater.is_qubes_mid_upgrade()
+    assert detect.call_count == 2
+    assert not os.path.exists(Updater.get_dom0_path(Updater.MID_UPGRADE_CACHE_FILE))
+
+
 @mock.patch(
     "sdw_updater.Updater.read_dom0_update_flag_from_disk",
     return_value={
@@ -537,22 +741,22 @@ def test_should_run_updater_invalid_status_value(mocked_write):
             assert Updater.should_launch_updater(TEST_INTERVAL) is True
 
 
-@mock.patch("subprocess.check_output", side_effect=[b""])
+@mock.patch("sdw_updater.Supervisor.check_run")
 @mock.patch("sdw_updater.Updater.sdlog.error")
 @mock.patch("sdw_updater.Updater.sdlog.info")
 def test_apply_dom0_state_success(mocked_info, mocked_error, mocked_subprocess):
     Updater.apply_dom0_state()
     log_call_list = [call("Applying dom0 state"), call("Dom0 state applied")]
     mocked_subprocess.assert_called_once_with(
-        ["sudo", "qubesctl", "--show-output", "state.highstate"]
+        ["sudo", "qubesctl", "--show-output", "state.highstate"], mock.ANY
     )
     mocked_info.assert_has_calls(log_call_list)
     assert not mocked_error.called
 
 
 @mock.patch(
-    "subprocess.check_output",
-    side_effect=[subprocess.CalledProcessError(1, cmd="check_output", output=b"")],
+    "sdw_updater.Supervisor.check_run",
+    side_effect=[subprocess.CalledProcessError(1, cmd="check_output")],
 )
 @mock.patch("sdw_updater.Updater.sdlog.error")
 @mock.patch("sdw_updater.Updater.sdlog.info")
@@ -563,7 +767,7 @@ def test_apply_dom0_state_failure(mocked_info, mocked_error, mocked_subprocess):
         call("Command 'check_output' returned non-zero exit status 1."),
     ]
     mocked_subprocess.assert_called_once_with(
-        ["sudo", "qubesctl", "--show-output", "state.highstate"]
+        ["sudo", "qubesctl", "--show-output", "state.highstate"], mock.ANY
     )
     mocked_info.assert_called_once_with("Applying dom0 state")
     mocked_error.assert_has_calls(log_error_calls)
@@ -588,7 +792,7 @@ def test_migration_not_required(mocked_info, mocked_listdir, mocked_exists):
 
 
 @mock.patch("sdw_updater.Updater.sdlog.info")
-@mock.patch("subprocess.check_output", return_value=b"")
+@mock.patch("sdw_updater.Supervisor.check_run")
 @mock.patch("subprocess.check_call")
 def test_run_full_install(mocked_call, mocked_output, mocked_info):
     """
@@ -602,7 +806,7 @@ def test_run_full_install(mocked_call, mocked_output, mocked_info):
     MIGRATION_DIR = "/tmp/potato"
     with mock.patch("sdw_updater.Updater.MIGRATION_DIR", MIGRATION_DIR):
         result = Updater.run_full_install()
-    check_outputs = [call(["sdw-admin", "--apply"])]
+    check_outputs = [call(["sdw-admin", "--apply", "--skip-storage-check"], mock.ANY)]
     check_calls = [call(["sudo", "rm", "-rf", MIGRATION_DIR])]
     assert mocked_output.call_count == 1
     assert mocked_call.call_count == 1
@@ -613,8 +817,8 @@ def test_run_full_install(mocked_call, mocked_output, mocked_info):
 
 @mock.patch("sdw_updater.Updater.sdlog.error")
 @mock.patch(
-    "subprocess.check_output",
-    side_effect=[subprocess.CalledProcessError(1, cmd="check_output", output=b"")],
+    "sdw_updater.Supervisor.check_run",
+    side_effect=[subprocess.CalledProcessError(1, cmd="check_output")],
 )
 @mock.patch("subprocess.check_call", return_value=0)
 def test_run_full_install_with_error(mocked_call, mocked_output, mocked_error):
@@ -628,7 +832,7 @@ def test_run_full_install_with_error(mocked_call, mocked_output, mocked_error):
     MIGRATION_DIR = "/tmp/potato"
     with mock.patch("sdw_updater.Updater.MIGRATION_DIR", MIGRATION_DIR):
         result = Updater.run_full_install()
-    calls = [call(["sdw-admin", "--apply"])]
+    calls = [call(["sdw-admin", "--apply", "--skip-storage-check"], mock.ANY)]
     assert mocked_output.call_count == 1
     assert mocked_call.call_count == 0
     assert mocked_error.called
@@ -637,7 +841,7 @@ def test_run_full_install_with_error(mocked_call, mocked_output, mocked_error):
 
 
 @mock.patch("sdw_updater.Updater.sdlog.error")
-@mock.patch("subprocess.check_output", return_value=b"")
+@mock.patch("sdw_updater.Supervisor.check_run")
 @mock.patch(
     "subprocess.check_call", side_effect=[subprocess.CalledProcessError(1, cmd="check_call")]
 )
@@ -652,7 +856,7 @@ def test_run_full_install_with_flag_error(mocked_call, mocked_output, mocked_err
     MIGRATION_DIR = "/tmp/potato"
     with mock.patch("sdw_updater.Updater.MIGRATION_DIR", MIGRATION_DIR):
         result = Updater.run_full_install()
-    check_outputs = [call(["sdw-admin", "--apply"])]
+    check_outputs = [call(["sdw-admin", "--apply", "--skip-storage-check"], mock.ANY)]
     check_calls = [call(["sudo", "rm", "-rf", MIGRATION_DIR])]
     assert mocked_output.call_count == 1
     assert mocked_call.call_count == 1
@@ -660,3 +864,915 @@ def test_run_full_install_with_flag_error(mocked_call, mocked_output, mocked_err
     assert result == UpdateStatus.UPDATES_FAILED
     mocked_output.assert_has_calls(check_outputs, any_order=False)
     mocked_call.assert_has_calls(check_calls, any_order=False)
+
+
+@mock.patch("sdw_updater.Updater.sdlog.error")
+@mock.patch("sdw_updater.Supervisor.check_run")
+@mock.patch(
+    "sdw_updater.Preflight.check_storage",
+    return_value=["Not enough space in storage pool varlibqubes: 15.0 GiB required"],
+)
+def test_run_full_install_not_enough_storage(mocked_check, mocked_run, mocked_error):
+    """
+    When a full migration is requested
+      And the default pool is not expected to have room for it
+    Then the migration is not started
+      And the shortage is logged
+    """
+    assert Updater.run_full_install(expected_growth=10 * 1024**3) == UpdateStatus.UPDATES_FAILED
+    mocked_check.assert_called_once_with(pool_growth=10 * 1024**3)
+    assert not mocked_run.called
+    mocked_error.assert_called_with(
+        "Not enough space in storage pool varlibqubes: 15.0 GiB required"
+    )
+
+
+def test_run_full_install_streams_output_to_detail_log(tmp_path, monkeypatch):
+    """
+    When sdw-admin produces output
+    Then each line is written to the detail log as it arrives
+      And ANSI formatting is removed
+    """
+    script = tmp_path / "sdw-admin"
+    script.write_text(
+        "#!/usr/bin/env python3\n"
+        "import sys\n"
+        "for n in range(3):\n"
+        "    print(f'\\x1b[0;32mstate {n}\\x1b[0m', flush=True)\n"
+        "print('error output', file=sys.stderr)\n"
+    )
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+
+    with (
+        mock.patch("sdw_updater.Updater.detail_log") as mocked_detail_log,
+        mock.patch("subprocess.check_call"),
+    ):
+        result = Updater.run_full_install()
+
+    assert result == UpdateStatus.UPDATES_OK
+    mocked_detail_log.info.assert_has_calls(
+        [
+            call("Output from command: sdw-admin --apply --skip-storage-check"),
+            call("state 0"),
+            call("state 1"),
+            call("state 2"),
+            call("error output"),
+        ]
+    )
+
+
+def test_apply_dom0_state_reports_progress_from_previous_run(tmp_path, monkeypatch):
+    """
+    When the dom0 state has been applied before
+    Then progress is reported against the number of states completed last time
+      And the per-state durations of this run are saved
+    """
+    script = tmp_path / "sudo"
+    script.write_text(
+        "#!/usr/bin/env python3\n"
+        "for n in range(4):\n"
+        "    print(f'          ID: state-{n}')\n"
+        "    print(f'    Duration: {n}.5 ms')\n"
+    )
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tmp_path), prepend=os.pathsep)
+    Updater._write_salt_state_durations({"apply_dom0": {"total_states": 8, "durations": {}}})
+
+    progress_callback = mock.Mock()
+    result = Updater.apply_dom0_state(progress_callback)
+
+    assert result == UpdateStatus.UPDATES_OK
+    assert progress_callback.call_args_list == [call(12), call(25), call(37), call(50)]
+    durations = Updater._read_salt_state_durations()["apply_dom0"]
+    assert durations["total_states"] == 4
+    assert durations["durations"]["dom0:state-3"] == 3.5
+
+
+@pytest.fixture
+def dom0_state_inputs(tmp_path):
+    """
+    A fake Salt tree, pillar tree and config.json as inputs for the dom0 state,
+    with a fixed dom0 config package version
+    """
+    salt_dir = tmp_path / "srv" / "salt" / "securedrop_salt"
+    salt_dir.mkdir(parents=True)
+    (salt_dir / "sd-dom0-files.sls").write_text("dom0-files: {}\n")
+    pillar_dir = tmp_path / "srv" / "pillar"
+    (pillar_dir / "_tops" / "base").mkdir(parents=True)
+    (pillar_dir / "top.sls").write_text("base: {}\n")
+    config = tmp_path / "config.json"
+    config.write_text('{"environment": "prod"}')
+    with (
+        mock.patch(
+            "sdw_updater.Updater.DOM0_STATE_INPUT_PATHS",
+            [str(salt_dir), str(pillar_dir), str(config)],
+        ),
+        mock.patch(
+            "sdw_updater.Updater.subprocess.check_output",
+            return_value="securedrop-workstation-dom0-config-1.8.0-1.fc41.noarch\n",
+        ),
+    ):
+        yield salt_dir, config
+
+
+@mock.patch("sdw_updater.Supervisor.check_run")
+def test_apply_dom0_state_skipped_when_inputs_unchanged(mocked_run, dom0_state_inputs):
+    assert Updater.apply_dom0_state() == UpdateStatus.UPDATES_OK
+    assert Updater.apply_dom0_state() == UpdateStatus.UPDATES_OK
+    assert mocked_run.call_count == 1
+
+
+@pytest.mark.parametrize("changed_input", ["salt", "pillar", "pillar_top", "config", "package"])
+@mock.patch("sdw_updater.Supervisor.check_run")
+def test_apply_dom0_state_applied_when_inputs_change(mocked_run, changed_input, dom0_state_inputs):
+    salt_dir, config = dom0_state_inputs
+    pillar_dir = salt_dir.parent.parent / "pillar"
+    Updater.apply_dom0_state()
+
+    if changed_input == "salt":
+        (salt_dir / "sd-new-state.sls").write_text("new-state: {}\n")
+    elif changed_input == "pillar":
+        (pillar_dir / "securedrop.sls").write_text("sd-app: {}\n")
+    elif changed_input == "pillar_top":
+        (pillar_dir / "_tops" / "base" / "securedrop.top").write_text("base: {}\n")
+    elif changed_input == "config":
+        config.write_text('{"environment": "staging"}')
+    else:
+        Updater.subprocess.check_output.return_value = "securedrop-workstation-dom0-config-1.9.0"
+
+    Updater.apply_dom0_state()
+    assert mocked_run.call_count == 2
+
+
+@mock.patch("sdw_updater.Supervisor.check_run")
+def test_apply_dom0_state_forced(mocked_run, dom0_state_inputs):
+    Updater.apply_dom0_state()
+    Updater.clear_dom0_state_digest()
+    Updater.apply_dom0_state()
+    assert mocked_run.call_count == 2
+
+
+@mock.patch("sdw_updater.Supervisor.check_run")
+def test_apply_dom0_state_reapplied_after_max_age(mocked_run, dom0_state_inputs):
+    Updater.apply_dom0_state()
+    with mock.patch("sdw_updater.Updater.DOM0_STATE_MAX_AGE", timedelta(0)):
+        Updater.apply_dom0_state()
+    assert mocked_run.call_count == 2
+
+
+@mock.patch(
+    "sdw_updater.Supervisor.check_run", side_effect=subprocess.CalledProcessError(1, "qubesctl")
+)
+def test_apply_dom0_state_not_skipped_after_failure(mocked_run, dom0_state_inputs):
+    Updater.apply_dom0_state()
+    Updater.apply_dom0_state()
+    assert mocked_run.call_count == 2
+
+
+@pytest.fixture
+def template_sources(tmp_path):
+    """
+    Fake package source inputs for templates
+    """
+    sources = tmp_path / "apt_freedom_press.sources.j2"
+    sources.write_text("URIs: https://apt.freedom.press\n")
+    with mock.patch("sdw_updater.Updater.TEMPLATE_SOURCE_INPUT_PATHS", [str(sources)]):
+        yield sources
+
+
+def _write_prefetched(updates_pending, prefetched=None):
+    """
+    Record a background download for each template in `updates_pending`,
+    which tells whether it found updates for the template.
+    """
+    Updater._write_prefetch_state(
+        {
+            "prefetched": (prefetched or datetime.now()).strftime(Updater.DATE_FORMAT),
+            "dom0": None,
+            "templates": {
+                template: {
+                    "status": UpdateStatus.UPDATES_OK.value,
+                    "updates_pending": pending,
+                    "fingerprint": Updater._get_template_fingerprint(template),
+                }
+                for template, pending in updates_pending.items()
+            },
+        }
+    )
+
+
+def test_get_templates_to_update_without_history(template_sources):
+    assert Updater._get_templates_to_update(["tpl2", "tpl1"]) == ["tpl1", "tpl2"]
+
+
+def test_get_templates_to_update_recently_updated(template_sources):
+    """
+    When a template was updated successfully, but has not been checked for
+    updates since
+    Then it is updated again
+    """
+    Updater._write_template_fingerprints(["tpl1"])
+    assert Updater._get_templates_to_update(["tpl1"]) == ["tpl1"]
+
+
+def test_get_templates_to_update_skips_up_to_date_templates(template_sources):
+    """
+    When a recent background download found no updates for a template
+    Then it is skipped
+    """
+    _write_prefetched({"tpl1": False, "tpl2": True})
+    assert Updater._get_templates_to_update(["tpl1", "tpl2", "tpl3"]) == ["tpl2", "tpl3"]
+
+
+def test_get_templates_to_update_sources_changed(template_sources):
+    _write_prefetched({"tpl1": False})
+    template_sources.write_text("URIs: https://apt-test.freedom.press\n")
+    assert Updater._get_templates_to_update(["tpl1"]) == ["tpl1"]
+
+
+@pytest.mark.parametrize(
+    "age", [Updater.TEMPLATE_SKIP_MAX_AGE, Updater.PREFETCH_MAX_AGE + timedelta(1)]
+)
+def test_get_templates_to_update_prefetch_too_old(template_sources, age):
+    """
+    When a background download found no updates for a template, but not recently
+    Then the template is updated, as updates may have been published since
+    """
+    _write_prefetched({"tpl1": False}, prefetched=datetime.now() - age)
+    assert Updater._get_templates_to_update(["tpl1"]) == ["tpl1"]
+
+
+def test_get_templates_to_update_refresh_all(template_sources):
+    _write_prefetched({"tpl1": False})
+    Updater.clear_template_fingerprints()
+    assert Updater._get_templates_to_update(["tpl1"]) == ["tpl1"]
+
+
+def test_get_templates_to_update_completed(template_sources):
+    """
+    When templates were updated by the previous, incomplete run
+    Then they are skipped
+    """
+    assert Updater._get_templates_to_update(["tpl1", "tpl2"], completed={"tpl1"}) == ["tpl2"]
+
+
+def test_apply_templates_only_updates_changed_templates(template_sources, mocked_qubes_vm_update):
+    """
+    When only one template requires updates
+    Then only that template is passed to qubes-vm-update
+      And its successful update is recorded
+    """
+    _write_prefetched({"tpl1": False, "tpl2": True})
+    mocked_qubes_vm_update(stderr="tpl2 updating 0\ntpl2 done success")
+    with (
+        mock.patch("sdw_updater.Updater._get_current_templates", return_value={"tpl1", "tpl2"}),
+        mock.patch(
+            "sdw_updater.Updater._start_qubes_updater_proc",
+            wraps=Updater._start_qubes_updater_proc,
+        ) as mocked_start,
+    ):
+        result = Updater.apply_updates_templates()
+
+    assert result == UpdateStatus.UPDATES_OK
+    mocked_start.assert_called_once_with(["tpl2"], None)
+    # The background download is no longer relied upon for the updated template
+    assert Updater._get_templates_to_update(["tpl1", "tpl2"]) == ["tpl2"]
+
+
+def _feed_lines(*lines):
+    """
+    Fake for `Supervisor.run` that writes `lines` to the command's output
+    handler, then exits successfully.
+    """
+
+    def run(cmd, on_stdout, *args, **kwargs):
+        for line in lines:
+            on_stdout(line)
+        return 0
+
+    return run
+
+
+@mock.patch("sdw_updater.Updater._apply_updates_dom0", return_value=UpdateStatus.UPDATES_OK)
+def test_apply_updates_dom0_uses_prefetched_updates(apply_dom0):
+    """
+    When dom0 updates were downloaded in the background
+    Then they are installed
+      And the download result is only used once
+    """
+    with mock.patch("sdw_updater.Supervisor.run", side_effect=_feed_lines("Complete!")):
+        Updater._write_prefetch_state(
+            {"prefetched": datetime.now().strftime(Updater.DATE_FORMAT), "templates": {}}
+            | {"dom0": Updater._prefetch_dom0()}
+        )
+
+    assert Updater.apply_updates_dom0() == UpdateStatus.UPDATES_OK
+    apply_dom0.assert_called_once_with(from_cache=True)
+    assert Updater._pop_prefetched_dom0_result() is None
+
+
+@mock.patch("sdw_updater.Updater._apply_updates_dom0", return_value=UpdateStatus.UPDATES_OK)
+def test_apply_updates_dom0_prefetched_nothing_to_do(apply_dom0):
+    """
+    When no dom0 updates were available during a background download
+    Then dom0 is still checked for updates published since
+      And the update is timed
+    """
+    timings: dict[str, float] = {}
+    with mock.patch("sdw_updater.Supervisor.run", side_effect=_feed_lines("Nothing to do.")):
+        Updater._write_prefetch_state(
+            {"prefetched": datetime.now().strftime(Updater.DATE_FORMAT), "templates": {}}
+            | {"dom0": Updater._prefetch_dom0()}
+        )
+
+    assert Updater.apply_updates_dom0(timings) == UpdateStatus.UPDATES_OK
+    apply_dom0.assert_called_once_with(from_cache=False)
+    assert "dom0_apply" in timings
+
+
+@mock.patch("sdw_updater.Updater._apply_updates_dom0", return_value=UpdateStatus.UPDATES_OK)
+def test_apply_updates_dom0_ignores_stale_prefetch(apply_dom0):
+    prefetched = datetime.now() - Updater.PREFETCH_MAX_AGE
+    Updater._write_prefetch_state(
+        {
+            "prefetched": prefetched.strftime(Updater.DATE_FORMAT),
+            "dom0": {"status": UpdateStatus.UPDATES_OK.value, "updates_pending": False},
+            "templates": {},
+        }
+    )
+
+    assert Updater.apply_updates_dom0() == UpdateStatus.UPDATES_OK
+    apply_dom0.assert_called_once_with(from_cache=False)
+
+
+@pytest.mark.parametrize(
+    ("template", "output", "updates_pending"),
+    [
+        ("sd-large-bookworm-template", "0 upgraded, 0 newly installed, 0 to remove", False),
+        ("sd-large-bookworm-template", "3 upgraded, 1 newly installed, 0 to remove", True),
+        ("fedora-42-xfce", "Nothing to do.", False),
+        ("fedora-42-xfce", "Downloading Packages:", True),
+    ],
+)
+@mock.patch("subprocess.run", return_value=subprocess.CompletedProcess([], returncode=1))
+def test_prefetch_template(mocked_run, template, output, updates_pending, template_sources):
+    """
+    When updates are downloaded for a template that was not running
+    Then the download summary determines whether updates are pending
+      And the template is shut down again
+    """
+    with mock.patch("sdw_updater.Supervisor.run", side_effect=_feed_lines("Reading...", output)):
+        result = Updater._prefetch_template(template)
+
+    assert result["status"] == UpdateStatus.UPDATES_OK.value
+    assert result["updates_pending"] is updates_pending
+    mocked_run.assert_called_with(["qvm-shutdown", "--wait", template], check=False)
+
+
+@mock.patch("sdw_updater.Supervisor.run", return_value=1)
+@mock.patch("subprocess.run", return_value=subprocess.CompletedProcess([], returncode=0))
+def test_prefetch_template_failure(mocked_run, mocked_supervisor_run, template_sources):
+    """
+    When downloading updates for a running template fails
+    Then the template is not shut down
+      And the failure is not relied upon by the updater
+    """
+    result = Updater._prefetch_template("tpl1")
+    assert result["status"] == UpdateStatus.UPDATES_FAILED.value
+    assert mocked_run.call_count == 1
+
+    Updater._write_prefetch_state(
+        {
+            "prefetched": datetime.now().strftime(Updater.DATE_FORMAT),
+            "dom0": None,
+            "templates": {"tpl1": result},
+        }
+    )
+    assert Updater._read_prefetched_template_results({}) == {}
+
+
+@mock.patch("subprocess.run", return_value=subprocess.CompletedProcess([], returncode=0))
+def test_get_templates_to_update_uses_prefetch(mocked_run, template_sources):
+    """
+    When updates were downloaded in the background for some templates
+    Then only templates with downloaded updates are updated
+      And a change in package sources invalidates the download results
+    """
+
+    def run(cmd, on_stdout):
+        upgraded = 1 if "tpl1" in cmd else 0
+        on_stdout(f"{upgraded} upgraded, 0 newly installed, 0 to remove")
+        return 0
+
+    with (
+        mock.patch("sdw_updater.Updater._get_current_templates", return_value={"tpl1", "tpl2"}),
+        mock.patch("sdw_updater.Supervisor.run", side_effect=run),
+    ):
+        Updater.prefetch_updates()
+
+    assert Updater._get_templates_to_update(["tpl1", "tpl2"]) == ["tpl1"]
+
+    template_sources.write_text("URIs: https://apt-test.freedom.press\n")
+    assert Updater._get_templates_to_update(["tpl1", "tpl2"]) == ["tpl1", "tpl2"]
+
+
+@mock.patch("sdw_util.Util.can_obtain_lock", return_value=False)
+@mock.patch("sdw_updater.Updater._prefetch_dom0")
+def test_prefetch_updates_stops_when_updater_runs(prefetch_dom0, mocked_lock):
+    assert Updater.prefetch_updates() == UpdateStatus.UPDATES_REQUIRED
+    assert not prefetch_dom0.called
+
+
+@mock.patch("sdw_updater.Updater._apply_updates_dom0", return_value=UpdateStatus.UPDATES_OK)
+def test_apply_updates_dom0_timings(apply_dom0):
+    timings: dict[str, float] = {}
+    Updater.apply_updates_dom0(timings)
+    assert set(timings) == {"dom0_apply"}
+
+
+def test_qubes_updater_progress_parser_timings():
+    """
+    When templates report progress and complete
+    Then the time from their first progress report to completion is recorded
+    """
+    result: dict[str, UpdateStatus] = {}
+    timings: dict[str, float] = {}
+    parse = Updater._qubes_updater_progress_parser(result, ["tpl1", "tpl2"], timings=timings)
+    with mock.patch("time.monotonic", side_effect=[100.0, 107.5]):
+        parse("tpl1 updating 0")
+        parse("tpl1 done success")
+    parse("tpl2 done error")
+
+    assert timings == {"tpl1": 7.5}
+
+
+def test_qubes_updater_progress_parser_weights():
+    """
+    When templates are weighted by their expected update duration
+    Then overall progress reflects the weighted average of template progress
+      And templates without a weight are weighted like the average template
+    """
+    progress_callback = mock.Mock()
+    parse = Updater._qubes_updater_progress_parser(
+        {}, ["tpl1", "tpl2", "tpl3"], progress_callback, weights={"tpl1": 300, "tpl2": 100}
+    )
+    parse("tpl1 updating 0")
+    parse("tpl1 updating 50.0")
+    progress_callback.assert_called_with(25)
+    parse("tpl3 updating 0")
+    parse("tpl3 updating 100.0")
+    progress_callback.assert_called_with(58)
+
+
+def test_qubes_updater_progress_parser_completed():
+    """
+    When templates are retried
+    Then those updated by an earlier attempt count as done
+    """
+    progress_callback = mock.Mock()
+    parse = Updater._qubes_updater_progress_parser(
+        {}, ["tpl2"], progress_callback, completed=["tpl1"]
+    )
+    parse("tpl2 updating 0")
+    parse("tpl2 updating 50.0")
+    progress_callback.assert_called_with(75)
+
+
+def test_qubes_updater_progress_parser_template_progress():
+    """
+    When templates report progress
+    Then changes in each template's progress are reported
+    """
+    template_progress_callback = mock.Mock()
+    parse = Updater._qubes_updater_progress_parser(
+        {}, ["tpl1", "tpl2"], template_progress_callback=template_progress_callback
+    )
+    parse("tpl1 updating 0")
+    parse("tpl1 updating 40.2")
+    parse("tpl1 updating 40.7")
+    parse("tpl1 done success")
+    parse("tpl2 updating 0")
+    parse("tpl2 done error")
+    assert template_progress_callback.call_args_list == [
+        mock.call("tpl1", 0),
+        mock.call("tpl1", 40),
+        mock.call("tpl1", 100),
+        mock.call("tpl2", 0),
+    ]
+
+
+@pytest.fixture
+def qubes_memory():
+    """
+    Fakes the Qubes admin API: templates tpl1-tpl5 each start with 400 MiB and
+    may grow to 4 GiB, and the available memory is set with `set_memory`
+    (free Xen memory and current memory of a running qube, in KiB).
+    """
+    app = mock.Mock()
+    templates = {f"tpl{i}": mock.Mock(memory=400, maxmem=4000) for i in range(1, 6)}
+    running = mock.Mock(klass="AppVM", memory=1000)
+    running.is_running.return_value = True
+    app.domains.__getitem__ = lambda self, name: templates[name]
+    app.domains.__iter__ = lambda self: iter([running])
+
+    def set_memory(free, running_mem=1000 * 1024):
+        app.host.get_free_xen_memory.return_value = free
+        running.get_mem.return_value = running_mem
+
+    qubesadmin = mock.Mock()
+    qubesadmin.Qubes.return_value = app
+    with mock.patch.dict("sys.modules", {"qubesadmin": qubesadmin}):
+        yield set_memory
+
+
+@pytest.mark.parametrize(
+    ("free", "running_mem", "max_concurrency", "expected"),
+    [
+        # 3 GiB beyond the reserve fit three templates of 800 MiB each
+        (5 * 1024**2, 1000 * 1024, None, 3),
+        # Memory the running qube can give up is available too
+        (4 * 1024**2, 2000 * 1024, None, 3),
+        (5 * 1024**2, 1000 * 1024, 2, 2),
+        (10 * 1024**2, 1000 * 1024, None, 5),
+        # At least one template is always updated
+        (1024**2, 1000 * 1024, None, 1),
+    ],
+)
+def test_get_template_concurrency(qubes_memory, free, running_mem, max_concurrency, expected):
+    qubes_memory(free, running_mem)
+    templates = ["tpl1", "tpl2", "tpl3", "tpl4", "tpl5"]
+    assert Updater._get_template_concurrency(templates, max_concurrency) == expected
+
+
+@pytest.mark.parametrize("max_concurrency", [None, 2])
+@mock.patch("sdw_updater.Updater.sdlog.warning")
+def test_get_template_concurrency_unknown(mocked_warning, max_concurrency):
+    """
+    When the available memory cannot be determined
+    Then the concurrency is left to qubes-vm-update, or the given maximum
+    """
+    with mock.patch.dict("sys.modules", {"qubesadmin": None}):
+        assert Updater._get_template_concurrency(["tpl1"], max_concurrency) == max_concurrency
+    assert mocked_warning.called
+
+
+def test_get_template_update_memory():
+    assert Updater._get_template_update_memory(mock.Mock(memory=400, maxmem=4000)) == 800 * 1024
+    assert Updater._get_template_update_memory(mock.Mock(memory=400, maxmem=600)) == 600 * 1024
+    # Memory balancing disabled
+    assert Updater._get_template_update_memory(mock.Mock(memory=400, maxmem=0)) == 400 * 1024
+
+
+@mock.patch("sdw_updater.Supervisor.start")
+def test_start_qubes_updater_proc_max_concurrency(mocked_start):
+    Updater._start_qubes_updater_proc(["tpl1", "tpl2"], 2)
+    assert mocked_start.call_args[0][0][-4:] == ["--targets", "tpl1,tpl2", "--max-concurrency", "2"]
+    Updater._start_qubes_updater_proc(["tpl1", "tpl2"])
+    assert "--max-concurrency" not in mocked_start.call_args[0][0]
+
+
+@pytest.fixture
+def qubes_vm_update_attempts():
+    """
+    Fakes qubes-vm-update: each run reports the next list of progress lines,
+    the watchdog is then checked, and the templates each run was started with
+    are recorded.
+    """
+    attempts: list[list[str]] = []
+    started: list[list[str]] = []
+
+    def start(templates, max_concurrency=None):
+        started.append(list(templates))
+        return mock.Mock()
+
+    def supervise(proc, handlers, watchdog=None, **kwargs):
+        for line in attempts[len(started) - 1]:
+            handlers[proc.stderr](line)
+        if watchdog:
+            watchdog()
+        return 0
+
+    with (
+        mock.patch("sdw_updater.Updater._get_current_templates", return_value=["tpl1", "tpl2"]),
+        mock.patch(
+            "sdw_updater.Updater._get_templates_to_update",
+            side_effect=lambda templates, completed: sorted(templates),
+        ),
+        mock.patch("sdw_updater.Updater._start_qubes_updater_proc", side_effect=start),
+        mock.patch("sdw_updater.Supervisor.supervise", side_effect=supervise),
+        mock.patch("time.sleep") as sleep,
+        mock.patch("subprocess.run", return_value=mock.Mock(returncode=0)),
+    ):
+        yield attempts, started, sleep
+
+
+def test_apply_templates_retries_failed(qubes_vm_update_attempts):
+    """
+    When a template fails to update
+    Then only that template is updated again, after a delay
+      And the template updates succeed if the retry does
+    """
+    attempts, started, sleep = qubes_vm_update_attempts
+    attempts += [
+        ["tpl1 updating 0", "tpl1 done success", "tpl2 updating 0", "tpl2 done error"],
+        ["tpl2 updating 0", "tpl2 done success"],
+    ]
+    results: dict[str, UpdateStatus] = {}
+    assert Updater.apply_updates_templates(results=results) == UpdateStatus.UPDATES_OK
+    assert started == [["tpl1", "tpl2"], ["tpl2"]]
+    sleep.assert_called_once_with(Updater.TEMPLATE_RETRY_BACKOFF)
+    assert results == {"tpl1": UpdateStatus.UPDATES_OK, "tpl2": UpdateStatus.UPDATES_OK}
+
+
+def test_apply_templates_reverts_failed(qubes_vm_update_attempts):
+    """
+    When a template still fails to update after retries
+    Then it is reverted to its state before the update
+      And this is reported
+      And the revisions kept of each template are restored afterwards
+    """
+    attempts, _, _ = qubes_vm_update_attempts
+    attempts += [["tpl1 updating 0", "tpl1 done success", "tpl2 updating 0", "tpl2 done error"]]
+    attempts += [["tpl2 updating 0", "tpl2 done error"]] * Updater.TEMPLATE_UPDATE_RETRIES
+    snapshots = {"tpl1": Snapshots.Snapshot(["rev1"]), "tpl2": Snapshots.Snapshot(["rev1"])}
+    reverted: list[str] = []
+    with (
+        mock.patch("sdw_updater.Snapshots.record", return_value=snapshots) as record,
+        mock.patch("sdw_updater.Snapshots.revert", return_value=["tpl2"]) as revert,
+        mock.patch("sdw_updater.Snapshots.release") as release,
+    ):
+        result = Updater.apply_updates_templates(reverted=reverted)
+    assert result == UpdateStatus.UPDATES_FAILED
+    record.assert_called_once_with(["tpl1", "tpl2"])
+    revert.assert_called_once_with(snapshots, ["tpl2"])
+    release.assert_called_once_with(snapshots)
+    assert reverted == ["tpl2"]
+
+
+def test_apply_templates_concurrency(qubes_memory, qubes_vm_update_attempts):
+    """
+    When templates are retried
+    Then the concurrency of each attempt is based on the templates left
+      And is recorded
+    """
+    qubes_memory(5 * 1024**2)
+    attempts, started, _ = qubes_vm_update_attempts
+    attempts += [
+        ["tpl1 updating 0", "tpl1 done success", "tpl2 updating 0", "tpl2 done error"],
+        ["tpl2 updating 0", "tpl2 done success"],
+    ]
+    concurrency: list[int] = []
+    assert Updater.apply_updates_templates(concurrency=concurrency) == UpdateStatus.UPDATES_OK
+    assert concurrency == [2, 1]
+
+
+@mock.patch("sdw_updater.Updater.sdlog.error")
+def test_apply_templates_not_enough_storage(mocked_error, qubes_vm_update_attempts):
+    """
+    When the templates to update are not expected to fit in storage
+    Then no template is updated
+      And the shortage is logged
+    """
+    _, started, _ = qubes_vm_update_attempts
+    shortage = "Not enough space in root volume of tpl1: 1.5 GiB required, 0.5 GiB available"
+    with mock.patch("sdw_updater.Preflight.check_storage", return_value=[shortage]) as check:
+        result = Updater.apply_updates_templates(expected_growth={"tpl1": 1024**3})
+    assert result == UpdateStatus.UPDATES_FAILED
+    check.assert_called_once_with(["tpl1", "tpl2"], {"tpl1": 1024**3})
+    assert started == []
+    mocked_error.assert_called_with(shortage)
+
+
+def test_apply_templates_retries_with_backoff(qubes_vm_update_attempts):
+    """
+    When a template keeps failing to update
+    Then it is retried TEMPLATE_UPDATE_RETRIES times, with exponential backoff
+    """
+    attempts, started, sleep = qubes_vm_update_attempts
+    attempts += [["tpl1 done success", "tpl2 done error"]] + [["tpl2 done error"]] * 2
+    assert Updater.apply_updates_templates() == UpdateStatus.UPDATES_FAILED
+    assert started == [["tpl1", "tpl2"], ["tpl2"], ["tpl2"]]
+    assert sleep.call_args_list == [
+        mock.call(Updater.TEMPLATE_RETRY_BACKOFF),
+        mock.call(Updater.TEMPLATE_RETRY_BACKOFF * 2),
+    ]
+
+
+@mock.patch("sdw_updater.Updater.TEMPLATE_RETRY_BUDGET", 1)
+def test_apply_templates_retry_budget(qubes_vm_update_attempts):
+    """
+    When more templates fail than the retry budget allows for
+    Then only as many template updates as the budget allows are retried
+    """
+    attempts, started, _ = qubes_vm_update_attempts
+    attempts += [["tpl1 done error", "tpl2 done error"], ["tpl1 done error"]]
+    assert Updater.apply_updates_templates() == UpdateStatus.UPDATES_FAILED
+    assert started == [["tpl1", "tpl2"], ["tpl1"]]
+
+
+def test_apply_templates_retries_stalled(qubes_vm_update_attempts):
+    """
+    When qubes-vm-update is stopped before a template update completed
+    Then that template is failed, and retried
+    """
+    attempts, started, _ = qubes_vm_update_attempts
+    attempts += [["tpl1 done success", "tpl2 updating 0"], ["tpl2 done success"]]
+    assert Updater.apply_updates_templates() == UpdateStatus.UPDATES_OK
+    assert started == [["tpl1", "tpl2"], ["tpl2"]]
+
+
+@mock.patch("sdw_updater.Updater.TEMPLATE_STALL_TIMEOUT", 0)
+@mock.patch("sdw_updater.Updater.TEMPLATE_UPDATE_RETRIES", 0)
+@pytest.mark.parametrize("shutdown_returncode", [0, 1])
+def test_apply_templates_stops_stalled(shutdown_returncode, qubes_vm_update_attempts):
+    """
+    When a template stalls before reporting any progress
+    Then qubes-vm-update is stopped
+      And the template is shut down, stopping the update inside it
+      And it is killed if it does not shut down
+    """
+    attempts, _, _ = qubes_vm_update_attempts
+    attempts += [["tpl1 updating 0", "tpl1 done success"]]
+    with mock.patch(
+        "subprocess.run", return_value=mock.Mock(returncode=shutdown_returncode)
+    ) as run:
+        assert Updater.apply_updates_templates() == UpdateStatus.UPDATES_FAILED
+    expected = [
+        mock.call(
+            ["qvm-shutdown", "--wait", "--timeout", str(Updater.TEMPLATE_SHUTDOWN_TIMEOUT), "tpl2"],
+            check=False,
+        )
+    ]
+    if shutdown_returncode:
+        expected.append(mock.call(["qvm-kill", "tpl2"], check=False))
+    assert run.call_args_list == expected
+
+
+def test_apply_templates_not_stalled(qubes_vm_update_attempts):
+    """
+    When template updates complete without stalling
+    Then no template is shut down
+    """
+    attempts, _, _ = qubes_vm_update_attempts
+    attempts += [["tpl1 updating 0", "tpl1 done success", "tpl2 updating 0", "tpl2 done success"]]
+    with mock.patch("subprocess.run") as run:
+        assert Updater.apply_updates_templates() == UpdateStatus.UPDATES_OK
+    assert not run.called
+
+
+def test_apply_templates_cancelled(qubes_vm_update_attempts):
+    """
+    When template updates are cancelled
+    Then the templates still being updated are stopped
+      And they are not retried
+    """
+    attempts, started, sleep = qubes_vm_update_attempts
+    attempts += [["tpl1 updating 0", "tpl1 done success", "tpl2 updating 0"]]
+    with mock.patch("subprocess.run", return_value=mock.Mock(returncode=0)) as run:
+        result = Updater.apply_updates_templates(cancel=lambda: True)
+    assert result == UpdateStatus.UPDATES_FAILED
+    assert started == [["tpl1", "tpl2"]]
+    assert not sleep.called
+    assert run.call_args.args[0][-1] == "tpl2"
+
+
+@mock.patch("sdw_updater.Updater.TEMPLATE_UPDATE_DEADLINE", 0)
+def test_apply_templates_deadline(qubes_vm_update_attempts):
+    """
+    When template updates did not complete by the deadline
+    Then they are not retried
+    """
+    attempts, started, sleep = qubes_vm_update_attempts
+    attempts += [["tpl1 done success", "tpl2 updating 0"]]
+    assert Updater.apply_updates_templates() == UpdateStatus.UPDATES_FAILED
+    assert started == [["tpl1", "tpl2"]]
+    assert not sleep.called
+
+
+def test_qubes_updater_progress_parser_watchdog():
+    watchdog = mock.Mock()
+    parse = Updater._qubes_updater_progress_parser({}, ["tpl1"], watchdog=watchdog)
+    parse("tpl1 updating 0")
+    parse("tpl1 updating 0.5")
+    parse("tpl1 done success")
+    assert watchdog.progress.call_args_list == [mock.call("tpl1")] * 2
+    watchdog.done.assert_called_once_with("tpl1")
+
+
+def test_qubes_updater_progress_parser_benchmark():
+    """
+    Microbenchmark: a synthetic stream of 300,000 progress lines across five
+    templates is parsed quickly, and results in no more progress events than
+    there are distinct percentages.
+    """
+    templates = [f"tpl{i}" for i in range(5)]
+    steps = 60_000
+    lines = [f"{template} updating 0" for template in templates]
+    lines += [
+        f"{template} updating {step * 100 / steps:.4f}"
+        for step in range(steps)
+        for template in templates
+    ]
+    lines += [f"{template} done success" for template in templates]
+
+    events = mock.Mock()
+    progress = Progress.CoalescedProgress(events)
+    parse = Updater._qubes_updater_progress_parser({}, templates, progress)
+
+    start = time.perf_counter()
+    for line in lines:
+        parse(line)
+    progress.flush()
+    elapsed = time.perf_counter() - start
+
+    assert events.call_count <= 100, f"{events.call_count} progress events"
+    assert events.call_args == call(99)
+    assert (
+        elapsed < 10
+    ), f"{len(lines)} lines in {elapsed:.2f}s ({len(lines) / elapsed:.0f} lines/s)"
+
+
+def test_dom0_packages_changed_since_status_update(tmp_path):
+    rpmdb = tmp_path / "rpmdb.sqlite"
+    with mock.patch("sdw_updater.Updater.RPMDB_PATHS", [str(tmp_path / "missing"), str(rpmdb)]):
+        # No update status, or no RPM database
+        assert Updater.dom0_packages_changed_since_status_update()
+        Updater._write_updates_status_flag_to_disk(UpdateStatus.UPDATES_OK)
+        assert Updater.dom0_packages_changed_since_status_update()
+
+        rpmdb.touch()
+        os.utime(rpmdb, (time.time() - 60, time.time() - 60))
+        assert not Updater.dom0_packages_changed_since_status_update()
+
+        rpmdb.touch()
+        assert Updater.dom0_packages_changed_since_status_update()
+
+
+@pytest.mark.parametrize(
+    ("status", "age", "reboot_performed", "expected"),
+    [
+        (UpdateStatus.UPDATES_OK, timedelta(hours=1), True, True),
+        (UpdateStatus.UPDATES_OK, timedelta(hours=9), True, False),
+        (UpdateStatus.REBOOT_REQUIRED, timedelta(hours=1), True, True),
+        (UpdateStatus.REBOOT_REQUIRED, timedelta(hours=1), False, False),
+        (UpdateStatus.UPDATES_REQUIRED, timedelta(hours=1), True, False),
+        (UpdateStatus.UPDATES_FAILED, timedelta(hours=1), True, False),
+    ],
+)
+@mock.patch("sdw_updater.Updater._write_updates_status_flag_to_disk")
+def test_inbox_launch_expected(write_status, status, age, reboot_performed, expected):
+    flag = {
+        "status": status.value,
+        "last_status_update": (datetime.now() - age).strftime(Updater.DATE_FORMAT),
+    }
+    with (
+        mock.patch("sdw_updater.Updater.read_dom0_update_flag_from_disk", return_value=flag),
+        mock.patch(
+            "sdw_updater.Updater.last_required_reboot_performed", return_value=reboot_performed
+        ),
+    ):
+        assert Updater.inbox_launch_expected(8 * 3600) == expected
+        assert Updater.should_launch_updater(8 * 3600) != expected
+    # Unlike should_launch_updater, the status on disk is not updated
+    assert write_status.call_count == (status == UpdateStatus.REBOOT_REQUIRED and expected)
+
+
+def test_inbox_launch_expected_no_status():
+    assert not Updater.inbox_launch_expected(8 * 3600)
+
+
+def test_get_dom0_packages_key(tmp_path):
+    rpmdb = tmp_path / "rpmdb.sqlite"
+    with mock.patch("sdw_updater.Updater.RPMDB_PATHS", [str(tmp_path / "missing"), str(rpmdb)]):
+        assert Updater.get_dom0_packages_key() is None
+        rpmdb.touch()
+        key = Updater.get_dom0_packages_key()
+        assert key is not None
+        os.utime(rpmdb, ns=(0, 0))
+        assert Updater.get_dom0_packages_key() != key
+
+
+@pytest.mark.parametrize(
+    ("migration_required", "state_current", "updates_pending", "up_to_date"),
+    [
+        (False, True, False, True),
+        (True, True, False, False),
+        (False, False, False, False),
+        (False, True, True, False),
+    ],
+)
+def test_is_dom0_up_to_date(migration_required, state_current, updates_pending, up_to_date):
+    with (
+        mock.patch("sdw_updater.Updater.migration_is_required", return_value=migration_required),
+        mock.patch("sdw_updater.Updater._get_dom0_state_digest", return_value="digest"),
+        mock.patch("sdw_updater.Updater._is_dom0_state_current", return_value=state_current),
+        mock.patch(
+            "sdw_updater.Updater._prefetch_dom0",
+            return_value={
+                "status": UpdateStatus.UPDATES_OK.value,
+                "updates_pending": updates_pending,
+            },
+        ),
+    ):
+        assert Updater.is_dom0_up_to_date() == up_to_date
@@ -8,7 +8,7 @@ try:
 except ImportError:
     from PyQt5.QtWidgets import QApplication  # type: ignore [no-redef]
 
-from sdw_updater import UpdaterApp, strings
+from sdw_updater import Progress, UpdaterApp, strings
 from sdw_updater.Updater import UpdateStatus, overall_update_status
 
 
@@ -112,54 +112,76 @@ def test_run_full_update_success_no_migration(
     assert overall_update_status(results) == UpdateStatus.UPDATES_OK
 
 
-@mock.patch("sdw_util.Util.get_qubes_version", return_value="4.1")
-@mock.patch("sdw_updater.UpdaterApp.subprocess.check_output", return_value=b"none")
-def test_netcheck_no_network_should_fail(mocked_output, mocked_qubes_version):
-    """
-    When the host machine has no network connectivity
-    Then the error is logged
-     And netcheck returns False
-    """
-    assert not UpdaterApp._is_netcheck_successful()
-
-
-@mock.patch("sdw_util.Util.get_qubes_version", return_value=None)
-@mock.patch("sdw_updater.UpdaterApp.logger.error")
-def test_netcheck_no_qubes_should_fail_with_error(mocked_error, mocked_qubes_version):
+@mock.patch("sdw_updater.Updater.apply_updates_dom0", return_value=UpdateStatus.UPDATES_OK)
+@mock.patch("sdw_updater.Updater.apply_dom0_state", return_value=UpdateStatus.UPDATES_OK)
+@mock.patch("sdw_updater.Updater.migration_is_required", return_value=False)
+@mock.patch("sdw_updater.Updater.apply_updates_templates", return_value=UpdateStatus.UPDATES_OK)
+def test_run_full_update_reports_time_remaining(
+    apply_updates_templates_mock,
+    migration_required_mock,
+    apply_dom0_state_mock,
+    apply_updates_dom0_mock,
+):
     """
-    When the network connectivity check is run outside of Qubes
-    Then the check should return not succeed
-     And an error should be logged
+    When updates are applied
+    Then progress and the estimated time remaining are reported for each phase
+      And the full install is not part of the estimate if it does not run
     """
-    assert not UpdaterApp._is_netcheck_successful()
-    assert mocked_error.called
+    thread = UpdaterApp.UpgradeThread()
+    progress, eta = mock.Mock(), mock.Mock()
+    thread.progress_signal.connect(progress)
+    thread.eta_signal.connect(eta)
+
+    thread.run_full_update()
+
+    assert eta.call_count == 3
+    expected = thread.pipeline.progress_model.expected
+    assert eta.call_args_list[0] == mock.call(round(sum(expected.values())))
+    # Earlier phases completed instantly, so templates are expected to be quicker
+    assert eta.call_args_list[-1] == mock.call(
+        round(expected["templates"] * Progress.MIN_SPEED_FACTOR)
+    )
+    assert progress.call_count == 3
 
 
-@mock.patch("subprocess.check_output", return_value=b"full")
-@mock.patch("sdw_util.Util.get_qubes_version", return_value="4.1")
-def test_netcheck_should_succeed(mocked_qubes_version, mocked_output):
-    """
-    When the network connectivity check is run in Qubes
-     And nmcli detects a connection
-    Then the network check should succeed
-    """
-    assert UpdaterApp._is_netcheck_successful()
+@pytest.mark.parametrize(
+    ("seconds", "expected"),
+    [
+        (0, strings.progress_format_less_than_a_minute),
+        (60, strings.progress_format_less_than_a_minute),
+        (61, strings.progress_format_minutes.format(minutes=2)),
+        (600, strings.progress_format_minutes.format(minutes=10)),
+    ],
+)
+def test_format_time_remaining(seconds, expected):
+    assert UpdaterApp._format_time_remaining(seconds) == expected
 
 
 @mock.patch("sdw_util.Util.get_qubes_version", return_value="4.1")
-@mock.patch("sdw_updater.UpdaterApp.logger.error")
+@mock.patch("sdw_updater.Preflight.logger.error")
 @mock.patch("subprocess.check_output", return_value=b"none")
+@mock.patch("sdw_updater.Preflight.get_pool_free_space", return_value=None)
+@mock.patch("sdw_updater.Pipeline.UpdatePipeline.run")
+# Run the thread synchronously, so that its signals are delivered immediately
+@mock.patch.object(UpdaterApp.UpgradeThread, "start", UpdaterApp.UpgradeThread.run)
 def test_updater_app_with_no_connectivity_should_error(
-    mocked_output, mocked_error, mocked_qubes_version
+    mocked_pipeline_run,
+    mocked_pool_space,
+    mocked_output,
+    mocked_error,
+    mocked_qubes_version,
 ):
     """
     When the netcheck method is run
      And the network check is unsuccessful
     Then the network error view should be visible
+     And no updates are applied
     """
     updater_app_dialog = UpdaterApp.UpdaterApp()
     updater_app_dialog._check_network_and_update()
     assert is_network_fail_view(updater_app_dialog)
+    assert mocked_error.called
+    assert not mocked_pipeline_run.called
 
 
 @mock.patch("sdw_util.Util.get_qubes_version", return_value="4.1")
@@ -193,6 +215,20 @@ def test_updater_app_with_override(mocked_thread):
     assert is_progress_view(updater_app_dialog)
 
 
+@mock.patch("sdw_updater.UpdaterApp.launch_securedrop_inbox")
+def test_updater_app_open_inbox(mocked_launch):
+    """
+    When updates have completed and the inbox is opened
+    Then the dialog is hidden while the inbox launches
+    """
+    updater_app_dialog = UpdaterApp.UpdaterApp()
+    updater_app_dialog.progress_timer = mock.Mock()
+    updater_app_dialog.upgrade_status({"recommended_action": UpdateStatus.UPDATES_OK})
+    updater_app_dialog.inboxOpenButton.click()
+    assert mocked_launch.called
+    assert not updater_app_dialog.isVisible()
+
+
 def is_progress_view(dialog: UpdaterApp.UpdaterApp) -> bool:
     """
     Helper method to test assumptions about Dialog UI state.
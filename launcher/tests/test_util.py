@@ -1,3 +1,4 @@
+import fcntl
 import os
 import re
 import subprocess
@@ -106,6 +107,20 @@ def test_cannot_obtain_shared_lock_when_busy(mocked_info, mocked_warning, mocked
             assert re.search(BUSY_LOCK_REGEX, error_string) is not None
 
 
+@mock.patch("sdw_util.Util.sdlog.error")
+def test_lock_conflict_not_logged(mocked_error, tmp_path):
+    """
+    When a lock conflict is expected
+    Then it is not logged as an error
+    """
+    with mock.patch("sdw_util.Util.LOCK_DIRECTORY", tmp_path):
+        basename = "test-conflict.lock"
+        Util.obtain_lock(basename)
+        with mock.patch("fcntl.lockf", side_effect=OSError()):
+            assert Util.can_obtain_lock(basename, log=False) is False
+    assert not mocked_error.called
+
+
 @mock.patch("sdw_util.Util.sdlog.error")
 @mock.patch("sdw_util.Util.sdlog.warning")
 @mock.patch("sdw_util.Util.sdlog.info")
@@ -304,3 +319,18 @@ def test_is_sdapp_halted_error(patched_subprocess, os_release_fixture, version_c
     """
 
     assert not Util.is_sdapp_halted()
+
+
+def test_wait_for_lock(tmp_path):
+    """
+    Test whether waiting for a lock returns once the lock is available, or
+    when there is no lockfile at all.
+    """
+    with mock.patch("sdw_util.Util.LOCK_DIRECTORY", tmp_path):
+        Util.wait_for_lock("404.lock")
+
+        basename = "test-wait.lock"
+        Util.obtain_lock(basename)
+        with mock.patch("fcntl.lockf") as mocked_lockf:
+            Util.wait_for_lock(basename)
+            assert mocked_lockf.call_args[0][1] == fcntl.LOCK_SH
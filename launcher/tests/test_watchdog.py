@@ -0,0 +1,163 @@
+from unittest import mock
+
+from sdw_updater import Watchdog
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@mock.patch("sdw_updater.Watchdog.sdlog")
+def test_watchdog_stalled_template(mocked_log):
+    """
+    When one template stops reporting progress while another progresses
+    Then the stalled template is flagged and logged
+      And the update continues
+    """
+    clock = FakeClock()
+    watchdog = Watchdog.StallWatchdog(stall_timeout=60, clock=clock)
+    watchdog.progress("tpl1")
+    watchdog.progress("tpl2")
+
+    clock.now += 30
+    watchdog.progress("tpl2")
+    assert watchdog.check()
+    assert watchdog.stalled == set()
+
+    clock.now += 40
+    assert watchdog.check()
+    assert watchdog.stalled == {"tpl1"}
+    mocked_log.warning.assert_called_once_with(
+        "Stall detected: no progress updating template 'tpl1' for 70s"
+    )
+
+    # Logged once per stall
+    watchdog.check()
+    assert mocked_log.warning.call_count == 1
+
+
+@mock.patch("sdw_updater.Watchdog.sdlog")
+def test_watchdog_all_stalled(mocked_log):
+    """
+    When all templates still being updated have stalled
+    Then the update is stopped
+    """
+    clock = FakeClock()
+    watchdog = Watchdog.StallWatchdog(stall_timeout=60, clock=clock)
+    watchdog.progress("tpl1")
+    watchdog.progress("tpl2")
+    watchdog.done("tpl2")
+
+    clock.now += 60
+    assert not watchdog.check()
+    assert watchdog.stalled == {"tpl1"}
+
+
+@mock.patch("sdw_updater.Watchdog.sdlog")
+def test_watchdog_progress_resumes(mocked_log):
+    clock = FakeClock()
+    watchdog = Watchdog.StallWatchdog(stall_timeout=60, clock=clock)
+    watchdog.progress("tpl1")
+    watchdog.progress("tpl2")
+    clock.now += 60
+    watchdog.progress("tpl2")
+    watchdog.check()
+
+    watchdog.progress("tpl1")
+    assert watchdog.stalled == set()
+    assert watchdog.check()
+
+
+@mock.patch("sdw_updater.Watchdog.sdlog")
+def test_watchdog_no_templates_dispatched(mocked_log):
+    """
+    When no template has been dispatched yet
+    Then nothing is considered stalled
+    """
+    clock = FakeClock()
+    watchdog = Watchdog.StallWatchdog(stall_timeout=60, clock=clock)
+    clock.now += 3600
+    assert watchdog.check()
+
+
+@mock.patch("sdw_updater.Watchdog.sdlog")
+def test_watchdog_stalled_before_output(mocked_log):
+    """
+    When a dispatched template reports no progress at all
+    Then it is flagged as stalled
+      And the update is stopped
+    """
+    clock = FakeClock()
+    watchdog = Watchdog.StallWatchdog(stall_timeout=60, clock=clock)
+    watchdog.dispatched(["tpl1"])
+    clock.now += 30
+    assert watchdog.check()
+
+    clock.now += 30
+    assert not watchdog.check()
+    assert watchdog.stalled == {"tpl1"}
+    assert watchdog.stopped
+    mocked_log.warning.assert_called_once_with(
+        "Stall detected: no progress updating template 'tpl1' for 60s"
+    )
+
+
+@mock.patch("sdw_updater.Watchdog.sdlog")
+def test_watchdog_queued_template(mocked_log):
+    """
+    When a template is queued behind another, which is progressing
+    Then its timeout restarts once the other template is done
+    """
+    clock = FakeClock()
+    watchdog = Watchdog.StallWatchdog(stall_timeout=60, clock=clock)
+    watchdog.dispatched(["tpl1", "tpl2"])
+    for _ in range(3):
+        clock.now += 30
+        watchdog.progress("tpl1")
+    assert watchdog.check()
+    assert watchdog.stalled == {"tpl2"}
+
+    watchdog.done("tpl1")
+    assert watchdog.stalled == set()
+    clock.now += 30
+    assert watchdog.check()
+
+    clock.now += 30
+    assert not watchdog.check()
+    assert watchdog.stalled == {"tpl2"}
+
+
+@mock.patch("sdw_updater.Watchdog.sdlog")
+def test_watchdog_cancelled(mocked_log):
+    """
+    When the update is cancelled
+    Then it is stopped, even though templates are progressing
+    """
+    cancel = mock.Mock(return_value=False)
+    watchdog = Watchdog.StallWatchdog(stall_timeout=60, clock=FakeClock(), cancel=cancel)
+    watchdog.dispatched(["tpl1"])
+    assert watchdog.check()
+
+    cancel.return_value = True
+    assert not watchdog.check()
+    assert watchdog.cancelled
+    assert watchdog.stalled == set()
+
+
+@mock.patch("sdw_updater.Watchdog.sdlog")
+def test_watchdog_deadline(mocked_log):
+    clock = FakeClock()
+    watchdog = Watchdog.StallWatchdog(stall_timeout=60, deadline=clock.now + 100, clock=clock)
+    watchdog.progress("tpl1")
+    clock.now += 50
+    watchdog.progress("tpl1")
+    assert watchdog.check()
+    assert not watchdog.deadline_expired
+
+    clock.now += 50
+    assert watchdog.deadline_expired
+    assert not watchdog.check()
@@ -110,6 +110,10 @@ install -m 755 files/sdw-notify.py %{buildroot}%{_bindir}/sdw-notify
 install -m 755 files/sdw-login.py %{buildroot}%{_bindir}/sdw-login
 install -m 644 files/sdw-notify.service %{buildroot}%{_userunitdir}/
 install -m 644 files/sdw-notify.timer %{buildroot}%{_userunitdir}/
+install -m 644 files/sdw-prefetch.service %{buildroot}%{_userunitdir}/
+install -m 644 files/sdw-prefetch.timer %{buildroot}%{_userunitdir}/
+install -m 644 files/sdw-background-update.service %{buildroot}%{_userunitdir}/
+install -m 644 files/sdw-background-update.timer %{buildroot}%{_userunitdir}/
 install -m 644 files/securedrop-logind-override-disable.service %{buildroot}%{_unitdir}/
 install -m 644 files/95-securedrop-systemd-user.preset %{buildroot}%{_userpresetdir}/
 
@@ -159,6 +163,10 @@ install -m 644 securedrop_salt/apt-test_freedom_press.sources.j2 %{buildroot}/sr
 %{_datadir}/icons/hicolor/scalable/apps/securedrop.svg
 %{_userunitdir}/sdw-notify.service
 %{_userunitdir}/sdw-notify.timer
+%{_userunitdir}/sdw-prefetch.service
+%{_userunitdir}/sdw-prefetch.timer
+%{_userunitdir}/sdw-background-update.service
+%{_userunitdir}/sdw-background-update.timer
 %{_userunitdir}/securedrop-user-xfce-settings.service
 %{_userunitdir}/securedrop-user-xfce-icon-size.service
 %{_unitdir}/securedrop-logind-override-disable.service
@@ -211,6 +219,12 @@ systemctl enable securedrop-logind-override-disable.service ||:
 # Enable notification timer
 %systemd_user_post sdw-notify.timer
 
+# Enable background update download timer
+%systemd_user_post sdw-prefetch.timer
+
+# Enable idle-time template update timer
+%systemd_user_post sdw-background-update.timer
+
 %preun
 # If we're uninstalling (vs upgrading)
 if [ $1 -eq 0 ]; then
@@ -218,6 +232,8 @@ if [ $1 -eq 0 ]; then
     %systemd_user_preun securedrop-user-xfce-icon-size.service
     %systemd_user_preun securedrop-user-xfce-settings.service
     %systemd_user_preun sdw-notify.timer
+    %systemd_user_preun sdw-prefetch.timer
+    %systemd_user_preun sdw-background-update.timer
 fi
 
 %changelog
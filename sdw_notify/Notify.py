@@ -3,20 +3,15 @@ Utility library for warning the user that security updates have not been applied
 in some time.
 """
 
-import os
 from datetime import datetime
 
-from sdw_util import Util
+from sdw_util import State, Util
 
 sdlog = Util.get_logger(module=__name__)
 
 # The directory where status files and logs are stored
 BASE_DIRECTORY = Util.BASE_DIRECTORY
 
-# The file and format that contains the timestamp of the last successful update
-LAST_UPDATED_FILE = os.path.join(BASE_DIRECTORY, "sdw-last-updated")
-LAST_UPDATED_FORMAT = "%Y-%m-%d %H:%M:%S"
-
 # The lockfile basename used to ensure this script can only be executed once.
 # Default path for lockfiles is specified in sdw_util
 LOCK_FILE = "sdw-notify.lock"
@@ -46,25 +41,13 @@ def is_update_check_necessary() -> bool:
     shown to the user, reminding them to check for available software updates
     using the preflight updater.
     """
-    last_updated_file_exists = os.path.exists(LAST_UPDATED_FILE)
     # For consistent logging
     grace_period_hours = UPTIME_GRACE_PERIOD / 60 / 60
     warning_threshold_hours = WARNING_THRESHOLD / 60 / 60
 
-    # Get timestamp from last update (if it exists)
-    if last_updated_file_exists:
-        with open(LAST_UPDATED_FILE) as f:
-            last_update_str = f.readline().splitlines()[0]
-        try:
-            last_update_time = datetime.strptime(last_update_str, LAST_UPDATED_FORMAT)
-        except ValueError:
-            sdlog.error(
-                f"Data in {LAST_UPDATED_FILE} not in the expected format. "
-                f"Expecting a timestamp in format '{LAST_UPDATED_FORMAT}'. "
-                "Showing security warning."
-            )
-            return True
-
+    # Get timestamp from last update (if it has been recorded)
+    last_update_time = State.read().last_updated
+    if last_update_time is not None:
         now = datetime.now()
         updated_seconds_ago = (now - last_update_time).total_seconds()
         updated_hours_ago = updated_seconds_ago / 60 / 60
@@ -72,9 +55,9 @@ def is_update_check_necessary() -> bool:
     uptime_seconds = get_uptime_seconds()
     uptime_hours = uptime_seconds / 60 / 60
 
-    if not last_updated_file_exists:
+    if last_update_time is None:
         sdlog.warning(
-            f"Timestamp file '{LAST_UPDATED_FILE}' does not exist. "
+            f"No successful update recorded in '{State.get_state_path()}'. "
             "Updater may never have run. Showing security warning."
         )
         return True
@@ -0,0 +1,124 @@
+"""
+Unattended template updates while the workstation is idle.
+
+Template updates take up most of a typical updater run. `run`, started
+periodically by a systemd timer (`sdw-updater --background`), applies them in
+the background while the workstation is idle: SecureDrop is not in use (sd-app
+is halted), and the machine is on AC power. If dom0 is up to date as well, the
+update status is then recorded as it would be by the updater, so that the next
+launch opens the inbox right away.
+
+A background update holds its own lock, Updater.BACKGROUND_LOCK_FILE, and is
+cancelled once the updater is started: templates still being updated are
+stopped and reverted, the updater waits for this, and then updates them
+itself, resuming from the templates the background update completed.
+"""
+
+from __future__ import annotations
+
+import os
+
+from sdw_updater import Checkpoint, Pipeline, Preflight, Updater
+from sdw_updater.Updater import UpdateStatus
+from sdw_util import Util
+
+POWER_SUPPLY_DIR = "/sys/class/power_supply"
+# Power supply types that indicate AC power when online
+AC_POWER_SUPPLY_TYPES = {"Mains", "USB"}
+
+logger = Util.get_logger(module=__name__)
+
+
+def run() -> UpdateStatus | None:
+    """
+    Update templates if the workstation is idle, and record the resulting
+    update status. Returns the status of the template updates, or None if
+    they were not attempted, or cancelled by the updater.
+    """
+    blockers = get_blockers()
+    if blockers:
+        logger.info(f"Skipping background update: {', '.join(blockers)}")
+        return None
+    if not Preflight.run_preflight().should_update:
+        return None  # Logged
+
+    cancelled = False
+
+    def cancel() -> bool:
+        nonlocal cancelled
+        if not cancelled and not Util.can_obtain_lock(Updater.LOCK_FILE, log=False):
+            logger.info("Updater is running, stopping background update")
+            cancelled = True
+        return cancelled
+
+    logger.info("Updating templates in the background")
+    status = Pipeline.UpdatePipeline(serve_status=True, cancel=cancel).run_templates()
+    if cancel():
+        # The updater takes over, and records the update status
+        return None
+    _record_status(status)
+    return status
+
+
+def get_blockers() -> list[str]:
+    """
+    Returns the reasons not to update in the background now, if any.
+    """
+    blockers = []
+    if not is_on_ac_power():
+        blockers.append("running on battery")
+    if not Util.is_sdapp_halted():
+        blockers.append("sd-app is not halted")
+    return blockers
+
+
+def is_on_ac_power() -> bool:
+    """
+    Returns False if the machine is running on battery: it has a battery, and
+    no AC adapter is online. Machines that report no power supplies, such as
+    most desktops, are on AC power.
+    """
+    try:
+        supplies = os.listdir(POWER_SUPPLY_DIR)
+    except OSError:
+        return True
+
+    has_battery = False
+    for supply in supplies:
+        supply_type = _read_power_supply(supply, "type")
+        if supply_type in AC_POWER_SUPPLY_TYPES and _read_power_supply(supply, "online") == "1":
+            return True
+        has_battery = has_battery or supply_type == "Battery"
+    return not has_battery
+
+
+def _read_power_supply(supply: str, attribute: str) -> str | None:
+    try:
+        with open(os.path.join(POWER_SUPPLY_DIR, supply, attribute)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _record_status(template_status: UpdateStatus) -> None:
+    """
+    Record the update status after templates were updated in the background.
+    The system is only up to date if dom0 is as well. A pending reboot is not
+    overridden.
+    """
+    if not Updater.last_required_reboot_performed():
+        logger.info("Reboot required, leaving the update status unchanged")
+        return
+
+    status: UpdateStatus
+    if template_status != UpdateStatus.UPDATES_OK:
+        status = template_status
+    elif Updater.is_dom0_up_to_date():
+        status = UpdateStatus.UPDATES_OK
+    else:
+        status = UpdateStatus.UPDATES_REQUIRED
+
+    Updater._write_updates_status_flag_to_disk(status)
+    if status == UpdateStatus.UPDATES_OK:
+        Updater._write_last_updated_flags_to_disk()
+        Checkpoint.clear()
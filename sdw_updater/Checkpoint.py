@@ -0,0 +1,155 @@
+"""
+Checkpoints for resuming updater runs that failed or were interrupted.
+
+As each phase of a run completes, its outcome is saved to CHECKPOINT_FILE with
+a key over the phase's inputs: the state of the dom0 package database for dom0
+updates, and the digest of the dom0 state inputs (Salt tree, config.json and
+dom0 config package version) for the dom0 state. Templates are recorded
+individually, with the fingerprint of their package sources.
+
+The next run resumes at the first phase without a matching checkpoint, and
+only updates templates that were not updated successfully. Checkpoints are
+cleared once a run completes, and are ignored after CHECKPOINT_MAX_AGE.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+from collections.abc import Callable, Mapping
+from datetime import datetime, timedelta
+from typing import Any
+
+from sdw_updater import Updater
+from sdw_updater.Updater import DATE_FORMAT, DEFAULT_HOME, UpdateStatus, get_dom0_path
+from sdw_util import Util
+
+CHECKPOINT_FILE = os.path.join(DEFAULT_HOME, "sdw-update-checkpoint")
+
+# A run is only resumed within the default update interval of the launcher, so
+# that its results are never older than those of a regular run would be
+CHECKPOINT_MAX_AGE = timedelta(hours=8)
+
+sdlog = Util.get_logger(module=__name__)
+
+
+class Checkpoint:
+    """
+    Outcomes of the phases and template updates completed so far in the
+    current run.
+    """
+
+    def __init__(
+        self,
+        started: str | None = None,
+        phases: dict[str, dict[str, Any]] | None = None,
+        templates: dict[str, str] | None = None,
+    ) -> None:
+        self.started = started or datetime.now().strftime(DATE_FORMAT)
+        # Status, input key and completion date of each completed phase
+        self.phases = phases or {}
+        # Package source fingerprint of each successfully updated template
+        self.templates = templates or {}
+
+    def completed(self, phase: str, get_key: Callable[[], str | None]) -> UpdateStatus | None:
+        """
+        Returns the status `phase` completed with, if it completed with the
+        inputs it has now (as returned by `get_key`), else None. A required
+        reboot is no longer reported once it has been performed.
+        """
+        checkpoint = self.phases.get(phase)
+        if checkpoint is None:
+            return None
+        key = get_key()
+        if key is None or checkpoint["key"] != key:
+            sdlog.info(f"Inputs of phase '{phase}' have changed since it completed")
+            return None
+
+        status = UpdateStatus(checkpoint["status"])
+        if status == UpdateStatus.REBOOT_REQUIRED and _rebooted_since(checkpoint["completed"]):
+            status = UpdateStatus.UPDATES_OK
+        return status
+
+    def complete(self, phase: str, key: str | None, status: UpdateStatus) -> None:
+        """
+        Record that `phase` completed with `status`, with inputs matching
+        `key`. Nothing is recorded if the inputs are unknown.
+        """
+        if key is None:
+            return
+        self.phases[phase] = {
+            "status": status.value,
+            "key": key,
+            "completed": datetime.now().strftime(DATE_FORMAT),
+        }
+        self._save()
+
+    def completed_templates(self) -> set[str]:
+        """
+        Returns the templates updated successfully, whose package sources have
+        not changed since.
+        """
+        return {
+            template
+            for template, fingerprint in self.templates.items()
+            if Updater._get_template_fingerprint(template) == fingerprint
+        }
+
+    def complete_templates(self, results: Mapping[str, UpdateStatus]) -> None:
+        """
+        Record the templates in `results` that were updated successfully.
+        """
+        for template, status in results.items():
+            if status == UpdateStatus.UPDATES_OK:
+                self.templates[template] = Updater._get_template_fingerprint(template)
+        self._save()
+
+    def _save(self) -> None:
+        checkpoint_file = get_dom0_path(CHECKPOINT_FILE)
+        try:
+            os.makedirs(os.path.dirname(checkpoint_file), exist_ok=True)
+            with open(checkpoint_file, "w") as f:
+                json.dump(
+                    {"started": self.started, "phases": self.phases, "templates": self.templates},
+                    f,
+                )
+        except Exception as e:
+            sdlog.error("Error writing update checkpoint")
+            sdlog.error(str(e))
+
+
+def load() -> Checkpoint:
+    """
+    Returns the checkpoint of the previous run, if it did not complete and is
+    recent enough to resume from, else an empty one.
+    """
+    try:
+        with open(get_dom0_path(CHECKPOINT_FILE)) as f:
+            contents = json.load(f)
+        started = datetime.strptime(contents["started"], DATE_FORMAT)
+    except FileNotFoundError:
+        return Checkpoint()
+    except Exception:
+        sdlog.warning("Ignoring unreadable update checkpoint")
+        return Checkpoint()
+
+    if datetime.now() - started >= CHECKPOINT_MAX_AGE:
+        sdlog.info("Previous incomplete run is too old to resume, starting over")
+        return Checkpoint()
+
+    sdlog.info(f"Resuming incomplete run started {contents['started']}")
+    return Checkpoint(contents["started"], contents["phases"], contents["templates"])
+
+
+def clear() -> None:
+    """
+    Forget the outcomes of the current run, so the next run starts over.
+    """
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(get_dom0_path(CHECKPOINT_FILE))
+
+
+def _rebooted_since(date: str) -> bool:
+    boot_time = datetime.now() - Updater._get_uptime()
+    return boot_time >= datetime.strptime(date, DATE_FORMAT)
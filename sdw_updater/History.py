@@ -0,0 +1,304 @@
+"""
+Timing history of updater runs.
+
+Each run of the updater appends one JSON line to HISTORY_FILE, recording when
+it started and finished, the status of each step, how long each phase took,
+how long each template took to update, and how many templates were updated at
+a time. The storage used by template updates and by the full Salt run is also
+recorded, so that the storage they will need can be checked beforehand (see
+`Preflight.check_storage`). Only the most recent MAX_HISTORY_RUNS runs are
+kept. `sdw-updater --stats` summarizes the history with `format_stats`.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from collections.abc import Collection, Iterator, Mapping
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any
+
+from sdw_updater import Preflight
+from sdw_updater.Updater import DATE_FORMAT, DEFAULT_HOME, UpdateStatus, get_dom0_path
+from sdw_util import Util
+
+HISTORY_FILE = os.path.join(DEFAULT_HOME, "sdw-update-history.jsonl")
+
+# Number of runs kept in the history
+MAX_HISTORY_RUNS = 200
+
+# Number of most recent runs compared against the rest to report trends
+RECENT_RUNS = 10
+
+# Number of successful runs with a given template concurrency required before
+# it is compared to others (see `best_template_concurrency`)
+MIN_CONCURRENCY_RUNS = 3
+
+# Number of most recent runs from which the expected storage growth is derived
+GROWTH_RUNS = 20
+
+# Order in which phases are reported
+PHASES = ["dom0_apply", "apply_dom0", "apply_all", "templates"]
+
+sdlog = Util.get_logger(module=__name__)
+
+
+class RunRecord:
+    """
+    Timings of a single updater run. Phases are timed with `phase`; per-step
+    durations recorded by the Updater library are added to `phases` and
+    `templates` directly, and the template concurrency of each attempt to
+    `template_concurrency`. Growth (bytes) of the default storage pool, and of
+    template root volumes, is measured with `measure_pool_growth` and
+    `measure_template_growth`. Templates reverted after failing to update are
+    added to `reverted_templates`.
+    """
+
+    def __init__(self) -> None:
+        self.started = datetime.now()
+        self._start = time.monotonic()
+        # Duration (seconds) of each phase, and of each template update
+        self.phases: dict[str, float] = {}
+        self.templates: dict[str, float] = {}
+        self.template_concurrency: list[int] = []
+        self.template_growth: dict[str, int] = {}
+        self.pool_growth: dict[str, int] = {}
+        self.reverted_templates: list[str] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.monotonic() - start
+
+    @contextmanager
+    def measure_pool_growth(self, name: str) -> Iterator[None]:
+        """
+        Record the growth of the default storage pool under `name`, if the
+        block completes and the pool usage is known.
+        """
+        usage_before = Preflight.get_pool_usage()
+        yield
+        usage_after = Preflight.get_pool_usage() if usage_before is not None else None
+        if usage_before is not None and usage_after is not None:
+            self.pool_growth[name] = max(0, usage_after - usage_before)
+
+    @contextmanager
+    def measure_template_growth(
+        self, templates: Collection[str], results: Mapping[str, UpdateStatus]
+    ) -> Iterator[None]:
+        """
+        Record the growth of the root volumes of `templates` that were updated
+        successfully, according to `results` once the block completes.
+        """
+        usage_before = Preflight.get_root_volume_usage(templates)
+        yield
+        updated = [
+            template
+            for template in usage_before
+            if results.get(template) == UpdateStatus.UPDATES_OK
+        ]
+        usage_after = Preflight.get_root_volume_usage(updated) if updated else {}
+        for template, usage in usage_after.items():
+            self.template_growth[template] = max(0, usage - usage_before[template])
+
+    def to_dict(self, results: dict[str, UpdateStatus]) -> dict[str, Any]:
+        return {
+            "started": self.started.strftime(DATE_FORMAT),
+            "finished": datetime.now().strftime(DATE_FORMAT),
+            "duration": round(time.monotonic() - self._start, 1),
+            "results": {step: status.value for step, status in results.items()},
+            "phases": {name: round(duration, 1) for name, duration in self.phases.items()},
+            "templates": {name: round(duration, 1) for name, duration in self.templates.items()},
+            # Of the first attempt, which updates most templates
+            "template_concurrency": (
+                self.template_concurrency[0] if self.template_concurrency else None
+            ),
+            "template_growth": self.template_growth,
+            "pool_growth": self.pool_growth,
+            "reverted_templates": self.reverted_templates,
+        }
+
+
+def record_run(record: RunRecord, results: dict[str, UpdateStatus]) -> None:
+    """
+    Append the timings of a finished run to the history, dropping the oldest
+    runs beyond MAX_HISTORY_RUNS.
+    """
+    history_file = get_dom0_path(HISTORY_FILE)
+    try:
+        runs = _read_lines(history_file)
+        runs.append(json.dumps(record.to_dict(results)) + "\n")
+        os.makedirs(os.path.dirname(history_file), exist_ok=True)
+        if len(runs) > MAX_HISTORY_RUNS:
+            with open(history_file, "w") as f:
+                f.writelines(runs[-MAX_HISTORY_RUNS:])
+        else:
+            with open(history_file, "a") as f:
+                f.write(runs[-1])
+    except Exception as e:
+        sdlog.error("Error writing update history")
+        sdlog.error(str(e))
+
+
+def read_history() -> list[dict[str, Any]]:
+    """
+    Returns the recorded runs, oldest first. Unreadable lines are skipped.
+    """
+    runs = []
+    for line in _read_lines(get_dom0_path(HISTORY_FILE)):
+        try:
+            runs.append(json.loads(line))
+        except json.JSONDecodeError:
+            sdlog.warning("Skipping unreadable line in update history")
+    return runs
+
+
+def best_template_concurrency(runs: list[dict[str, Any]]) -> int | None:
+    """
+    Returns the template concurrency with which `runs` updated templates
+    fastest, as the mean duration of the template phase per template updated.
+    Only concurrencies used in at least MIN_CONCURRENCY_RUNS successful runs
+    are compared. Returns None unless a higher concurrency was slower, so that
+    higher concurrencies are tried while memory allows.
+    """
+    durations: dict[int, list[float]] = {}
+    for run in runs:
+        concurrency = run.get("template_concurrency")
+        duration = run["phases"].get("templates")
+        if (
+            concurrency is None
+            or duration is None
+            or not run["templates"]
+            or run["results"].get("templates") != UpdateStatus.UPDATES_OK.value
+        ):
+            continue
+        durations.setdefault(concurrency, []).append(duration / len(run["templates"]))
+
+    mean_durations = {
+        concurrency: sum(per_template) / len(per_template)
+        for concurrency, per_template in durations.items()
+        if len(per_template) >= MIN_CONCURRENCY_RUNS
+    }
+    if not mean_durations:
+        return None
+    best = min(mean_durations, key=lambda concurrency: mean_durations[concurrency])
+    if best == max(mean_durations):
+        return None
+    return best
+
+
+def expected_template_growth(runs: list[dict[str, Any]]) -> dict[str, int]:
+    """
+    Returns the growth (bytes) of each template's root volume expected during
+    an update: the 90th percentile of its growth in the GROWTH_RUNS most recent
+    runs that recorded it.
+    """
+    growth: dict[str, list[float]] = {}
+    for run in runs[-GROWTH_RUNS:]:
+        for template, template_growth in run.get("template_growth", {}).items():
+            growth.setdefault(template, []).append(template_growth)
+    return {template: int(percentile(values, 90)) for template, values in growth.items()}
+
+
+def expected_pool_growth(runs: list[dict[str, Any]], name: str) -> int | None:
+    """
+    Returns the growth (bytes) of the default storage pool expected during
+    `name` (see `RunRecord.measure_pool_growth`): the 90th percentile of the
+    GROWTH_RUNS most recent runs that recorded it, or None if none did.
+    """
+    growth = [
+        run["pool_growth"][name]
+        for run in runs[-GROWTH_RUNS:]
+        if name in run.get("pool_growth", {})
+    ]
+    return int(percentile(growth, 90)) if growth else None
+
+
+def _read_lines(path: str) -> list[str]:
+    try:
+        with open(path) as f:
+            return [line for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def percentile(values: list[float], percent: int) -> float:
+    """
+    Nearest-rank percentile of `values`, which must not be empty.
+    """
+    ordered = sorted(values)
+    rank = max(1, -(-percent * len(ordered) // 100))
+    return ordered[rank - 1]
+
+
+def format_stats(runs: list[dict[str, Any]]) -> str:
+    """
+    Summarize `runs`: the median, 90th percentile and maximum duration of each
+    phase and template, and how the most recent runs compare to earlier ones.
+    """
+    if not runs:
+        return "No updater runs recorded yet."
+
+    succeeded = sum(
+        1
+        for run in runs
+        if run["results"]
+        and all(
+            status in {UpdateStatus.UPDATES_OK.value, UpdateStatus.REBOOT_REQUIRED.value}
+            for status in run["results"].values()
+        )
+    )
+    lines = [
+        f"{len(runs)} updater runs from {runs[0]['started']} to {runs[-1]['started']}, "
+        f"{succeeded} successful",
+        "",
+        f"{'':<40}{'runs':>6}{'median':>10}{'p90':>10}{'max':>10}{'trend':>10}",
+    ]
+
+    rows = [("total", [run["duration"] for run in runs])]
+    rows += [
+        (phase, [run["phases"][phase] for run in runs if phase in run["phases"]])
+        for phase in PHASES
+    ]
+    templates = sorted({template for run in runs for template in run["templates"]})
+    rows += [
+        (template, [run["templates"][template] for run in runs if template in run["templates"]])
+        for template in templates
+    ]
+
+    for name, durations in rows:
+        if not durations:
+            continue
+        lines.append(
+            f"{name:<40}{len(durations):>6}"
+            f"{_format_duration(percentile(durations, 50)):>10}"
+            f"{_format_duration(percentile(durations, 90)):>10}"
+            f"{_format_duration(max(durations)):>10}"
+            f"{_format_trend(durations):>10}"
+        )
+
+    return "\n".join(lines)
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(round(seconds), 60)
+    return f"{minutes}m{seconds:02d}s" if minutes else f"{seconds}s"
+
+
+def _format_trend(durations: list[float]) -> str:
+    """
+    Change in median duration of the RECENT_RUNS most recent runs over the
+    runs before them.
+    """
+    recent, earlier = durations[-RECENT_RUNS:], durations[:-RECENT_RUNS]
+    if not earlier:
+        return "-"
+    baseline = percentile(earlier, 50)
+    if baseline == 0:
+        return "-"
+    return f"{(percentile(recent, 50) - baseline) * 100 / baseline:+.0f}%"
@@ -0,0 +1,206 @@
+"""
+Launching the SecureDrop Inbox.
+
+The qubes the inbox relies on are started in parallel wherever their
+dependencies allow (see INBOX_QUBE_DEPENDENCIES), each waiting only until the
+qubes it depends on are ready to accept qrexec calls. The inbox is launched in
+sd-app as soon as that qube is ready. The time until the inbox was launched
+(time-to-inbox), and the time each qube took to become ready, are logged so
+that the launch sequence can be tuned.
+
+While the launcher decides whether the inbox can be opened, `QubeWarmup` starts
+sd-proxy speculatively, so that Tor can bootstrap in the meantime. `launch`
+waits for the warm-up to finish before starting that qube itself.
+"""
+
+from __future__ import annotations
+
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from sdw_util import Util
+
+# Qubes started to launch the inbox, each listed after the qubes it depends on.
+# All qubes send their logs to sd-log. sd-app only needs sd-gpg (to decrypt
+# submissions) and sd-proxy (to reach the server) once the inbox is in use, so
+# it is started alongside them.
+INBOX_QUBE_DEPENDENCIES: dict[str, list[str]] = {
+    "sd-log": [],
+    "sd-gpg": ["sd-log"],
+    "sd-proxy": ["sd-log"],
+    "sd-app": ["sd-log"],
+}
+INBOX_QUBE = "sd-app"
+INBOX_LAUNCH_CMD = "gtk-launch press.freedom.SecureDropApp"
+
+# Maximum time (seconds) to wait for a qube to start, and for a started qube to
+# run a qrexec call
+QUBE_START_TIMEOUT = 120
+QREXEC_READY_TIMEOUT = 120
+
+# Qube started speculatively before it is known whether the inbox will open
+WARMUP_QUBE = "sd-proxy"
+
+sdlog = Util.get_logger(module=__name__)
+
+
+def launch(warmup: QubeWarmup | None = None) -> bool:
+    """
+    Start the qubes the inbox relies on and launch the inbox, once `warmup`
+    has finished starting its qube, if given. Returns whether the inbox was
+    launched; qubes that failed to start are logged.
+    """
+    sdlog.info("Launching SecureDrop Inbox")
+    start = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=len(INBOX_QUBE_DEPENDENCIES)) as executor:
+        qubes: dict[str, Future[float | None]] = {}
+        for qube, dependencies in INBOX_QUBE_DEPENDENCIES.items():
+            qubes[qube] = executor.submit(
+                _start_qube,
+                qube,
+                [qubes[dependency] for dependency in dependencies],
+                start,
+                warmup if warmup is not None and warmup.qube == qube else None,
+            )
+
+        launched = qubes[INBOX_QUBE].result() is not None and _launch_inbox_app()
+        time_to_inbox = time.monotonic() - start
+        if launched:
+            sdlog.info(f"SecureDrop Inbox launched in {time_to_inbox:.1f}s")
+        else:
+            sdlog.error(f"Failed to launch SecureDrop Inbox after {time_to_inbox:.1f}s")
+
+    ready = {qube: future.result() for qube, future in qubes.items()}
+    sdlog.info(
+        "Time until qubes were ready: {}".format(
+            ", ".join(
+                f"{qube} {seconds:.1f}s" if seconds is not None else f"{qube} failed"
+                for qube, seconds in ready.items()
+            )
+        )
+    )
+    return launched
+
+
+def _start_qube(
+    qube: str,
+    dependencies: list[Future[float | None]],
+    start: float,
+    warmup: QubeWarmup | None = None,
+) -> float | None:
+    """
+    Start `qube` once its dependencies have been started, and `warmup` (which
+    starts the same qube) has finished, if given. Then wait until it is ready
+    to accept qrexec calls. Returns the time (seconds) from `start` until it
+    was ready, or None if it could not be started.
+    """
+    # A qube is started even if a dependency failed: the inbox may still be
+    # usable, and the failure has been logged already
+    for dependency in dependencies:
+        dependency.result()
+    if warmup is not None:
+        warmup.wait()
+
+    try:
+        subprocess.run(
+            ["qvm-start", "--skip-if-running", qube],
+            check=True,
+            capture_output=True,
+            timeout=QUBE_START_TIMEOUT,
+        )
+        # qrexec calls to a qube succeed once its qrexec agent is running
+        subprocess.run(
+            ["qvm-run", "--no-autostart", "--no-gui", "--pass-io", "--quiet", qube, "true"],
+            check=True,
+            capture_output=True,
+            timeout=QREXEC_READY_TIMEOUT,
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        sdlog.error(f"Error starting {qube}")
+        sdlog.error(str(e))
+        return None
+
+    return time.monotonic() - start
+
+
+def _launch_inbox_app() -> bool:
+    try:
+        subprocess.run(
+            ["qvm-run", "--no-autostart", INBOX_QUBE, INBOX_LAUNCH_CMD],
+            check=True,
+            capture_output=True,
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        sdlog.error("Error while launching SecureDrop Inbox")
+        sdlog.error(str(e))
+        return False
+    return True
+
+
+class QubeWarmup:
+    """
+    Starts a qube in the background, ahead of launching the inbox. If the
+    warm-up is cancelled, because the updater runs instead, the qube is shut
+    down again once it has started, unless it was running already.
+    """
+
+    def __init__(self, qube: str = WARMUP_QUBE) -> None:
+        self.qube = qube
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._started = False
+        # The launcher may exit while the qube is still starting
+        self._thread = threading.Thread(target=self._run, name=f"warmup-{qube}", daemon=True)
+
+    def start(self) -> None:
+        sdlog.info(f"Starting {self.qube} ahead of launching the inbox")
+        self._thread.start()
+
+    def wait(self) -> None:
+        """
+        Wait until the qube has finished starting, if the warm-up was started.
+        """
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def cancel(self) -> None:
+        """
+        Cancel the warm-up without waiting for the qube to finish starting.
+        """
+        sdlog.info(f"Inbox will not be launched, cancelling start of {self.qube}")
+        with self._lock:
+            self._cancelled = True
+            started = self._started
+        if started:
+            self._shutdown()
+
+    def _run(self) -> None:
+        try:
+            check = subprocess.run(["qvm-check", "--quiet", "--running", self.qube], check=False)
+            if check.returncode == 0:
+                return  # Already running, nothing to warm up
+            with self._lock:
+                if self._cancelled:
+                    return
+            subprocess.run(
+                ["qvm-start", "--skip-if-running", self.qube],
+                check=True,
+                timeout=QUBE_START_TIMEOUT,
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            sdlog.error(f"Error starting {self.qube} ahead of launching the inbox")
+            sdlog.error(str(e))
+            return
+
+        with self._lock:
+            self._started = True
+            cancelled = self._cancelled
+        if cancelled:
+            self._shutdown()
+
+    def _shutdown(self) -> None:
+        sdlog.info(f"Shutting down {self.qube}, started ahead of launching the inbox")
+        subprocess.run(["qvm-shutdown", self.qube], check=False)
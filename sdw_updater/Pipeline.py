@@ -0,0 +1,292 @@
+"""
+The update pipeline run by the SecureDrop updater, independent of any user
+interface.
+
+`UpdatePipeline` applies dom0 updates, the dom0 state, the full Salt
+configuration (if required) and template updates in order, reporting progress
+to a callback. A run that fails or is interrupted is resumed by the next one
+(see `Checkpoint`). It is driven by the updater GUI (`UpdaterApp.UpgradeThread`),
+and by `run_headless`, which reports progress and results on stdout as
+newline-delimited JSON for unattended use (`sdw-updater --headless`). Template
+updates also run on their own while the workstation is idle (see
+`BackgroundUpdate`). In all cases, the status of the run is served to other
+processes (see `StatusServer`).
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import sys
+from collections.abc import Callable
+from datetime import datetime
+from typing import Any
+
+from sdw_updater import Checkpoint, History, Preflight, Progress, StatusServer, Updater
+from sdw_updater.Updater import DATE_FORMAT, UpdateStatus
+from sdw_util import Util
+
+logger = Util.get_logger(module=__name__)
+
+# Called with the overall progress (0-100) and estimated seconds remaining
+ProgressCallback = Callable[[int, int], None]
+
+
+class UpdatePipeline:
+    """
+    A single run of the updater. `phase_callback` is called with the name of
+    each phase as it starts (see `Progress.PHASES`), and `progress_callback`
+    with the overall progress and estimated time remaining whenever either
+    may have changed. If `serve_status` is set, the status of the run is served
+    on a socket while it runs (see `StatusServer`). Template updates are
+    cancelled once `cancel`, if given, returns True.
+    """
+
+    def __init__(
+        self,
+        progress_callback: ProgressCallback | None = None,
+        phase_callback: Callable[[str], None] | None = None,
+        serve_status: bool = False,
+        cancel: Callable[[], bool] | None = None,
+    ) -> None:
+        self.progress_callback = progress_callback
+        self.phase_callback = phase_callback
+        self.serve_status = serve_status
+        self.cancel = cancel
+        self.status = StatusServer.StatusServer()
+        self.run_record = History.RunRecord()
+        self.checkpoint = Checkpoint.load()
+        history = History.read_history()
+        self.progress_model = Progress.ProgressModel(history)
+        self.max_template_concurrency = History.best_template_concurrency(history)
+        self.expected_template_growth = History.expected_template_growth(history)
+        self.expected_full_install_growth = History.expected_pool_growth(history, "apply_all")
+
+    def run(self) -> dict[str, Any]:
+        """
+        Run all update phases and record the outcome. Returns the status of each
+        phase, and the overall status as "recommended_action".
+        """
+        if self.serve_status:
+            self.status.start()
+        try:
+            results = self.run_full_update()
+            History.record_run(self.run_record, results)
+
+            # write flags to disk
+            run_results = Updater.overall_update_status(results)
+            Updater._write_updates_status_flag_to_disk(run_results)
+            # Write the "last updated" date to disk if the system is up-to-date
+            # after applying upgrades, regardless of whether a reboot is still pending.
+            if run_results in {UpdateStatus.UPDATES_OK, UpdateStatus.REBOOT_REQUIRED}:
+                Updater._write_last_updated_flags_to_disk()
+                Checkpoint.clear()
+            self.status.set_result(run_results, results)
+        finally:
+            self.status.stop()
+
+        message: dict[str, Any] = dict(results)
+        message["recommended_action"] = run_results
+        return message
+
+    def run_full_update(self) -> dict[str, Any]:
+        """
+        Run all update phases.
+        """
+        # Pre-populate results with all available steps for early exits
+        results = {
+            "dom0": UpdateStatus.UPDATES_REQUIRED,
+            "apply_dom0": UpdateStatus.UPDATES_REQUIRED,
+            "apply_all": UpdateStatus.UPDATES_REQUIRED,
+            "templates": UpdateStatus.UPDATES_REQUIRED,
+        }
+
+        # A background download stops on its own once the updater is running;
+        # its results are only complete after it has done so.
+        Updater.wait_for_prefetch()
+        # So does a background update; the templates it updated are skipped
+        if Updater.wait_for_background_update():
+            self.checkpoint = Checkpoint.load()
+
+        # Update dom0 first, then apply dom0 state. If full state run
+        # is required, the dom0 state will drop a flag.
+        results["dom0"] = self.run_phase(
+            "dom0",
+            Updater.get_dom0_packages_key,
+            lambda: Updater.apply_updates_dom0(self.run_record.phases),
+        )
+        if results["dom0"] == UpdateStatus.UPDATES_FAILED:
+            return results  # Fail early
+
+        # apply dom0 state
+        # add to results dict, if it fails it will show error message
+        results["apply_dom0"] = self.run_phase(
+            "apply_dom0",
+            Updater._get_dom0_state_digest,
+            lambda: Updater.apply_dom0_state(self.phase_progress),
+        )
+        if results["apply_dom0"] == UpdateStatus.UPDATES_FAILED:
+            return results  # Fail early
+
+        # rerun full config if dom0 checks determined it's required. It needs
+        # no checkpoint: the flag requesting it is only cleared on success.
+        if Updater.migration_is_required():
+            # Progress is reported as Salt states complete during full state run
+            # add to results dict, if it fails it will show error message
+            self.start_phase("apply_all")
+            with (
+                self.run_record.phase("apply_all"),
+                self.run_record.measure_pool_growth("apply_all"),
+            ):
+                results["apply_all"] = Updater.run_full_install(
+                    self.phase_progress, self.expected_full_install_growth
+                )
+            if results["apply_all"] == UpdateStatus.UPDATES_FAILED:
+                return results  # Fail early
+        else:
+            results["apply_all"] = UpdateStatus.UPDATES_OK  # No updates
+            self.progress_model.skip("apply_all")
+
+        results["templates"] = self.update_templates()
+        return results
+
+    def run_templates(self) -> UpdateStatus:
+        """
+        Run the template phase only, for unattended updates in the background
+        (see `BackgroundUpdate`). The run is not recorded: the overall update
+        status also depends on dom0, and is left to the caller.
+        """
+        if self.serve_status:
+            self.status.start()
+        try:
+            Updater.wait_for_prefetch()
+            for phase in Progress.PHASES:
+                if phase != "templates":
+                    self.progress_model.skip(phase)
+            status = self.update_templates()
+            self.status.set_result(status, {"templates": status})
+        finally:
+            self.status.stop()
+        return status
+
+    def update_templates(self) -> UpdateStatus:
+        """
+        Run the template phase.
+        """
+        self.start_phase("templates")
+        template_results: dict[str, UpdateStatus] = {}
+        with (
+            self.run_record.phase("templates"),
+            self.run_record.measure_template_growth(
+                Updater._get_current_templates(), template_results
+            ),
+        ):
+            status = Updater.apply_updates_templates(
+                self.phase_progress,
+                self.run_record.templates,
+                self.progress_model.template_durations,
+                completed=self.checkpoint.completed_templates(),
+                results=template_results,
+                template_progress_callback=self.status.set_template_progress,
+                max_concurrency=self.max_template_concurrency,
+                concurrency=self.run_record.template_concurrency,
+                expected_growth=self.expected_template_growth,
+                reverted=self.run_record.reverted_templates,
+                cancel=self.cancel,
+            )
+        self.checkpoint.complete_templates(template_results)
+        self.progress_model.finish()
+
+        return status
+
+    def run_phase(
+        self,
+        phase: str,
+        get_key: Callable[[], str | None],
+        apply: Callable[[], UpdateStatus],
+    ) -> UpdateStatus:
+        """
+        Run `phase` with `apply`, unless it completed during the previous,
+        incomplete run with the inputs it has now (as returned by `get_key`).
+        """
+        status = self.checkpoint.completed(phase, get_key)
+        if status is not None:
+            logger.info(f"Phase '{phase}' completed during the previous run, skipping")
+            self.progress_model.skip(phase)
+            return status
+
+        self.start_phase(phase)
+        timer = (
+            self.run_record.phase(phase) if phase in History.PHASES else contextlib.nullcontext()
+        )
+        with timer:
+            status = apply()
+        if status != UpdateStatus.UPDATES_FAILED:
+            self.checkpoint.complete(phase, get_key(), status)
+        return status
+
+    def start_phase(self, phase: str) -> None:
+        self.progress_model.start(phase)
+        self.status.set_phase(phase)
+        if self.phase_callback:
+            self.phase_callback(phase)
+        self.report_progress()
+
+    def phase_progress(self, phase_progress: int) -> None:
+        """
+        Record the progress (0-100) reported for the current phase
+        """
+        self.progress_model.update(phase_progress / 100)
+        self.report_progress()
+
+    def report_progress(self) -> None:
+        """
+        Report the overall progress and estimated time remaining, based on the
+        progress reported so far and the durations of previous runs
+        """
+        percent, estimate = self.progress_model.estimate()
+        remaining = round(estimate)
+        self.status.set_progress(percent, remaining)
+        if self.progress_callback:
+            self.progress_callback(percent, remaining)
+
+
+def run_headless(should_skip_netcheck: bool = False) -> int:
+    """
+    Run the update pipeline without a user interface, writing one JSON event
+    per line to stdout:
+
+    - {"event": "phase", "phase": ...} as each phase starts
+    - {"event": "progress", "percent": ..., "remaining": ...} as progress is made
+    - {"event": "result", "status": ..., "results": {...}} once done
+
+    Each event also has a "time" field. Returns the overall `UpdateStatus` as
+    an exit code.
+    """
+
+    def emit(event: str, **fields: Any) -> None:
+        fields = {"event": event, "time": datetime.now().strftime(DATE_FORMAT), **fields}
+        sys.stdout.write(json.dumps(fields) + "\n")
+        sys.stdout.flush()
+
+    preflight = Preflight.run_preflight(should_skip_netcheck)
+    if not preflight.should_update:
+        emit("result", status=UpdateStatus.UPDATES_FAILED.value, results={}, error="network")
+        return int(UpdateStatus.UPDATES_FAILED.value)
+
+    logger.info("Starting headless update")
+    pipeline = UpdatePipeline(
+        progress_callback=lambda percent, remaining: emit(
+            "progress", percent=percent, remaining=remaining
+        ),
+        phase_callback=lambda phase: emit("phase", phase=phase),
+        serve_status=True,
+    )
+    results = pipeline.run()
+    status = results.pop("recommended_action")
+    emit(
+        "result",
+        status=status.value,
+        results={step: result.value for step, result in results.items()},
+    )
+    return int(status.value)
@@ -0,0 +1,219 @@
+"""
+Pre-flight checks run before updates are applied.
+
+The checks are independent and mostly wait on qrexec calls to other VMs, so
+they run concurrently: network connectivity (in sys-net) and free space in the
+default storage pool.
+
+Before the long-running phases, `check_storage` also verifies that the storage
+they are expected to use is available: in the root volumes of the templates
+about to be updated, and in the storage pools holding them. Expected growth is
+based on earlier runs (see `History`), with STORAGE_GROWTH_MARGIN to spare.
+"""
+
+from __future__ import annotations
+
+import subprocess
+from collections.abc import Collection, Mapping
+from concurrent.futures import ThreadPoolExecutor
+
+from sdw_util import Util
+
+# Free space (bytes) in the default storage pool below which a warning is logged
+MIN_POOL_FREE_SPACE = 10 * 1024**3
+
+# Expected growth (bytes) of a template's root volume during an update, and of
+# the default pool while the full Salt configuration is applied, when it was
+# not recorded by earlier runs
+DEFAULT_TEMPLATE_GROWTH = 1024**3
+DEFAULT_FULL_INSTALL_GROWTH = 10 * 1024**3
+
+# Factor applied to expected growth, as growth varies between runs
+STORAGE_GROWTH_MARGIN = 1.5
+
+logger = Util.get_logger(module=__name__)
+
+
+class PreflightResult:
+    """
+    Combined result of the pre-flight checks. Checks that were skipped, or
+    could not be completed, are None.
+    """
+
+    def __init__(
+        self,
+        network_ok: bool | None,
+        pool_free_space: int | None,
+    ) -> None:
+        self.network_ok = network_ok
+        self.pool_free_space = pool_free_space
+
+    @property
+    def should_update(self) -> bool:
+        """
+        Updates can only be applied if network connectivity is available (or
+        was not checked).
+        """
+        return self.network_ok is not False
+
+
+def run_preflight(should_skip_netcheck: bool = False) -> PreflightResult:
+    """
+    Run all pre-flight checks concurrently and combine their results.
+    """
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        network = None if should_skip_netcheck else executor.submit(is_netcheck_successful)
+        pool_space = executor.submit(get_pool_free_space)
+
+        result = PreflightResult(
+            network_ok=network.result() if network else None,
+            pool_free_space=pool_space.result(),
+        )
+
+    if result.network_ok is None:
+        logger.info("Network check skipped")
+    elif result.network_ok:
+        logger.info("Network check successful")
+    else:
+        logger.error("Network connectivity check failed; cannot check for updates.")
+
+    if result.pool_free_space is not None and result.pool_free_space < MIN_POOL_FREE_SPACE:
+        logger.warning(
+            f"Low free space in default storage pool: {result.pool_free_space // 1024**2} MiB"
+        )
+
+    return result
+
+
+def is_netcheck_successful() -> bool:
+    """
+    Helper function to assess network connectivity before launching updater.
+
+    Assess network connectivity by checking connection status (via nmcli) in
+    sys-net.
+    """
+    command = b"nmcli networking connectivity check"
+
+    if not Util.get_qubes_version():
+        logger.error("QubesOS not detected, cannot check network.")
+        return False
+    try:
+        # Use of `--pass-io` is required to check on network status, since
+        # nmcli returns 0 for all connection states we need to report back to dom0.
+        result = subprocess.check_output(["qvm-run", "-p", "sys-net", command])
+        return result.decode("utf-8").strip() == "full"
+    except subprocess.CalledProcessError as e:
+        logger.error(
+            "{} (connectivity check) failed; state reported as {}".format(
+                command.decode("utf-8"), e.output
+            )
+        )
+        return False
+
+
+def get_pool_free_space() -> int | None:
+    """
+    Returns the free space (bytes) in the default storage pool, or None if it
+    cannot be determined.
+    """
+    try:
+        # Lazy import: dom0-only system package, not available in CI venv
+        import qubesadmin
+
+        app = qubesadmin.Qubes()
+        pool = app.pools[str(app.default_pool)]
+        if pool.size is None or pool.usage is None:
+            return None
+        return int(pool.size) - int(pool.usage)
+    except Exception as e:
+        logger.error("Error checking free space in default storage pool")
+        logger.error(str(e))
+        return None
+
+
+def get_pool_usage() -> int | None:
+    """
+    Returns the space (bytes) used in the default storage pool, or None if it
+    cannot be determined.
+    """
+    try:
+        # Lazy import: dom0-only system package, not available in CI venv
+        import qubesadmin
+
+        app = qubesadmin.Qubes()
+        usage = app.pools[str(app.default_pool)].usage
+        return int(usage) if usage is not None else None
+    except Exception as e:
+        logger.warning(f"Cannot determine usage of default storage pool: {e}")
+        return None
+
+
+def get_root_volume_usage(templates: Collection[str]) -> dict[str, int]:
+    """
+    Returns the space (bytes) used in the root volume of each of `templates`.
+    Templates whose usage cannot be determined are left out.
+    """
+    try:
+        # Lazy import: dom0-only system package, not available in CI venv
+        import qubesadmin
+
+        domains = qubesadmin.Qubes().domains
+        return {template: int(domains[template].volumes["root"].usage) for template in templates}
+    except Exception as e:
+        logger.warning(f"Cannot determine usage of template root volumes: {e}")
+        return {}
+
+
+def check_storage(
+    templates: Collection[str] = (),
+    template_growth: Mapping[str, int] | None = None,
+    pool_growth: int = 0,
+) -> list[str]:
+    """
+    Checks whether there is enough storage to update `templates`, whose root
+    volumes are expected to grow as given in `template_growth` (or by
+    DEFAULT_TEMPLATE_GROWTH), and to grow the default pool by a further
+    `pool_growth` bytes. Returns a description of each shortage found. If
+    storage cannot be checked, this is logged and no shortage is reported.
+    """
+    template_growth = template_growth or {}
+    try:
+        # Lazy import: dom0-only system package, not available in CI venv
+        import qubesadmin
+
+        app = qubesadmin.Qubes()
+        default_pool = str(app.default_pool)
+        shortages = []
+        required = {default_pool: int(pool_growth * STORAGE_GROWTH_MARGIN)}
+        for template in templates:
+            growth = int(
+                template_growth.get(template, DEFAULT_TEMPLATE_GROWTH) * STORAGE_GROWTH_MARGIN
+            )
+            root = app.domains[template].volumes["root"]
+            free = int(root.size) - int(root.usage)
+            if growth > free:
+                shortages.append(
+                    f"Not enough space in root volume of {template}: "
+                    f"{_format_size(growth)} required, {_format_size(free)} available"
+                )
+            required[str(root.pool)] = required.get(str(root.pool), 0) + growth
+
+        for name, growth in required.items():
+            pool = app.pools[name]
+            if growth == 0 or pool.size is None or pool.usage is None:
+                continue
+            free = int(pool.size) - int(pool.usage)
+            if growth > free:
+                shortages.append(
+                    f"Not enough space in storage pool {name}: "
+                    f"{_format_size(growth)} required, {_format_size(free)} available"
+                )
+    except Exception as e:
+        logger.warning(f"Cannot check available storage, continuing: {e}")
+        return []
+
+    return shortages
+
+
+def _format_size(size: int) -> str:
+    return f"{size / 1024**3:.1f} GiB"
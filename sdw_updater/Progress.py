@@ -0,0 +1,227 @@
+"""
+Time-based progress model for updater runs.
+
+Each phase of a run is expected to take as long as its median duration in the
+update history (see `History`), falling back to DEFAULT_PHASE_DURATIONS. Progress
+is reported as the share of the estimated total time that has elapsed, and the
+estimate is revised as phases run faster or slower than expected.
+"""
+
+from __future__ import annotations
+
+import statistics
+import threading
+import time
+from collections.abc import Callable
+from typing import Any
+
+# Phases of an updater run, in order
+PHASES = ["dom0", "apply_dom0", "apply_all", "templates"]
+
+# Expected phase durations (seconds) when there is no history for a phase
+DEFAULT_PHASE_DURATIONS = {
+    "dom0": 120.0,
+    "apply_dom0": 60.0,
+    "apply_all": 1800.0,
+    "templates": 600.0,
+}
+# Share of a phase after which its observed rate of progress fully replaces
+# the historical estimate for the rest of it
+RATE_CONFIDENCE = 0.25
+
+# Bounds on how much faster or slower than recorded the remaining phases are
+# assumed to run, based on the phases completed so far
+MIN_SPEED_FACTOR = 0.5
+MAX_SPEED_FACTOR = 2.0
+
+# Default maximum number of progress events passed on per second
+MAX_EVENTS_PER_SECOND = 10.0
+
+
+class ProgressModel:
+    """
+    Estimates the progress and remaining time of an updater run from the
+    durations of previous runs (as returned by `History.read_history`). The
+    run's progress may be recorded and read from different threads, e.g. the
+    updater's worker and GUI threads.
+    """
+
+    def __init__(
+        self,
+        runs: list[dict[str, Any]],
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.clock = clock
+        self.expected = {phase: _expected_phase_duration(runs, phase) for phase in PHASES}
+        # Median update duration of each template, for weighting template progress
+        self.template_durations = {
+            template: statistics.median(durations)
+            for template, durations in _template_durations(runs).items()
+        }
+        self._phases = list(PHASES)
+        # Actual duration of each completed phase
+        self._actual: dict[str, float] = {}
+        self._current: str | None = None
+        self._current_started = 0.0
+        self._fraction = 0.0
+        self._started = clock()
+        self._last_percent = 0
+        self._lock = threading.Lock()
+
+    def skip(self, phase: str) -> None:
+        """
+        Leave out a phase that will not run.
+        """
+        with self._lock:
+            if phase in self._phases and phase not in self._actual:
+                self._phases.remove(phase)
+
+    def start(self, phase: str) -> None:
+        """
+        Start `phase`, completing the current one, if any.
+        """
+        with self._lock:
+            self._complete_current()
+            self._current = phase
+            self._current_started = self.clock()
+            self._fraction = 0.0
+
+    def update(self, fraction: float) -> None:
+        """
+        Record the progress (0-1) reported for the current phase.
+        """
+        with self._lock:
+            self._fraction = min(max(fraction, 0.0), 1.0)
+
+    def finish(self) -> None:
+        with self._lock:
+            self._complete_current()
+
+    def estimate(self) -> tuple[int, float]:
+        """
+        Returns the progress (see `percent`) and the estimated remaining time
+        (see `remaining`), consistent with each other.
+        """
+        with self._lock:
+            remaining = self._remaining()
+            return self._percent(remaining), remaining
+
+    def remaining(self) -> float:
+        """
+        Estimated number of seconds until the run completes.
+        """
+        with self._lock:
+            return self._remaining()
+
+    def percent(self) -> int:
+        """
+        Share of the estimated total time that has elapsed, 0-99. Never
+        decreases, even if the estimate for the rest of the run goes up.
+        """
+        with self._lock:
+            return self._percent(self._remaining())
+
+    def _remaining(self) -> float:
+        speed = self._speed_factor()
+        remaining = sum(
+            self.expected[phase] * speed
+            for phase in self._phases
+            if phase not in self._actual and phase != self._current
+        )
+        if self._current is not None:
+            remaining += self._current_remaining(self.expected[self._current] * speed)
+        return remaining
+
+    def _percent(self, remaining: float) -> int:
+        elapsed = self.clock() - self._started
+        if elapsed + remaining > 0:
+            percent = min(99, int(elapsed * 100 / (elapsed + remaining)))
+            self._last_percent = max(self._last_percent, percent)
+        return self._last_percent
+
+    def _complete_current(self) -> None:
+        if self._current is not None:
+            self._actual[self._current] = self.clock() - self._current_started
+            self._current = None
+
+    def _current_remaining(self, expected: float) -> float:
+        """
+        Blend of the phase's expected duration and the duration extrapolated
+        from its progress so far, favoring the latter as the phase progresses.
+        """
+        elapsed = self.clock() - self._current_started
+        if self._fraction <= 0:
+            return max(expected - elapsed, 0.0)
+        confidence = min(1.0, self._fraction / RATE_CONFIDENCE)
+        projected = (1 - confidence) * max(expected, elapsed) + confidence * (
+            elapsed / self._fraction
+        )
+        return max(projected - elapsed, 0.0)
+
+    def _speed_factor(self) -> float:
+        expected = sum(self.expected[phase] for phase in self._actual)
+        if not expected:
+            return 1.0
+        actual = sum(self._actual.values())
+        return min(max(actual / expected, MIN_SPEED_FACTOR), MAX_SPEED_FACTOR)
+
+
+def _expected_phase_duration(runs: list[dict[str, Any]], phase: str) -> float:
+    # The dom0 phase is recorded as the dom0 update itself
+    recorded = "dom0_apply" if phase == "dom0" else phase
+    durations = [run["phases"][recorded] for run in runs if recorded in run["phases"]]
+    return statistics.median(durations) if durations else DEFAULT_PHASE_DURATIONS[phase]
+
+
+def _template_durations(runs: list[dict[str, Any]]) -> dict[str, list[float]]:
+    durations: dict[str, list[float]] = {}
+    for run in runs:
+        for template, duration in run["templates"].items():
+            durations.setdefault(template, []).append(duration)
+    return durations
+
+
+class CoalescedProgress:
+    """
+    Progress callback that passes a percentage on to `callback` only when it
+    has changed, and at most `max_rate` times per second. A change held back
+    by the rate limit is passed on with the next event after the interval has
+    passed, or by `flush`, which should be called once progress reporting ends.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[int], None],
+        max_rate: float = MAX_EVENTS_PER_SECOND,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.callback = callback
+        self.min_interval = 1 / max_rate
+        self.clock = clock
+        self.emitted = 0
+        self._last_value: int | None = None
+        self._last_emitted = -self.min_interval
+        self._pending: int | None = None
+
+    def __call__(self, value: int) -> None:
+        if value == self._last_value:
+            self._pending = None
+            return
+
+        now = self.clock()
+        if now - self._last_emitted < self.min_interval:
+            self._pending = value
+            return
+
+        self._emit(value, now)
+
+    def flush(self) -> None:
+        if self._pending is not None:
+            self._emit(self._pending, self.clock())
+
+    def _emit(self, value: int, now: float) -> None:
+        self._pending = None
+        self._last_value = value
+        self._last_emitted = now
+        self.emitted += 1
+        self.callback(value)
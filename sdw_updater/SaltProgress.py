@@ -0,0 +1,104 @@
+"""
+Progress reporting for Salt runs.
+
+Parses the output of `qubesctl --show-output` (directly, or through
+`sdw-admin --apply`) as it streams, counting completed states against the
+number of states seen in the previous successful run, and keeping track of the
+target currently being configured and of how long each state took.
+"""
+
+from __future__ import annotations
+
+import re
+from collections.abc import Callable
+
+from sdw_util import Util
+
+# Fallback for the expected number of states when no previous run is on record
+DEFAULT_EXPECTED_STATES = 200
+
+# Number of slowest states written to the detail log after each run
+SLOWEST_STATES_TO_LOG = 10
+
+# A target header, e.g. "local:" or "sd-app:", printed in the first column
+TARGET_HEADER_REGEX = re.compile(r"^(?P<target>[\w.-]+):\s*$")
+# A target result printed by qubesctl once a VM is done, e.g. "sd-app: OK"
+TARGET_RESULT_REGEX = re.compile(r"^(?P<target>[\w.-]+): (?P<result>OK|ERROR)\s*$")
+# Full ("state_output: full") state output, one attribute per line
+STATE_ID_REGEX = re.compile(r"^\s+ID: (?P<id>.+?)\s*$")
+STATE_DURATION_REGEX = re.compile(r"^\s+Duration: (?P<duration>[\d.]+) ms\s*$")
+# Terse ("state_output: terse/mixed") state output, one state per line
+TERSE_STATE_REGEX = re.compile(
+    r"^\s+Name: (?P<id>.+?) - Function: .* - Duration: (?P<duration>[\d.]+) ms\s*$"
+)
+
+# Salt calls dom0 "local"
+LOCAL_TARGET = "local"
+DOM0_TARGET = "dom0"
+
+sdlog = Util.get_logger(module=__name__)
+
+
+class SaltProgress:
+    """
+    Line handler for streamed Salt output. Each completed state advances the
+    progress reported to `progress_callback` (0-99; 100 is left to the caller
+    once the command has actually succeeded).
+    """
+
+    def __init__(
+        self,
+        expected_states: int | None = None,
+        progress_callback: Callable[[int], None] | None = None,
+    ) -> None:
+        self.expected_states = expected_states or DEFAULT_EXPECTED_STATES
+        self.progress_callback = progress_callback
+        self.completed_states = 0
+        self.current_target: str | None = None
+        # Duration (ms) of each state, keyed by "<target>:<state ID>"
+        self.durations: dict[str, float] = {}
+        self._current_state_id: str | None = None
+        self._last_progress = -1
+
+    def feed(self, line: str) -> None:
+        line = Util.cleanup_for_log(line).rstrip()
+
+        if match := TARGET_RESULT_REGEX.match(line):
+            target = _target_name(match.group("target"))
+            if match.group("result") == "OK":
+                sdlog.info(f"Salt configuration complete for target: '{target}'")
+            else:
+                sdlog.error(f"Salt configuration failed for target: '{target}'")
+        elif match := TARGET_HEADER_REGEX.match(line):
+            self._set_target(_target_name(match.group("target")))
+        elif match := STATE_ID_REGEX.match(line):
+            self._current_state_id = match.group("id")
+        elif match := STATE_DURATION_REGEX.match(line):
+            if self._current_state_id is not None:
+                self._complete_state(self._current_state_id, float(match.group("duration")))
+                self._current_state_id = None
+        elif match := TERSE_STATE_REGEX.match(line):
+            self._complete_state(match.group("id"), float(match.group("duration")))
+
+    def slowest_states(self, count: int = SLOWEST_STATES_TO_LOG) -> list[tuple[str, float]]:
+        return sorted(self.durations.items(), key=lambda item: item[1], reverse=True)[:count]
+
+    def _set_target(self, target: str) -> None:
+        if target != self.current_target:
+            self.current_target = target
+            sdlog.info(f"Configuring target: '{target}'")
+
+    def _complete_state(self, state_id: str, duration: float) -> None:
+        self.completed_states += 1
+        self.durations[f"{self.current_target or DOM0_TARGET}:{state_id}"] = duration
+
+        # The number of states may differ from the last run; never report
+        # completion before the command has exited
+        progress = min(99, self.completed_states * 100 // self.expected_states)
+        if self.progress_callback and progress != self._last_progress:
+            self._last_progress = progress
+            self.progress_callback(progress)
+
+
+def _target_name(name: str) -> str:
+    return DOM0_TARGET if name == LOCAL_TARGET else name
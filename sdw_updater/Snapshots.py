@@ -0,0 +1,147 @@
+"""
+Rollback of failed template updates, using Qubes volume revisions.
+
+When a template shuts down, Qubes keeps the previous state of its root volume
+as a revision, up to the volume's `revisions_to_keep`. `record` notes the
+revisions of each template's root volume before it is updated, keeping at
+least REVISIONS_TO_KEEP. Once the update has failed, the first revision added
+since is the template's state before the update: `revert` restores it, which
+takes seconds, rather than the minutes of another update or a full Salt run.
+
+Revisions are pruned by Qubes as new ones are added, so no more than
+`revisions_to_keep` snapshots are kept per template. Once the update is over,
+`release` restores each volume's `revisions_to_keep` if `record` raised it, so
+that the setting managed by the administrator (or Salt) is left unchanged.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Collection, Mapping
+from dataclasses import dataclass
+
+from sdw_util import Util
+
+# Revisions kept of each template's root volume during an update: enough for
+# the state before the update to survive a revision added by each attempt to
+# update it (see Updater.TEMPLATE_UPDATE_RETRIES).
+REVISIONS_TO_KEEP = 4
+
+sdlog = Util.get_logger(module=__name__)
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    The revisions of a template's root volume before it is updated, and the
+    volume's original `revisions_to_keep` if `record` raised it.
+    """
+
+    revisions: list[str]
+    original_revisions_to_keep: int | None = None
+
+
+def record(templates: Collection[str]) -> dict[str, Snapshot]:
+    """
+    Returns the revisions of the root volume of each of `templates`, before
+    they are updated, keeping at least REVISIONS_TO_KEEP until `release`.
+    Templates whose revisions cannot be recorded are skipped, and cannot be
+    reverted.
+    """
+    try:
+        # Lazy import: dom0-only system package, not available in CI venv
+        import qubesadmin
+
+        app = qubesadmin.Qubes()
+    except Exception as e:
+        sdlog.warning(f"Cannot record template revisions, failed updates cannot be reverted: {e}")
+        return {}
+
+    snapshots = {}
+    for template in templates:
+        try:
+            volume = app.domains[template].volumes["root"]
+            original = volume.revisions_to_keep
+            if original < REVISIONS_TO_KEEP:
+                volume.revisions_to_keep = REVISIONS_TO_KEEP
+                snapshots[template] = Snapshot(list(volume.revisions), original)
+            else:
+                snapshots[template] = Snapshot(list(volume.revisions))
+        except Exception as e:
+            sdlog.warning(
+                f"Cannot record revisions of template '{template}', "
+                f"a failed update cannot be reverted: {e}"
+            )
+    return snapshots
+
+
+def revert(snapshots: Mapping[str, Snapshot], templates: Collection[str]) -> list[str]:
+    """
+    Revert the root volume of each of `templates` to its state before the
+    update, as recorded in `snapshots` (see `record`). Returns the templates
+    reverted; templates left unchanged by the update are not reverted.
+    """
+    templates = [template for template in templates if template in snapshots]
+    if not templates:
+        return []
+    try:
+        # Lazy import: dom0-only system package, not available in CI venv
+        import qubesadmin
+
+        app = qubesadmin.Qubes()
+    except Exception as e:
+        sdlog.error("Error reverting failed template updates")
+        sdlog.error(str(e))
+        return []
+
+    reverted = []
+    for template in templates:
+        try:
+            vm = app.domains[template]
+            volume = vm.volumes["root"]
+            # Revisions are listed oldest first: the first one added since the
+            # update started is the state before it
+            added = [rev for rev in volume.revisions if rev not in snapshots[template].revisions]
+            if not added:
+                sdlog.info(f"Template '{template}' was not changed by the failed update")
+                continue
+            if not vm.is_halted():
+                sdlog.error(f"Cannot revert template '{template}' while it is running")
+                continue
+            volume.revert(added[0])
+        except Exception as e:
+            sdlog.error(f"Error reverting template '{template}'")
+            sdlog.error(str(e))
+            continue
+        sdlog.info(f"Reverted template '{template}' to its state before the failed update")
+        reverted.append(template)
+    return reverted
+
+
+def release(snapshots: Mapping[str, Snapshot]) -> None:
+    """
+    Restore the `revisions_to_keep` of each root volume raised by `record`,
+    unless it was changed again in the meantime.
+    """
+    raised = {
+        template: snapshot.original_revisions_to_keep
+        for template, snapshot in snapshots.items()
+        if snapshot.original_revisions_to_keep is not None
+    }
+    if not raised:
+        return
+    try:
+        # Lazy import: dom0-only system package, not available in CI venv
+        import qubesadmin
+
+        app = qubesadmin.Qubes()
+    except Exception as e:
+        sdlog.warning(f"Cannot restore the revisions kept of template volumes: {e}")
+        return
+
+    for template, original in raised.items():
+        try:
+            volume = app.domains[template].volumes["root"]
+            if volume.revisions_to_keep == REVISIONS_TO_KEEP:
+                volume.revisions_to_keep = original
+        except Exception as e:
+            sdlog.warning(f"Cannot restore the revisions kept of template '{template}': {e}")
@@ -0,0 +1,264 @@
+"""
+Live status of a running updater, served on a UNIX-domain socket.
+
+While the update pipeline runs, `StatusServer` serves its status on SOCKET_FILE
+in the lock directory: the current phase, the overall progress and estimated
+time remaining, the progress (0-100) of each template being updated, and the
+result once the run has completed. Clients connect and send one request line:
+
+- "status": the current status is sent as one line of JSON
+- "subscribe": the current status is sent, then again each time it changes,
+  one line of JSON each, until the run has completed
+
+`read_status` and `subscribe` implement the client side, for the notifier, the
+launcher and monitoring (`sdw-updater --status`).
+"""
+
+from __future__ import annotations
+
+import contextlib
+import copy
+import json
+import os
+import socket
+import socketserver
+import threading
+from collections.abc import Iterator, Mapping
+from datetime import datetime
+from typing import Any
+
+from sdw_updater.Updater import DATE_FORMAT, UpdateStatus
+from sdw_util import Util
+
+SOCKET_FILE = "sdw-updater.sock"
+
+# Maximum time (seconds) to wait on a client or server. Subscribers that do not
+# keep up with status updates for this long are disconnected.
+SOCKET_TIMEOUT = 5.0
+
+# Maximum length of a request line
+MAX_REQUEST_LENGTH = 64
+
+sdlog = Util.get_logger(module=__name__)
+
+
+def get_socket_path() -> str:
+    return os.path.join(Util.LOCK_DIRECTORY, SOCKET_FILE)
+
+
+class StatusServer:
+    """
+    Status of an updater run, served on SOCKET_FILE once started. Status
+    updates are recorded whether or not the server has been started.
+    """
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._status: dict[str, Any] = {
+            "phase": None,
+            "percent": 0,
+            "remaining": None,
+            "templates": {},
+            "result": None,
+            "updated": datetime.now().strftime(DATE_FORMAT),
+        }
+        # Incremented on each status update, so subscribers can wait for changes
+        self._version = 0
+        self._stopped = False
+        self._server: _StatusSocketServer | None = None
+        self._thread: threading.Thread | None = None
+        # Identifies the socket bound by this server (its inode and creation
+        # time, as inodes may be reused), which may be replaced by the socket of
+        # another updater run, e.g. one that cancelled a background update
+        self._socket_id: tuple[int, int] | None = None
+
+    def start(self) -> None:
+        """
+        Start serving the status. Errors are logged; the updater runs without
+        serving its status.
+        """
+        socket_file = get_socket_path()
+        try:
+            # Only one updater runs at a time (see Updater.LOCK_FILE): a socket
+            # left in place was not removed by an updater that did not exit
+            # cleanly, or belongs to a background update being cancelled
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(socket_file)
+            self._server = _StatusSocketServer(socket_file, self)
+            self._socket_id = _get_file_id(socket_file)
+        except OSError as e:
+            sdlog.error("Error starting updater status server")
+            sdlog.error(str(e))
+            return
+
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="status-server", daemon=True
+        )
+        self._thread.start()
+        sdlog.info(f"Serving updater status on {socket_file}")
+
+    def stop(self) -> None:
+        """
+        Stop serving the status, once subscribers have been sent the latest
+        status.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._server is None:
+            return
+
+        self._server.shutdown()
+        self._server.server_close()
+        socket_file = get_socket_path()
+        with contextlib.suppress(FileNotFoundError):
+            # Leave the socket of another updater run in place
+            if _get_file_id(socket_file) == self._socket_id:
+                os.remove(socket_file)
+        self._server = None
+
+    def set_phase(self, phase: str) -> None:
+        self._update(phase=phase)
+
+    def set_progress(self, percent: int, remaining: int) -> None:
+        self._update(percent=percent, remaining=remaining)
+
+    def set_template_progress(self, template: str, progress: int) -> None:
+        with self._condition:
+            self._status["templates"][template] = progress
+            self._changed()
+
+    def set_result(self, status: UpdateStatus, results: Mapping[str, UpdateStatus]) -> None:
+        self._update(
+            result={
+                "status": status.value,
+                "results": {step: result.value for step, result in results.items()},
+            }
+        )
+
+    def snapshot(self) -> tuple[int, dict[str, Any]]:
+        """
+        Returns the current status, and its version.
+        """
+        with self._condition:
+            return self._version, copy.deepcopy(self._status)
+
+    def wait_for_update(self, version: int) -> tuple[int, dict[str, Any]] | None:
+        """
+        Wait until the status has changed from `version`, and return it (see
+        `snapshot`). Returns None if the server was stopped in the meantime.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._version != version or self._stopped)
+            if self._version == version:
+                return None
+            return self._version, copy.deepcopy(self._status)
+
+    def _update(self, **changes: Any) -> None:
+        with self._condition:
+            self._status.update(changes)
+            self._changed()
+
+    def _changed(self) -> None:
+        self._status["updated"] = datetime.now().strftime(DATE_FORMAT)
+        self._version += 1
+        self._condition.notify_all()
+
+
+def _get_file_id(path: str) -> tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_ctime_ns
+
+
+class _StatusRequestHandler(socketserver.StreamRequestHandler):
+    server: _StatusSocketServer
+
+    def handle(self) -> None:
+        self.request.settimeout(SOCKET_TIMEOUT)
+        status = self.server.status
+        try:
+            request = self.rfile.readline(MAX_REQUEST_LENGTH).decode("ascii", "replace").strip()
+            if request == "status":
+                self._send(status.snapshot()[1])
+            elif request == "subscribe":
+                update: tuple[int, dict[str, Any]] | None = status.snapshot()
+                while update is not None:
+                    version, snapshot = update
+                    self._send(snapshot)
+                    if snapshot["result"] is not None:
+                        break
+                    update = status.wait_for_update(version)
+            else:
+                self._send({"error": "Unknown request, expected 'status' or 'subscribe'"})
+        except OSError:
+            pass  # Client disconnected, or did not keep up
+
+    def _send(self, message: dict[str, Any]) -> None:
+        self.wfile.write(json.dumps(message).encode("utf-8") + b"\n")
+
+
+class _StatusSocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # Wait for subscribers to be sent the final status on server_close()
+    block_on_close = True
+
+    def __init__(self, socket_file: str, status: StatusServer) -> None:
+        self.status = status
+        super().__init__(socket_file, _StatusRequestHandler)
+        os.chmod(socket_file, 0o600)
+
+
+def read_status() -> dict[str, Any] | None:
+    """
+    Returns the status of the running updater, or None if no updater is
+    serving its status.
+    """
+    try:
+        with _connect() as sock, sock.makefile("rb") as f:
+            sock.sendall(b"status\n")
+            return json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+
+
+def subscribe() -> Iterator[dict[str, Any]]:
+    """
+    Yields the status of the running updater, and again each time it changes,
+    until the run has completed. Yields nothing if no updater is serving its
+    status.
+    """
+    try:
+        sock = _connect()
+        sock.sendall(b"subscribe\n")
+    except OSError:
+        return
+
+    # Status updates may be minutes apart, e.g. while Salt states are applied
+    sock.settimeout(None)
+    with sock, sock.makefile("rb") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                return
+
+
+def describe(status: Mapping[str, Any]) -> str:
+    """
+    Returns a summary of `status` for logging.
+    """
+    if status.get("result") is not None:
+        return f"completed with status {status['result']['status']}"
+    if status.get("phase") is None:
+        return "starting"
+    return f"in phase '{status['phase']}', {status['percent']}% complete"
+
+
+def _connect() -> socket.socket:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(SOCKET_TIMEOUT)
+    try:
+        sock.connect(get_socket_path())
+    except OSError:
+        sock.close()
+        raise
+    return sock
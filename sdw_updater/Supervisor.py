@@ -0,0 +1,170 @@
+"""
+Event-driven supervision of long-running update commands.
+
+A single selector multiplexes a child process' stdout and stderr, handing each
+complete line to a caller-supplied handler as soon as it arrives. Supervision
+ends the moment the child has closed its pipes and exited, without polling.
+
+This is used for `qubes-vm-update`, `qubesctl` and `qubes-dom0-update`, which
+may run for tens of minutes while producing large amounts of output.
+"""
+
+from __future__ import annotations
+
+import os
+import selectors
+import subprocess
+import time
+from collections.abc import Callable, Mapping
+from typing import IO
+
+# Maximum number of bytes read from a pipe per wakeup
+READ_CHUNK_SIZE = 65536
+
+# Default interval (seconds) between watchdog checks
+WATCHDOG_INTERVAL = 10.0
+
+# Time (seconds) a process is given to exit once asked to terminate, before
+# it is killed
+TERMINATE_GRACE_PERIOD = 10.0
+
+LineHandler = Callable[[str], None]
+
+
+def start(cmd: list[str], merge_stderr: bool = False) -> subprocess.Popen[bytes]:
+    """
+    Start `cmd` with its output connected to pipes suitable for `supervise`.
+    If `merge_stderr` is set, stderr is redirected into stdout.
+    """
+    return subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE,
+    )
+
+
+def supervise(
+    proc: subprocess.Popen[bytes],
+    handlers: Mapping[IO[bytes], LineHandler],
+    encoding: str = "utf-8",
+    errors: str = "replace",
+    watchdog: Callable[[], bool] | None = None,
+    watchdog_interval: float = WATCHDOG_INTERVAL,
+) -> int:
+    """
+    Dispatch every line written to the streams in `handlers` to the associated
+    handler (without the trailing newline), then wait for `proc` to exit.
+    Returns the process' exit code.
+
+    Only complete lines are dispatched; a trailing partial line is flushed once
+    its stream reaches EOF. Memory use is bounded by the longest single line.
+
+    If `watchdog` is given, it is called every `watchdog_interval` seconds.
+    Once it returns False, `proc` is terminated and any further output is
+    discarded. If a handler or the watchdog raises, `proc` is terminated and
+    the exception is propagated.
+    """
+    try:
+        _dispatch(proc, handlers, encoding, errors, watchdog, watchdog_interval)
+    except BaseException:
+        # A handler or the watchdog failed: do not leave the process running
+        if proc.poll() is None:
+            terminate(proc)
+        raise
+    finally:
+        for stream in handlers:
+            stream.close()
+
+    return proc.wait()
+
+
+def _dispatch(
+    proc: subprocess.Popen[bytes],
+    handlers: Mapping[IO[bytes], LineHandler],
+    encoding: str,
+    errors: str,
+    watchdog: Callable[[], bool] | None,
+    watchdog_interval: float,
+) -> None:
+    partial: dict[int, bytes] = {}
+    next_check = time.monotonic() + watchdog_interval
+    with selectors.DefaultSelector() as selector:
+        for stream, handler in handlers.items():
+            selector.register(stream, selectors.EVENT_READ, handler)
+            partial[stream.fileno()] = b""
+
+        while selector.get_map():
+            if watchdog is not None:
+                if time.monotonic() >= next_check:
+                    next_check = time.monotonic() + watchdog_interval
+                    if not watchdog():
+                        terminate(proc)
+                        break
+                timeout: float | None = max(next_check - time.monotonic(), 0.0)
+            else:
+                timeout = None
+
+            for key, _ in selector.select(timeout):
+                handler = key.data
+                chunk = os.read(key.fd, READ_CHUNK_SIZE)
+                if not chunk:
+                    # EOF: flush whatever is left of the last line
+                    if partial[key.fd]:
+                        handler(partial[key.fd].decode(encoding, errors))
+                    selector.unregister(key.fileobj)
+                    continue
+
+                *lines, partial[key.fd] = (partial[key.fd] + chunk).split(b"\n")
+                for line in lines:
+                    handler(line.decode(encoding, errors))
+
+
+def terminate(proc: subprocess.Popen[bytes], grace_period: float = TERMINATE_GRACE_PERIOD) -> None:
+    """
+    Ask `proc` to terminate, and kill it if it has not exited after
+    `grace_period` seconds.
+    """
+    proc.terminate()
+    try:
+        proc.wait(grace_period)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def run(
+    cmd: list[str],
+    on_stdout: LineHandler,
+    on_stderr: LineHandler | None = None,
+    encoding: str = "utf-8",
+    errors: str = "replace",
+) -> int:
+    """
+    Run `cmd` to completion, streaming its output line by line to the given
+    handlers. If `on_stderr` is None, stderr is merged into stdout.
+    Returns the exit code.
+    """
+    proc = start(cmd, merge_stderr=on_stderr is None)
+    assert proc.stdout is not None  # noqa: S101
+    handlers: dict[IO[bytes], LineHandler] = {proc.stdout: on_stdout}
+    if on_stderr is not None:
+        assert proc.stderr is not None  # noqa: S101
+        handlers[proc.stderr] = on_stderr
+
+    return supervise(proc, handlers, encoding=encoding, errors=errors)
+
+
+def check_run(
+    cmd: list[str],
+    on_stdout: LineHandler,
+    on_stderr: LineHandler | None = None,
+    encoding: str = "utf-8",
+    errors: str = "replace",
+) -> None:
+    """
+    Like `run`, but raises `subprocess.CalledProcessError` on a non-zero exit
+    code, mirroring `subprocess.check_call`.
+    """
+    returncode = run(cmd, on_stdout, on_stderr, encoding=encoding, errors=errors)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
@@ -8,27 +8,147 @@ is opened by the user when clicking on the desktop, opening
 
 from __future__ import annotations
 
+import contextlib
+import hashlib
 import json
 import os
+import re
 import subprocess
-import threading
+import sys
 import time
-from collections.abc import Callable, Collection
+from collections.abc import Callable, Collection, Iterator, Mapping
 from datetime import datetime, timedelta
 from enum import Enum
-from typing import IO, Any, TypeGuard
-
-from sdw_util import Util
-
-DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
-DEFAULT_HOME = ".securedrop_updater"
-FLAG_FILE_STATUS_DOM0 = os.path.join(DEFAULT_HOME, "sdw-update-status")
-FLAG_FILE_LAST_UPDATED_DOM0 = os.path.join(DEFAULT_HOME, "sdw-last-updated")
+from typing import TYPE_CHECKING, Any, TypeGuard
+
+from sdw_updater import (
+    Inbox,
+    Preflight,
+    Progress,
+    SaltProgress,
+    Snapshots,
+    Supervisor,
+    Watchdog,
+)
+from sdw_util import State, Util
+
+if TYPE_CHECKING:
+    # Imported lazily at run time: dom0-only system package
+    from qubesadmin import Qubes
+    from qubesadmin.vm import QubesVM
+
+DATE_FORMAT = Util.DATE_FORMAT
+DEFAULT_HOME = Util.BASE_DIRECTORY_NAME
+SALT_STATE_DURATIONS_FILE = os.path.join(DEFAULT_HOME, "salt-state-durations.json")
+FLAG_FILE_DOM0_STATE_DIGEST = os.path.join(DEFAULT_HOME, "sdw-dom0-state-digest")
+FLAG_FILE_TEMPLATE_FINGERPRINTS = os.path.join(DEFAULT_HOME, "sdw-template-fingerprints")
+FLAG_FILE_PREFETCH = os.path.join(DEFAULT_HOME, "sdw-prefetch")
 LOCK_FILE = "sdw-updater.lock"
+PREFETCH_LOCK_FILE = "sdw-prefetch.lock"
+BACKGROUND_LOCK_FILE = "sdw-background-update.lock"
 LOG_FILE = "updater.log"
 DETAIL_LOG_FILE = "updater-detail.log"
 DETAIL_LOGGER_PREFIX = "detail"  # For detailed logs such as Salt states
 
+# Inputs to the dom0 highstate: if none of these have changed since the last
+# successful run, the dom0 state does not need to be applied again.
+DOM0_CONFIG_PACKAGE = "securedrop-workstation-dom0-config"
+DOM0_STATE_INPUT_PATHS = [
+    "/srv/salt/securedrop_salt",
+    "/srv/salt/_tops",  # Enabled top files
+    # Pillar data and its top files (top.sls, _tops), which the states and
+    # the top file match on
+    "/srv/pillar",
+    "/usr/share/securedrop-workstation-dom0-config/config.json",
+]
+# Re-apply the dom0 state at least this often, even when its inputs are
+# unchanged, to correct any drift in dom0 or VM configuration.
+DOM0_STATE_MAX_AGE = timedelta(days=7)
+
+# Inputs to the package sources configured in templates (see fpf-apt-repo.sls).
+# A change to any of these means templates must be updated from the new sources.
+TEMPLATE_SOURCE_INPUT_PATHS = [
+    "/srv/salt/securedrop_salt/fpf-apt-repo.sls",
+    "/srv/salt/securedrop_salt/apt_freedom_press.sources.j2",
+    "/srv/salt/securedrop_salt/apt-test_freedom_press.sources.j2",
+    "/usr/share/securedrop-workstation-dom0-config/config.json",
+]
+# Templates that fail to update, e.g. due to transient network errors over Tor,
+# are retried up to TEMPLATE_UPDATE_RETRIES times, with exponential backoff
+# starting at TEMPLATE_RETRY_BACKOFF seconds. At most TEMPLATE_RETRY_BUDGET
+# template updates are retried per run.
+TEMPLATE_UPDATE_RETRIES = 2
+TEMPLATE_RETRY_BACKOFF = 30
+TEMPLATE_RETRY_MAX_BACKOFF = 120
+TEMPLATE_RETRY_BUDGET = 6
+
+# A template update is considered stalled if it reports no progress for this
+# many seconds. Once all remaining template updates have stalled, qubes-vm-update
+# is stopped and the stalled templates are retried (or fail). All template
+# updates, including retries, must complete within TEMPLATE_UPDATE_DEADLINE.
+TEMPLATE_STALL_TIMEOUT = 900
+TEMPLATE_UPDATE_DEADLINE = 3 * 3600
+# Templates whose updates were stopped this way are shut down, ending apt/dnf
+# inside them (and releasing their locks), or killed if they do not shut down
+# within TEMPLATE_SHUTDOWN_TIMEOUT seconds.
+TEMPLATE_SHUTDOWN_TIMEOUT = 60
+
+# Templates are updated concurrently only as far as they fit in the memory
+# available to start qubes (in KiB), keeping TEMPLATE_MEMORY_RESERVE available
+# for dom0 and qubes started in the meantime. A template's memory use grows
+# from its initial memory towards its maxmem while it updates: each template is
+# planned for up to TEMPLATE_MEMORY_HEADROOM times its initial memory.
+TEMPLATE_MEMORY_RESERVE = 2 * 1024**2
+TEMPLATE_MEMORY_HEADROOM = 2
+
+# Updates downloaded in the background (see `prefetch_updates`) are only
+# relied upon for this long; afterwards, the updater checks for updates again.
+PREFETCH_MAX_AGE = timedelta(hours=6)
+# A template is only skipped as up to date if a background download found no
+# updates for it this recently: updates published since are not detected
+# without refreshing its repository metadata, which takes most of the time of
+# an update.
+TEMPLATE_SKIP_MAX_AGE = timedelta(hours=1)
+
+# Installs dom0 updates downloaded in the background from the local package
+# cache, without refreshing metadata or downloading again (dnf's --cacheonly,
+# passed through by qubes-dom0-update)
+DOM0_UPDATE_CACHED_CMD = ["sudo", "qubes-dom0-update", "-y", "--cacheonly"]
+
+# Commands run as root in templates to download (but not install) updates
+PREFETCH_CMD_DEBIAN = "apt-get -q update && apt-get -q -y --download-only dist-upgrade"
+PREFETCH_CMD_FEDORA = "dnf -y -q --refresh --downloadonly upgrade"
+# Summary printed by apt-get, e.g. "2 upgraded, 1 newly installed, 0 to remove..."
+APT_SUMMARY_REGEX = re.compile(r"^(?P<upgraded>\d+) upgraded, (?P<installed>\d+) newly installed")
+# Printed by dnf (and qubes-dom0-update) if there is nothing to download
+DNF_NOTHING_TO_DO = "Nothing to do"
+
+# The dom0 RPM database (the first path that exists is used); it is modified
+# whenever dom0 packages are installed, upgraded or removed
+RPMDB_PATHS = ["/usr/lib/sysimage/rpm/rpmdb.sqlite", "/var/lib/rpm/rpmdb.sqlite"]
+
+# Installed dom0 packages are listed in this format to find out which have
+# changed during an update
+RPM_QUERY_FORMAT = "%{NAME} %{EPOCHNUM}:%{VERSION}-%{RELEASE}.%{ARCH}\n"
+# dom0 packages that only take effect after a reboot: the kernel (including VM
+# kernels), Xen, firmware and microcode, and core system components that cannot
+# be restarted in place (as in `dnf needs-restarting --reboothint`)
+DOM0_REBOOT_PACKAGES_REGEX = re.compile(
+    r"^(kernel|kernel-.+|xen|xen-.+|.+-firmware|microcode_ctl"
+    r"|glibc|systemd|dbus|dbus-broker|dbus-daemon|libvirt|libvirt-.+)$"
+)
+
+# Cached result of the in-place upgrade check, and the files it depends on: the
+# dom0 release files and RPM database (for dom0's Qubes version), and the
+# qubesd store (for templates' agent versions)
+MID_UPGRADE_CACHE_FILE = os.path.join(DEFAULT_HOME, "sdw-mid-upgrade")
+MID_UPGRADE_INPUT_PATHS = [
+    "/etc/qubes-release",
+    "/etc/system-release",
+    *RPMDB_PATHS,
+    "/var/lib/qubes/qubes.xml",
+]
+
 # We use a hardcoded temporary directory path in dom0. As dom0 is not
 # a multi-user environment, we can safely assume that only the Updater is
 # managing that filepath. Later on, we should consider porting the check-migration
@@ -65,26 +185,38 @@ def get_dom0_path(folder: str) -> str:
     return os.path.join(os.path.expanduser("~"), folder)
 
 
-def run_full_install() -> UpdateStatus:
+def run_full_install(
+    progress_callback: Callable[[int], None] | None = None,
+    expected_growth: int | None = None,
+) -> UpdateStatus:
     """
     Re-apply the entire Salt config via sdw-admin. Required to enforce
-    VM state during major migrations, such as template consolidation.
+    VM state during major migrations, such as template consolidation. Fails
+    without applying it if the default storage pool is not expected to have
+    room for `expected_growth` bytes (see `Preflight.check_storage`).
     """
+    shortages = Preflight.check_storage(
+        pool_growth=(
+            expected_growth
+            if expected_growth is not None
+            else Preflight.DEFAULT_FULL_INSTALL_GROWTH
+        )
+    )
+    if shortages:
+        _log_storage_shortages("apply full system state", shortages)
+        return UpdateStatus.UPDATES_FAILED
+
     sdlog.info("Running 'sdw-admin --apply' to apply full system state")
-    apply_cmd = ["sdw-admin", "--apply"]
-    apply_cmd_for_log = (" ").join(apply_cmd)
+    # Storage was checked above, with the same estimate sdw-admin would use
+    apply_cmd = ["sdw-admin", "--apply", "--skip-storage-check"]
     try:
-        output = subprocess.check_output(apply_cmd)
+        _run_salt_command("apply_all", apply_cmd, progress_callback)
     except subprocess.CalledProcessError as e:
         sdlog.error(f"Failed to apply full system state. Please review {DETAIL_LOG_FILE}.")
         sdlog.error(str(e))
-        clean_output = Util.cleanup_for_log(e.output.decode("utf-8").strip())
-        detail_log.error(f"Output from failed command: {apply_cmd_for_log}\n{clean_output}")
+        detail_log.error(f"Command failed: {' '.join(apply_cmd)}")
         return UpdateStatus.UPDATES_FAILED
 
-    clean_output = Util.cleanup_for_log(output.decode("utf-8").strip())
-    detail_log.info(f"Output from command: {apply_cmd_for_log}\n{clean_output}")
-
     # Clean up flag requesting migration. Shell out since root created it.
     rm_flag_cmd = ["sudo", "rm", "-rf", MIGRATION_DIR]
     try:
@@ -109,48 +241,168 @@ def migration_is_required() -> bool:
     return result
 
 
-def apply_updates_dom0() -> UpdateStatus:
+def apply_updates_dom0(timings: dict[str, float] | None = None) -> UpdateStatus:
     """
-    Apply updates to dom0
+    Apply updates to dom0. If `timings` is given, the duration of the update
+    ("dom0_apply") is recorded in it, in seconds.
     """
     sdlog.info("Applying all updates to dom0")
 
-    dom0_status = _check_updates_dom0()
-    if dom0_status == UpdateStatus.UPDATES_REQUIRED:
-        upgrade_results = _apply_updates_dom0()
-    else:
-        upgrade_results = UpdateStatus.UPDATES_OK
-    return upgrade_results
+    # Updates downloaded in the background are installed from the local cache;
+    # dom0 is always checked for updates published since
+    prefetched = _pop_prefetched_dom0_result()
+    from_cache = prefetched is not None and prefetched["updates_pending"]
+    if from_cache:
+        sdlog.info("Installing dom0 updates downloaded in the background")
+
+    with _timed(timings, "dom0_apply"):
+        return _apply_updates_dom0(from_cache=from_cache)
+
+
+@contextlib.contextmanager
+def _timed(timings: dict[str, float] | None, name: str) -> Iterator[None]:
+    """
+    Record the duration of the enclosed block in `timings[name]`, if given.
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[name] = time.monotonic() - start
 
 
 def apply_updates_templates(
     progress_callback: Callable[[int], None] | None = None,
+    timings: dict[str, float] | None = None,
+    weights: Mapping[str, float] | None = None,
+    completed: Collection[str] = (),
+    results: dict[str, UpdateStatus] | None = None,
+    template_progress_callback: Callable[[str, int], None] | None = None,
+    max_concurrency: int | None = None,
+    concurrency: list[int] | None = None,
+    expected_growth: Mapping[str, int] | None = None,
+    reverted: list[str] | None = None,
+    cancel: Callable[[], bool] | None = None,
 ) -> UpdateStatus:
     """
-    Apply updates to all TemplateVMs.
+    Apply updates to all TemplateVMs that may have updates available, except
+    those in `completed` (already updated in an earlier, incomplete run). If
+    `timings` is given, the update duration of each template is recorded in
+    it, in seconds, and if `results` is given, the status of each template.
+    Progress is averaged across templates, weighted by `weights` if given (e.g.
+    by their expected update duration). The progress of each template is also
+    reported to `template_progress_callback`, if given.
+
+    Templates are updated concurrently as far as they fit in memory, and no
+    more than `max_concurrency` at a time, if given (see
+    `_get_template_concurrency`). The concurrency of each attempt is appended
+    to `concurrency`, if given and known.
+
+    No template is updated if their root volumes, and the storage pools holding
+    them, are not expected to have room for the growth of each template given
+    in `expected_growth` (see `Preflight.check_storage`).
+
+    Templates that fail to update are reverted to their state before the
+    update (see `Snapshots`), and appended to `reverted`, if given. The
+    revisions kept of each template are restored afterwards.
+
+    The template updates are stopped, without retries, once `cancel`, if
+    given, returns True.
     """
-    templates = _get_current_templates()
+    templates = _get_templates_to_update(_get_current_templates(), completed)
+    if not templates:
+        sdlog.info("All templates are up to date, skipping template updates")
+        return overall_update_status({})
+
+    shortages = Preflight.check_storage(templates, expected_growth)
+    if shortages:
+        _log_storage_shortages("update templates", shortages)
+        return UpdateStatus.UPDATES_FAILED
+
+    snapshots = Snapshots.record(templates)
     sdlog.info(f"Applying all updates to VMs: {', '.join(templates)}")
+    # qubes-vm-update may report progress many times per second; only pass on
+    # changes, at a rate the GUI can keep up with
+    coalesced_progress = (
+        Progress.CoalescedProgress(progress_callback) if progress_callback else None
+    )
+    result_update_status: dict[str, UpdateStatus] = {}
+    pending = templates
+    retry_budget = TEMPLATE_RETRY_BUDGET
+    attempt = 1
+    deadline = time.monotonic() + TEMPLATE_UPDATE_DEADLINE
     try:
-        proc = _start_qubes_updater_proc(templates)
-        assert proc.stdout is not None  # noqa: S101
-        assert proc.stderr is not None  # noqa: S101
-        result_update_status: dict[str, UpdateStatus] = {}
-        stderr_thread = threading.Thread(
-            target=_qubes_updater_parse_progress,
-            args=(proc.stderr, result_update_status, templates, progress_callback),
+        while True:
+            attempt_status: dict[str, UpdateStatus] = {}
+            watchdog = Watchdog.StallWatchdog(TEMPLATE_STALL_TIMEOUT, deadline, cancel=cancel)
+            attempt_concurrency = _get_template_concurrency(pending, max_concurrency)
+            if concurrency is not None and attempt_concurrency is not None:
+                concurrency.append(attempt_concurrency)
+            proc = _start_qubes_updater_proc(pending, attempt_concurrency)
+            watchdog.dispatched(pending)
+            assert proc.stdout is not None  # noqa: S101
+            assert proc.stderr is not None  # noqa: S101
+            Supervisor.supervise(
+                proc,
+                {
+                    proc.stdout: _qubes_updater_parse_stdout,
+                    proc.stderr: _qubes_updater_progress_parser(
+                        attempt_status,
+                        pending,
+                        coalesced_progress,
+                        timings,
+                        weights,
+                        completed=[t for t in templates if t not in pending],
+                        watchdog=watchdog,
+                        template_progress_callback=template_progress_callback,
+                    ),
+                },
+                # Output should be ascii-enforced and pre-sanitized; if the 'ascii'
+                # encoding assumption is wrong, replace with '?'
+                encoding="ascii",
+                errors="replace",
+                watchdog=watchdog.check,
+            )
+            _fail_incomplete_template_updates(watchdog, attempt_status)
+            result_update_status.update(attempt_status)
+
+            failed = [t for t in pending if attempt_status[t] != UpdateStatus.UPDATES_OK]
+            if (
+                not failed
+                or attempt > TEMPLATE_UPDATE_RETRIES
+                or retry_budget <= 0
+                or watchdog.deadline_expired
+                or watchdog.cancelled
+            ):
+                break
+            pending = failed[:retry_budget]
+            retry_budget -= len(pending)
+            delay = min(TEMPLATE_RETRY_BACKOFF * 2 ** (attempt - 1), TEMPLATE_RETRY_MAX_BACKOFF)
+            attempt += 1
+            sdlog.info(
+                f"Retrying update of templates in {delay}s (attempt {attempt}): "
+                + ", ".join(pending)
+            )
+            detail_log.info(
+                f"Retrying failed template updates in {delay}s (attempt {attempt}, "
+                f"{retry_budget} retries left for this run): {', '.join(pending)}"
+            )
+            time.sleep(delay)
+
+        if coalesced_progress:
+            coalesced_progress.flush()
+        if results is not None:
+            results.update(result_update_status)
+        _revert_failed_templates(snapshots, result_update_status, reverted)
+
+        _write_template_fingerprints(
+            [
+                template
+                for template, status in result_update_status.items()
+                if status == UpdateStatus.UPDATES_OK
+            ]
         )
-        stdout_thread = threading.Thread(target=_qubes_updater_parse_stdout, args=(proc.stdout,))
-        stderr_thread.start()
-        stdout_thread.start()
-
-        while proc.poll() is None or stderr_thread.is_alive() or stdout_thread.is_alive():
-            time.sleep(1)
-
-        stderr_thread.join()
-        stdout_thread.join()
-        proc.stderr.close()
-        proc.stdout.close()
         update_status = overall_update_status(result_update_status)
         if update_status == UpdateStatus.UPDATES_OK:
             sdlog.info("Template updates successful")
@@ -165,9 +417,213 @@ def apply_updates_templates(
         )
         sdlog.error(str(e))
         return UpdateStatus.UPDATES_FAILED
+    finally:
+        Snapshots.release(snapshots)
+
+
+def _fail_incomplete_template_updates(
+    watchdog: Watchdog.StallWatchdog, attempt_status: dict[str, UpdateStatus]
+) -> None:
+    """
+    Fail the template updates qubes-vm-update did not complete. If the
+    watchdog stopped it, the updates it left running inside templates are
+    stopped, by shutting them down.
+    """
+    for template, status in attempt_status.items():
+        if status != UpdateStatus.UPDATES_IN_PROGRESS:
+            continue
+        sdlog.error(f"Update did not complete for template: '{template}'")
+        attempt_status[template] = UpdateStatus.UPDATES_FAILED
+        if watchdog.stopped:
+            _stop_template_update(template)
+
+
+def _stop_template_update(template: str) -> None:
+    sdlog.info(f"Stopping update inside template: '{template}'")
+    shutdown = subprocess.run(
+        ["qvm-shutdown", "--wait", "--timeout", str(TEMPLATE_SHUTDOWN_TIMEOUT), template],
+        check=False,
+    )
+    if shutdown.returncode != 0:
+        sdlog.warning(f"Template '{template}' did not shut down, killing it")
+        subprocess.run(["qvm-kill", template], check=False)
+
+
+def _revert_failed_templates(
+    snapshots: Mapping[str, Snapshots.Snapshot],
+    results: Mapping[str, UpdateStatus],
+    reverted: list[str] | None = None,
+) -> None:
+    failed = [template for template, status in results.items() if status != UpdateStatus.UPDATES_OK]
+    if not failed:
+        return
+    reverted_templates = Snapshots.revert(snapshots, failed)
+    if reverted_templates:
+        sdlog.info(
+            "Reverted templates that failed to update to their previous state: "
+            + ", ".join(reverted_templates)
+        )
+    if reverted is not None:
+        reverted.extend(reverted_templates)
+
+
+def _log_storage_shortages(action: str, shortages: list[str]) -> None:
+    sdlog.error(f"Not enough storage to {action}. Please free up space and try again.")
+    for shortage in shortages:
+        sdlog.error(shortage)
+
+
+def _get_templates_to_update(
+    templates: Collection[str], completed: Collection[str] = ()
+) -> list[str]:
+    """
+    Returns the templates to update, in a stable order: all templates except
+    those in `completed`, and those with positive evidence of being up to
+    date. The only such evidence is a background download (see
+    `prefetch_updates`) within TEMPLATE_SKIP_MAX_AGE that refreshed the
+    template's repository metadata and found no updates, with the template's
+    package sources unchanged since.
+    """
+    for template in sorted(set(templates) & set(completed)):
+        sdlog.info(f"Template '{template}' was updated by the previous, incomplete run, skipping")
+    templates = [template for template in templates if template not in completed]
+
+    prefetched = _read_prefetched_template_results(_read_template_fingerprints())
+    to_update = []
+    for template in sorted(templates):
+        if template not in prefetched:
+            sdlog.info(f"Template '{template}' requires update: no recent check for updates")
+        elif prefetched[template]["updates_pending"]:
+            sdlog.info(f"Template '{template}' requires update: updates downloaded")
+        else:
+            sdlog.info(f"Template '{template}' had no updates during background download, skipping")
+            continue
+        to_update.append(template)
+    return to_update
+
+
+def _get_template_fingerprint(template: str) -> str:
+    """
+    Returns a fingerprint of the package sources configured for `template`.
+    """
+    digest = hashlib.sha256(template.encode() + b"\0")
+    _update_digest_with_files(digest, TEMPLATE_SOURCE_INPUT_PATHS)
+    return digest.hexdigest()
+
+
+def _read_template_fingerprints() -> dict[str, Any]:
+    try:
+        with open(get_dom0_path(FLAG_FILE_TEMPLATE_FINGERPRINTS)) as f:
+            contents = json.load(f)
+    except Exception:
+        return {}
+    return contents if isinstance(contents, dict) else {}
+
+
+def _write_template_fingerprints(templates: Collection[str]) -> None:
+    """
+    Record a successful update of `templates` from their current package sources.
+    """
+    fingerprints = _read_template_fingerprints()
+    current_date = str(datetime.now().strftime(DATE_FORMAT))
+    for template in templates:
+        fingerprints[template] = {
+            "fingerprint": _get_template_fingerprint(template),
+            "updated": current_date,
+        }
+
+    fingerprints_file = get_dom0_path(FLAG_FILE_TEMPLATE_FINGERPRINTS)
+    try:
+        os.makedirs(os.path.dirname(fingerprints_file), exist_ok=True)
+        with open(fingerprints_file, "w") as f:
+            json.dump(fingerprints, f)
+    except Exception as e:
+        sdlog.error("Error writing template fingerprints")
+        sdlog.error(str(e))
+
+
+def clear_template_fingerprints() -> None:
+    """
+    Forget when templates were last updated, and the results of background
+    downloads for them, so all templates are updated during the next update.
+    """
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(get_dom0_path(FLAG_FILE_TEMPLATE_FINGERPRINTS))
+    prefetch = _read_prefetch_state()
+    if prefetch is not None and prefetch["templates"]:
+        prefetch["templates"] = {}
+        _write_prefetch_state(prefetch)
+
+
+def _get_template_concurrency(
+    templates: Collection[str], max_concurrency: int | None = None
+) -> int | None:
+    """
+    Returns how many of `templates` to update at a time: as many as fit in the
+    memory available to start qubes, largest first, but at least one and no
+    more than `max_concurrency`, if given. If the available memory cannot be
+    determined, returns `max_concurrency`, or None to leave it to
+    qubes-vm-update.
+    """
+    try:
+        # Lazy import: dom0-only system package, not available in CI venv
+        import qubesadmin
+
+        app = qubesadmin.Qubes()
+        available = _get_available_memory(app)
+        needed = sorted(
+            (_get_template_update_memory(app.domains[template]) for template in templates),
+            reverse=True,
+        )
+    except Exception as e:
+        sdlog.warning(f"Cannot determine memory available for template updates: {e}")
+        return max_concurrency
+
+    budget = available - TEMPLATE_MEMORY_RESERVE
+    fitting = 0
+    for template_memory in needed:
+        if template_memory > budget:
+            break
+        budget -= template_memory
+        fitting += 1
+
+    template_concurrency = max(fitting, 1)
+    if max_concurrency is not None:
+        template_concurrency = min(template_concurrency, max_concurrency)
+    sdlog.info(
+        f"Updating up to {template_concurrency} templates at a time "
+        f"({available // 1024} MiB of memory available)"
+    )
+    return template_concurrency
+
+
+def _get_available_memory(app: Qubes) -> int:
+    """
+    Returns the memory (KiB) available to start qubes: free Xen memory, and
+    the memory the Qubes memory manager can reclaim from running qubes by
+    ballooning them down to their initial memory.
+    """
+    reclaimable = 0
+    for vm in app.domains:
+        if vm.klass != "AdminVM" and vm.is_running():
+            reclaimable += max(0, vm.get_mem() - int(vm.memory) * 1024)
+    return int(app.host.get_free_xen_memory()) + reclaimable
 
 
-def _start_qubes_updater_proc(templates: Collection[str]) -> subprocess.Popen[str]:
+def _get_template_update_memory(template: QubesVM) -> int:
+    """
+    Returns the memory (KiB) `template` is expected to use while updating.
+    """
+    memory = int(template.memory)
+    maxmem = int(template.maxmem)
+    if maxmem > 0:  # Memory balancing is enabled
+        memory = max(memory, min(maxmem, memory * TEMPLATE_MEMORY_HEADROOM))
+    return memory * 1024
+
+
+def _start_qubes_updater_proc(
+    templates: Collection[str], max_concurrency: int | None = None
+) -> subprocess.Popen[bytes]:
     update_cmd = [
         "qubes-vm-update",
         "--apply-to-all",  # Enforce app qube restarts
@@ -177,109 +633,384 @@ def _start_qubes_updater_proc(templates: Collection[str]) -> subprocess.Popen[st
         "--targets",
         ",".join(templates),
     ]
+    if max_concurrency is not None:
+        update_cmd += ["--max-concurrency", str(max_concurrency)]
     detail_log.info("Starting Qubes Updater with command: {}".format(" ".join(update_cmd)))
-    return subprocess.Popen(
-        update_cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        encoding="ascii",  # Output should be ascii-enforced and pre-sanitized
-        errors="replace",  # if 'ascii' encoding assumption wrong, replace with '?'
-        text=True,
-    )
+    return Supervisor.start(update_cmd)
 
 
-def _qubes_updater_parse_stdout(stream: IO[str]) -> None:
-    while True:
-        # Already sanitized for terminal output by Qubes Updater
-        line = stream.readline()
-        if len(line) == 0:
-            # Reached EOF
-            break
+def _qubes_updater_parse_stdout(line: str) -> None:
+    # Already sanitized for terminal output by Qubes Updater
+    line = Util.cleanup_for_log(line).rstrip()
+    detail_log.info(f"[Qubes updater] {line}")
 
-        line = Util.cleanup_for_log(line).rstrip()
-        detail_log.info(f"[Qubes updater] {line}")
 
-
-def _qubes_updater_parse_progress(
-    stream: IO[str],
+def _qubes_updater_progress_parser(
     result: dict[str, UpdateStatus],
     templates: Collection[str],
     progress_callback: Callable[[int], None] | None = None,
-) -> None:
-    update_progress: dict[str, int] = {}
+    timings: dict[str, float] | None = None,
+    weights: Mapping[str, float] | None = None,
+    completed: Collection[str] = (),
+    watchdog: Watchdog.StallWatchdog | None = None,
+    template_progress_callback: Callable[[str, int], None] | None = None,
+) -> Supervisor.LineHandler:
+    """
+    Returns a line handler for the progress report qubes-vm-update writes to
+    stderr. The handler records each template's final status in `result`, and
+    the time from its first progress report to completion in `timings`.
+    Progress reports are passed on to `watchdog`, and changes in a template's
+    progress to `template_progress_callback`, if given.
+    Overall progress is the average of the templates' progress, weighted by
+    `weights` (equally by default), with the templates in `completed` (updated
+    by an earlier attempt) counting as done. Templates missing from `weights`
+    are weighted like the average template.
+    """
+    update_progress: dict[str, int] = dict.fromkeys(completed, 100)
+    update_started: dict[str, float] = {}
+    weights = weights or {}
+    default_weight = sum(weights.values()) / len(weights) if weights else 1.0
+    template_weights = {
+        template: weights.get(template, default_weight) for template in [*templates, *completed]
+    }
+    total_weight = sum(template_weights.values()) or 1.0
+
+    report_template_progress = template_progress_callback or (lambda template, progress: None)
 
     for template in templates:
         result[template] = UpdateStatus.UPDATES_IN_PROGRESS
 
-    while True:
+    def parse_progress(line: str) -> None:
         # Already sanitized for terminal output by Qubes Updater
-        line = stream.readline()
-        if len(line) == 0:
-            # Reached EOF
-            break
-
         line = Util.cleanup_for_log(line).rstrip()
         try:
             vm, status, info = line.split()
         except ValueError:
             sdlog.warning("Line in Qubes updater's output could not be parsed")
-            continue
+            return
 
         if status == "updating":
+            if watchdog:
+                watchdog.progress(vm)
             if update_progress.get(vm) is None:
                 sdlog.info(f"Starting update on template: '{vm}'")
                 update_progress[vm] = 0
+                update_started[vm] = time.monotonic()
+                report_template_progress(vm, 0)
             else:
                 vm_progress = int(float(info))
+                # Fractional progress reports that do not change the template's
+                # integer progress cannot change the overall progress either
+                if vm_progress == update_progress[vm]:
+                    return
                 update_progress[vm] = vm_progress
+                report_template_progress(vm, vm_progress)
                 if progress_callback:
-                    progress_callback(sum(update_progress.values()) // len(templates))
+                    progress_callback(
+                        int(
+                            sum(
+                                progress * template_weights.get(template, 0.0)
+                                for template, progress in update_progress.items()
+                            )
+                            / total_weight
+                        )
+                    )
 
         # First time complete (status "done") may be repeated various times
-        if status == "done" and result[vm] == UpdateStatus.UPDATES_IN_PROGRESS:
+        if status == "done" and result.get(vm) == UpdateStatus.UPDATES_IN_PROGRESS:
+            if watchdog:
+                watchdog.done(vm)
             result[vm] = UpdateStatus.from_qubes_updater_name(info)
+            if timings is not None and vm in update_started:
+                timings[vm] = time.monotonic() - update_started[vm]
             if result[vm] == UpdateStatus.UPDATES_OK:
                 sdlog.info(f"Update successful for template: '{vm}'")
                 update_progress[vm] = 100
+                report_template_progress(vm, 100)
             else:
                 sdlog.error(f"Update failed for template: '{vm}'")
 
+    return parse_progress
 
-def _check_updates_dom0() -> UpdateStatus:
-    """
-    We need to reboot the system after every dom0 update. The update
-    script does not tell us through its exit code whether updates were applied,
-    and parsing command output can be brittle.
 
-    For this reason, we check for available updates first. The result of this
-    check is cached, so it does not incur a significant performance penalty.
+def _apply_updates_dom0(from_cache: bool = False) -> UpdateStatus:
     """
+    Apply updates to dom0 in a single transaction, from the local package cache
+    if `from_cache` is set (falling back to downloading them if that fails).
+    `qubes-dom0-update` does not tell us through its exit code whether updates
+    were applied, so the installed packages are compared before and after the
+    update instead. A reboot is only required if packages matching
+    DOM0_REBOOT_PACKAGES_REGEX have changed.
+    """
+    sdlog.info("Updating dom0")
+    packages_before = _get_dom0_packages()
     try:
-        subprocess.check_call(["sudo", "qubes-dom0-update", "--check-only"])
+        if not (from_cache and _install_cached_dom0_updates()):
+            subprocess.check_call(["sudo", "qubes-dom0-update", "-y"])
     except subprocess.CalledProcessError as e:
-        sdlog.error("dom0 updates required, or cannot check for updates")
+        sdlog.error("An error has occurred updating dom0. Please contact your administrator.")
         sdlog.error(str(e))
-        return UpdateStatus.UPDATES_REQUIRED
+        return UpdateStatus.UPDATES_FAILED
+    packages_after = _get_dom0_packages()
+
+    if packages_before is None or packages_after is None:
+        sdlog.warning("Cannot tell which dom0 packages were updated, assuming a reboot is required")
+        return UpdateStatus.REBOOT_REQUIRED
+
+    changed = _changed_packages(packages_before, packages_after)
+    if not changed:
+        sdlog.info("No updates available for dom0")
+        return UpdateStatus.UPDATES_OK
+
+    sdlog.info("dom0 packages changed: {}".format(", ".join(changed)))
+    reboot_packages = [name for name in changed if DOM0_REBOOT_PACKAGES_REGEX.match(name)]
+    if reboot_packages:
+        sdlog.info(
+            "dom0 updates have been applied and a reboot is required for: {}".format(
+                ", ".join(reboot_packages)
+            )
+        )
+        return UpdateStatus.REBOOT_REQUIRED
 
-    sdlog.info("No updates available for dom0")
+    sdlog.info("dom0 updates have been applied, no reboot is required.")
     return UpdateStatus.UPDATES_OK
 
 
-def _apply_updates_dom0() -> UpdateStatus:
+def _install_cached_dom0_updates() -> bool:
     """
-    Apply updates to dom0. Any update to dom0 will require a reboot after
-    the upgrade.
+    Install dom0 updates from the local package cache. Returns False if this
+    failed, e.g. because the cache was cleaned since updates were downloaded.
     """
-    sdlog.info("Updating dom0")
     try:
-        subprocess.check_call(["sudo", "qubes-dom0-update", "-y"])
+        subprocess.check_call(DOM0_UPDATE_CACHED_CMD)
     except subprocess.CalledProcessError as e:
-        sdlog.error("An error has occurred updating dom0. Please contact your administrator.")
+        sdlog.warning("Cannot install dom0 updates from the local cache, downloading them again")
+        sdlog.warning(str(e))
+        return False
+    return True
+
+
+def _get_dom0_packages() -> set[str] | None:
+    """
+    Returns the installed dom0 packages as "<name> <epoch>:<version>-<release>.<arch>"
+    strings, or None if they cannot be listed.
+    """
+    try:
+        output = subprocess.check_output(["rpm", "-qa", "--queryformat", RPM_QUERY_FORMAT])
+    except (OSError, subprocess.CalledProcessError) as e:
+        sdlog.error("Error listing installed dom0 packages")
         sdlog.error(str(e))
-        return UpdateStatus.UPDATES_FAILED
+        return None
+    return {line for line in output.decode("utf-8").splitlines() if line.strip()}
+
+
+def _changed_packages(before: set[str], after: set[str]) -> list[str]:
+    """
+    Returns the names of packages that were installed, upgraded, downgraded or
+    removed between the package lists `before` and `after`.
+    """
+    return sorted({package.split()[0] for package in before ^ after})
+
+
+def prefetch_updates() -> UpdateStatus:
+    """
+    Download, but do not install, available updates for dom0 and all
+    templates, so that a subsequent interactive update only has to install
+    them. The results are recorded for the interactive updater, which relies
+    on them for up to PREFETCH_MAX_AGE.
+
+    Stops early if the interactive updater is started in the meantime.
+    """
+    sdlog.info("Downloading updates in the background")
+    current_date = str(datetime.now().strftime(DATE_FORMAT))
+    prefetch: dict[str, Any] = {"prefetched": current_date, "dom0": None, "templates": {}}
+    results: dict[str, UpdateStatus] = {}
+
+    if _is_updater_running():
+        return UpdateStatus.UPDATES_REQUIRED
+    prefetch["dom0"] = _prefetch_dom0()
+    results["dom0"] = UpdateStatus(prefetch["dom0"]["status"])
+
+    for template in sorted(_get_current_templates()):
+        if _is_updater_running():
+            break
+        prefetch["templates"][template] = _prefetch_template(template)
+        results[template] = UpdateStatus(prefetch["templates"][template]["status"])
+
+    _write_prefetch_state(prefetch)
+    return overall_update_status(results)
+
+
+def _is_updater_running() -> bool:
+    if Util.can_obtain_lock(LOCK_FILE, log=False):
+        return False
+    sdlog.info("Updater is running, stopping background download")
+    return True
+
+
+def wait_for_prefetch() -> None:
+    """
+    Wait for a background download started before the updater to stop.
+    It stops on its own after the current step once the updater is running.
+    """
+    if not Util.can_obtain_lock(PREFETCH_LOCK_FILE, log=False):
+        sdlog.info("Waiting for background download to stop")
+        Util.wait_for_lock(PREFETCH_LOCK_FILE)
+
+
+def wait_for_background_update() -> bool:
+    """
+    Wait for a background template update started before the updater to
+    stop. It is cancelled once the updater is running (see
+    `BackgroundUpdate`). Returns True if it was running.
+    """
+    if Util.can_obtain_lock(BACKGROUND_LOCK_FILE, log=False):
+        return False
+    sdlog.info("Waiting for background update to stop")
+    Util.wait_for_lock(BACKGROUND_LOCK_FILE)
+    return True
+
+
+def _prefetch_dom0() -> dict[str, Any]:
+    cmd = ["sudo", "qubes-dom0-update", "--downloadonly", "-y"]
+    log_line = _log_command_output(cmd)
+    nothing_to_do = False
+
+    def handle_line(line: str) -> None:
+        nonlocal nothing_to_do
+        log_line(line)
+        nothing_to_do = nothing_to_do or DNF_NOTHING_TO_DO in line
+
+    if Supervisor.run(cmd, handle_line) != 0:
+        sdlog.error("Failed to download dom0 updates")
+        return {"status": UpdateStatus.UPDATES_FAILED.value, "updates_pending": True}
+
+    sdlog.info(f"dom0 updates {'not available' if nothing_to_do else 'downloaded'}")
+    return {"status": UpdateStatus.UPDATES_OK.value, "updates_pending": not nothing_to_do}
+
+
+def _prefetch_template(template: str) -> dict[str, Any]:
+    """
+    Download updates inside `template`, shutting it down again afterwards if
+    it was not running before.
+    """
+    is_fedora = template.startswith("fedora")
+    cmd = [
+        "qvm-run",
+        "--user",
+        "root",
+        "--pass-io",
+        "--no-gui",
+        template,
+        PREFETCH_CMD_FEDORA if is_fedora else PREFETCH_CMD_DEBIAN,
+    ]
+    was_running = (
+        subprocess.run(["qvm-check", "--quiet", "--running", template], check=False).returncode == 0
+    )
+
+    log_line = _log_command_output(cmd)
+    # apt-get always prints a summary; dnf only reports when there is nothing to do
+    updates_pending = is_fedora
 
-    sdlog.info("dom0 updates have been applied and a reboot is required.")
-    return UpdateStatus.REBOOT_REQUIRED
+    def handle_line(line: str) -> None:
+        nonlocal updates_pending
+        log_line(line)
+        if is_fedora:
+            updates_pending = updates_pending and DNF_NOTHING_TO_DO not in line
+        elif match := APT_SUMMARY_REGEX.match(line):
+            updates_pending = int(match.group("upgraded")) + int(match.group("installed")) > 0
+
+    returncode = Supervisor.run(cmd, handle_line)
+
+    if not was_running:
+        subprocess.run(["qvm-shutdown", "--wait", template], check=False)
+
+    if returncode != 0:
+        sdlog.error(f"Failed to download updates for template: '{template}'")
+        return {"status": UpdateStatus.UPDATES_FAILED.value, "updates_pending": True}
+
+    sdlog.info(
+        f"Updates {'downloaded' if updates_pending else 'not available'} for template: "
+        f"'{template}'"
+    )
+    return {
+        "status": UpdateStatus.UPDATES_OK.value,
+        "updates_pending": updates_pending,
+        "fingerprint": _get_template_fingerprint(template),
+    }
+
+
+def _read_prefetch_state() -> dict[str, Any] | None:
+    """
+    Returns the results of the last background download if it is recent
+    enough to be relied upon, otherwise None.
+    """
+    try:
+        with open(get_dom0_path(FLAG_FILE_PREFETCH)) as f:
+            prefetch = json.load(f)
+        prefetched = datetime.strptime(prefetch["prefetched"], DATE_FORMAT)
+    except Exception:
+        return None
+
+    if datetime.now() - prefetched >= PREFETCH_MAX_AGE:
+        return None
+    return prefetch
+
+
+def _write_prefetch_state(prefetch: dict[str, Any]) -> None:
+    prefetch_file = get_dom0_path(FLAG_FILE_PREFETCH)
+    try:
+        os.makedirs(os.path.dirname(prefetch_file), exist_ok=True)
+        with open(prefetch_file, "w") as f:
+            json.dump(prefetch, f)
+    except Exception as e:
+        sdlog.error("Error writing background download results")
+        sdlog.error(str(e))
+
+
+def _pop_prefetched_dom0_result() -> dict[str, Any] | None:
+    """
+    Returns the successful dom0 result of a recent background download, if
+    any. It is removed, as it no longer applies once dom0 has been updated.
+    """
+    prefetch = _read_prefetch_state()
+    if prefetch is None or prefetch.get("dom0") is None:
+        return None
+
+    result = prefetch["dom0"]
+    prefetch["dom0"] = None
+    _write_prefetch_state(prefetch)
+    if result["status"] != UpdateStatus.UPDATES_OK.value:
+        return None
+    return result
+
+
+def _read_prefetched_template_results(fingerprints: dict[str, Any]) -> dict[str, Any]:
+    """
+    Returns the successful template results of a background download within
+    TEMPLATE_SKIP_MAX_AGE that are still valid: the template has not been
+    updated since, and its package sources have not changed.
+    """
+    prefetch = _read_prefetch_state()
+    if prefetch is None:
+        return {}
+
+    prefetched = datetime.strptime(prefetch["prefetched"], DATE_FORMAT)
+    if datetime.now() - prefetched >= TEMPLATE_SKIP_MAX_AGE:
+        return {}
+    results = {}
+    for template, result in prefetch["templates"].items():
+        try:
+            updated = datetime.strptime(fingerprints[template]["updated"], DATE_FORMAT)
+        except (KeyError, TypeError, ValueError):
+            updated = None
+        if (
+            result["status"] == UpdateStatus.UPDATES_OK.value
+            and result["fingerprint"] == _get_template_fingerprint(template)
+            and (updated is None or updated < prefetched)
+        ):
+            results[template] = result
+    return results
 
 
 def _write_last_updated_flags_to_disk() -> None:
@@ -288,14 +1019,9 @@ def _write_last_updated_flags_to_disk() -> None:
     """
     current_date = str(datetime.now().strftime(DATE_FORMAT))
 
-    flag_file_dom0_last_updated = get_dom0_path(FLAG_FILE_LAST_UPDATED_DOM0)
-
     try:
         sdlog.info(f"Setting last updated to {current_date} in dom0")
-        if not os.path.exists(os.path.dirname(flag_file_dom0_last_updated)):
-            os.makedirs(os.path.dirname(flag_file_dom0_last_updated))
-        with open(flag_file_dom0_last_updated, "w") as f:
-            f.write(current_date)
+        State.write_last_updated()
     except Exception as e:
         sdlog.error("Error writing last updated flag to dom0")
         sdlog.error(str(e))
@@ -305,18 +1031,9 @@ def _write_updates_status_flag_to_disk(status: UpdateStatus) -> None:
     """
     Writes the latest SecureDrop Workstation update status to disk in dom0.
     """
-    flag_file_path_dom0 = get_dom0_path(FLAG_FILE_STATUS_DOM0)
-
     try:
         sdlog.info(f"Setting update flag to {status.value} in dom0")
-        if not os.path.exists(os.path.dirname(flag_file_path_dom0)):
-            os.makedirs(os.path.dirname(flag_file_path_dom0))
-
-        current_date = str(datetime.now().strftime(DATE_FORMAT))
-
-        with open(flag_file_path_dom0, "w") as f:
-            flag_contents = {"last_status_update": current_date, "status": status.value}
-            json.dump(flag_contents, f)
+        State.write_status(status.value)
     except Exception as e:
         sdlog.error("Error writing update status flag to dom0")
         sdlog.error(str(e))
@@ -362,23 +1079,21 @@ def _get_uptime() -> timedelta:
 
 def read_dom0_update_flag_from_disk() -> dict[str, Any] | None:
     """
-    Read the SecureDrop Workstation update flag from disk in dom0. Returns
-    the parsed JSON (with `status` and `last_status_update` keys) when the
-    file exists and contains a recognized status, otherwise None.
+    Read the SecureDrop Workstation update status from the updater state in
+    dom0. Returns a dict with `status` and `last_status_update` keys when a
+    recognized status has been recorded, otherwise None.
     """
-    flag_file_path_dom0 = get_dom0_path(FLAG_FILE_STATUS_DOM0)
-
-    try:
-        with open(flag_file_path_dom0) as f:
-            contents = json.load(f)
-            for status in UpdateStatus:
-                if int(contents["status"]) == int(status.value):
-                    return contents
-    except Exception:
+    state = State.read()
+    if state.status is None or state.status_updated is None:
         sdlog.info("Cannot read dom0 status flag, assuming first run")
         return None
+    if state.status not in {status.value for status in UpdateStatus}:
+        return None
 
-    return None
+    return {
+        "status": state.status,
+        "last_status_update": state.status_updated.strftime(DATE_FORMAT),
+    }
 
 
 def overall_update_status(results: dict[str, UpdateStatus]) -> UpdateStatus:
@@ -415,34 +1130,318 @@ def overall_update_status(results: dict[str, UpdateStatus]) -> UpdateStatus:
     return UpdateStatus.UPDATES_OK
 
 
-def apply_dom0_state() -> UpdateStatus:
+def apply_dom0_state(progress_callback: Callable[[int], None] | None = None) -> UpdateStatus:
     """
     Applies the dom0 state to ensure dom0 and AppVMs are properly
     Configured. This will *not* enforce configuration inside the AppVMs.
     Here, we call qubectl directly (instead of through sdw-admin) to
     ensure it is environment-specific.
+
+    The highstate is skipped if its inputs (Salt files, config.json and the
+    dom0 config package version) are unchanged since the last successful run,
+    unless that run is older than DOM0_STATE_MAX_AGE.
     """
+    digest = _get_dom0_state_digest()
+    if digest is not None and _is_dom0_state_current(digest):
+        sdlog.info("Dom0 state inputs unchanged since last successful run, skipping dom0 state")
+        return UpdateStatus.UPDATES_OK
+
     sdlog.info("Applying dom0 state")
     cmd = ["sudo", "qubesctl", "--show-output", "state.highstate"]
-    cmd_for_log = " ".join(cmd)
     try:
-        output = subprocess.check_output(cmd)
+        _run_salt_command("apply_dom0", cmd, progress_callback)
         sdlog.info("Dom0 state applied")
-        clean_output = Util.cleanup_for_log(output.decode("utf-8").strip())
-        detail_log.info(f"Output from command: {cmd_for_log}\n{clean_output}")
+        if digest is not None:
+            _write_dom0_state_digest(digest)
         return UpdateStatus.UPDATES_OK
     except subprocess.CalledProcessError as e:
         sdlog.error(f"Failed to apply dom0 state. See {DETAIL_LOG_FILE} for details.")
         sdlog.error(str(e))
-        clean_output = Util.cleanup_for_log(e.output.decode("utf-8").strip())
-        detail_log.error(f"Output from failed command: {cmd_for_log}\n{clean_output}")
+        detail_log.error(f"Command failed: {' '.join(cmd)}")
         return UpdateStatus.UPDATES_FAILED
 
 
+def _get_dom0_state_digest() -> str | None:
+    """
+    Returns a digest over all inputs of the dom0 highstate, or None if it
+    cannot be determined (in which case the state should always be applied).
+    """
+    try:
+        package_version = subprocess.check_output(
+            ["rpm", "-q", DOM0_CONFIG_PACKAGE], stderr=subprocess.DEVNULL, text=True
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        sdlog.warning("Could not determine dom0 config package version")
+        return None
+
+    digest = hashlib.sha256(package_version.strip().encode())
+    _update_digest_with_files(digest, DOM0_STATE_INPUT_PATHS)
+    return digest.hexdigest()
+
+
+def _update_digest_with_files(digest: hashlib._Hash, input_paths: list[str]) -> None:
+    """
+    Feed the names and contents of all files at or below `input_paths` into
+    `digest`.
+    """
+    for input_path in input_paths:
+        for path in _list_files(input_path):
+            digest.update(path.encode() + b"\0")
+            try:
+                with open(path, "rb") as f:
+                    while chunk := f.read(65536):
+                        digest.update(chunk)
+            except PermissionError:
+                # e.g. secrets readable by root only: fall back to file metadata
+                stat = os.stat(path)
+                digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+            except FileNotFoundError:
+                digest.update(b"missing")
+            digest.update(b"\0")
+
+
+def _list_files(path: str) -> list[str]:
+    """
+    Returns `path` if it is a file, or all files below it if it is a
+    directory, in a stable order. Symlinks (as used for enabled top files)
+    are followed.
+    """
+    if not os.path.isdir(path):
+        return [path]
+    files: list[str] = []
+    for dirpath, dirnames, filenames in os.walk(path, followlinks=True):
+        dirnames.sort()
+        files.extend(os.path.join(dirpath, filename) for filename in sorted(filenames))
+    return files
+
+
+def _is_dom0_state_current(digest: str) -> bool:
+    """
+    Checks whether the dom0 state was successfully applied with inputs
+    matching `digest`, recently enough.
+    """
+    try:
+        with open(get_dom0_path(FLAG_FILE_DOM0_STATE_DIGEST)) as f:
+            contents = json.load(f)
+        applied = datetime.strptime(contents["applied"], DATE_FORMAT)
+    except Exception:
+        return False
+
+    if datetime.now() - applied >= DOM0_STATE_MAX_AGE:
+        sdlog.info("Dom0 state was last applied too long ago, applying again")
+        return False
+    return contents["digest"] == digest
+
+
+def is_dom0_up_to_date() -> bool:
+    """
+    Returns True if the updater would have nothing to do in dom0: no full
+    Salt run is required, the dom0 state was recently applied with its current
+    inputs, and no dom0 updates are available (which are downloaded if so).
+    """
+    if migration_is_required():
+        return False
+    digest = _get_dom0_state_digest()
+    if digest is None or not _is_dom0_state_current(digest):
+        sdlog.info("dom0 state not current, updater run required")
+        return False
+    if _prefetch_dom0()["updates_pending"]:
+        sdlog.info("dom0 updates pending, updater run required")
+        return False
+    return True
+
+
+def _write_dom0_state_digest(digest: str) -> None:
+    digest_file = get_dom0_path(FLAG_FILE_DOM0_STATE_DIGEST)
+    try:
+        os.makedirs(os.path.dirname(digest_file), exist_ok=True)
+        with open(digest_file, "w") as f:
+            current_date = str(datetime.now().strftime(DATE_FORMAT))
+            json.dump({"digest": digest, "applied": current_date}, f)
+    except Exception as e:
+        sdlog.error("Error writing dom0 state digest")
+        sdlog.error(str(e))
+
+
+def clear_dom0_state_digest() -> None:
+    """
+    Forget the inputs of the last successful dom0 state run, so the dom0
+    state is applied during the next update.
+    """
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(get_dom0_path(FLAG_FILE_DOM0_STATE_DIGEST))
+
+
+def _run_salt_command(
+    phase: str, cmd: list[str], progress_callback: Callable[[int], None] | None = None
+) -> None:
+    """
+    Run a Salt command, streaming its output to the detail log while reporting
+    progress based on the number of states completed in the previous
+    successful run of the same `phase`. Per-state durations are saved on
+    success. Raises `subprocess.CalledProcessError` on failure.
+    """
+    state_durations = _read_salt_state_durations()
+    progress = SaltProgress.SaltProgress(
+        expected_states=state_durations.get(phase, {}).get("total_states"),
+        progress_callback=progress_callback,
+    )
+    log_line = _log_command_output(cmd)
+
+    def handle_line(line: str) -> None:
+        log_line(line)
+        progress.feed(line)
+
+    Supervisor.check_run(cmd, handle_line)
+
+    slowest = "\n".join(
+        f"{duration:>12.1f} ms  {state}" for state, duration in progress.slowest_states()
+    )
+    detail_log.info(f"Slowest Salt states during {phase}:\n{slowest}")
+    state_durations[phase] = {
+        "total_states": progress.completed_states,
+        "durations": progress.durations,
+    }
+    _write_salt_state_durations(state_durations)
+
+
+def _read_salt_state_durations() -> dict[str, Any]:
+    """
+    Read the per-state durations recorded for each Salt phase, keyed by phase.
+    Returns an empty dict if none have been recorded yet.
+    """
+    try:
+        with open(get_dom0_path(SALT_STATE_DURATIONS_FILE)) as f:
+            contents = json.load(f)
+    except Exception:
+        return {}
+    return contents if isinstance(contents, dict) else {}
+
+
+def _write_salt_state_durations(state_durations: dict[str, Any]) -> None:
+    durations_file = get_dom0_path(SALT_STATE_DURATIONS_FILE)
+    try:
+        os.makedirs(os.path.dirname(durations_file), exist_ok=True)
+        with open(durations_file, "w") as f:
+            json.dump(state_durations, f)
+    except Exception as e:
+        sdlog.error("Error writing Salt state durations")
+        sdlog.error(str(e))
+
+
+def _log_command_output(cmd: list[str]) -> Supervisor.LineHandler:
+    """
+    Returns a line handler that writes the output of `cmd` to the detail log
+    as it arrives, with ANSI formatting removed. Salt output can run to many
+    megabytes, so it is never held in memory as a whole.
+    """
+    detail_log.info(f"Output from command: {' '.join(cmd)}")
+
+    def log_line(line: str) -> None:
+        detail_log.info(Util.cleanup_for_log(line).rstrip())
+
+    return log_line
+
+
+def dom0_packages_changed_since_status_update() -> bool:
+    """
+    Checks whether dom0 packages may have changed since the update status was
+    last written. If not, no in-place upgrade can have started since the last
+    updater run, which checked for one before applying updates. Returns True
+    if this cannot be determined.
+    """
+    status = read_dom0_update_flag_from_disk()
+    if status is None:
+        return True
+
+    try:
+        status_time = datetime.strptime(status["last_status_update"], DATE_FORMAT)
+    except (KeyError, ValueError):
+        return True
+
+    for path in RPMDB_PATHS:
+        try:
+            rpmdb_time = datetime.fromtimestamp(os.path.getmtime(path))
+        except OSError:
+            continue
+        # The status time is truncated to seconds, so a change within the same
+        # second is treated as a change
+        return rpmdb_time >= status_time
+
+    return True
+
+
+def get_dom0_packages_key() -> str | None:
+    """
+    Returns a key that changes whenever dom0 packages are installed, upgraded
+    or removed, or None if the RPM database cannot be found.
+    """
+    for path in RPMDB_PATHS:
+        try:
+            return f"{path}:{os.stat(path).st_mtime_ns}"
+        except OSError:
+            continue
+    return None
+
+
+def launch_securedrop_inbox(warmup: Inbox.QubeWarmup | None = None) -> None:
+    """
+    Helper function to launch the SecureDrop Inbox (see `Inbox.launch`)
+    """
+    Inbox.launch(warmup)
+    sys.exit(0)
+
+
 def is_qubes_mid_upgrade() -> bool:
     """
     Detects if the system is in the middle of a dist. upgrade (e.g. 4.2 -> 4.3)
 
+    The result is cached until any of MID_UPGRADE_INPUT_PATHS is modified.
+    """
+    cache_key = _get_mid_upgrade_cache_key()
+    if cache_key is not None:
+        try:
+            with open(get_dom0_path(MID_UPGRADE_CACHE_FILE)) as f:
+                cached = json.load(f)
+            if cached["key"] == cache_key:
+                return cached["mid_upgrade"]
+        except Exception:
+            sdlog.info("No cached in-place upgrade check result")
+
+    mid_upgrade = _detect_qubes_mid_upgrade()
+
+    if cache_key is not None:
+        cache_file = get_dom0_path(MID_UPGRADE_CACHE_FILE)
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            with open(cache_file, "w") as f:
+                json.dump({"key": cache_key, "mid_upgrade": mid_upgrade}, f)
+        except Exception as e:
+            sdlog.error("Error writing in-place upgrade check result")
+            sdlog.error(str(e))
+
+    return mid_upgrade
+
+
+def _get_mid_upgrade_cache_key() -> dict[str, int | None] | None:
+    """
+    Returns the modification times of MID_UPGRADE_INPUT_PATHS (None for those
+    that do not exist), or None if any of them cannot be checked, in which
+    case the result of the in-place upgrade check cannot be cached.
+    """
+    key: dict[str, int | None] = {}
+    for path in MID_UPGRADE_INPUT_PATHS:
+        try:
+            key[path] = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            key[path] = None
+        except OSError:
+            return None
+    return key
+
+
+def _detect_qubes_mid_upgrade() -> bool:
+    """
     This detects if STAGE 4 of qubes-dist-upgrade has not yet started.
     """
     # Lazy imports: these are dom0-only system packages, not available in CI venv
@@ -494,6 +1493,19 @@ def should_launch_updater(interval: int) -> bool:
     return True
 
 
+def inbox_launch_expected(interval: int) -> bool:
+    """
+    Predicts whether `should_launch_updater` will let the inbox be launched,
+    without logging or updating the status on disk.
+    """
+    status = read_dom0_update_flag_from_disk()
+    if not _valid_status(status) or _interval_expired(interval, status):
+        return False
+    if status["status"] == UpdateStatus.REBOOT_REQUIRED.value:
+        return last_required_reboot_performed()
+    return status["status"] == UpdateStatus.UPDATES_OK.value
+
+
 def _valid_status(status: dict[str, Any] | None) -> TypeGuard[dict[str, Any]]:
     """
     status should contain 2 items, the update flag and a timestamp.
@@ -1,35 +1,25 @@
+import math
 import subprocess
 import sys
-from collections.abc import Callable
 from typing import Any
 
 try:
-    from PyQt6.QtCore import QThread, pyqtSignal, pyqtSlot
-    from PyQt6.QtWidgets import QDialog
+    from PyQt6.QtCore import QThread, QTimer, pyqtSignal, pyqtSlot
+    from PyQt6.QtWidgets import QApplication, QDialog
 except ImportError:
-    from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot  # type: ignore [no-redef]
-    from PyQt5.QtWidgets import QDialog  # type: ignore [no-redef]
+    from PyQt5.QtCore import QThread, QTimer, pyqtSignal, pyqtSlot  # type: ignore [no-redef]
+    from PyQt5.QtWidgets import QApplication, QDialog  # type: ignore [no-redef]
 
-from sdw_updater import Updater, strings
-from sdw_updater.Updater import UpdateStatus
+from sdw_updater import Pipeline, Preflight, strings
+from sdw_updater.Updater import UpdateStatus, launch_securedrop_inbox
 from sdw_updater.UpdaterAppUiQt6 import Ui_UpdaterDialog
 from sdw_util import Util
 
 logger = Util.get_logger(module=__name__)
 
-
-def launch_securedrop_inbox() -> None:
-    """
-    Helper function to launch the SecureDrop Inbox
-    """
-    try:
-        logger.info("Launching SecureDrop Inbox")
-        subprocess.Popen(["qvm-start", "sd-proxy"])
-        subprocess.Popen(["qvm-run", "sd-app", "gtk-launch press.freedom.SecureDropApp"])
-    except subprocess.CalledProcessError as e:
-        logger.error("Error while launching SecureDrop Inbox")
-        logger.error(str(e))
-    sys.exit(0)
+# How often the progress bar and estimated time remaining are refreshed while
+# no progress is reported, e.g. while dom0 updates are installed
+PROGRESS_REFRESH_INTERVAL_MS = 5000
 
 
 class UpdaterApp(QDialog, Ui_UpdaterDialog):
@@ -58,7 +48,7 @@ class UpdaterApp(QDialog, Ui_UpdaterDialog):
 
         self.inboxOpenButton.setEnabled(False)
         self.inboxOpenButton.hide()
-        self.inboxOpenButton.clicked.connect(launch_securedrop_inbox)
+        self.inboxOpenButton.clicked.connect(self.open_inbox)
 
         self.rebootButton.setEnabled(False)
         self.rebootButton.hide()
@@ -80,8 +70,10 @@ class UpdaterApp(QDialog, Ui_UpdaterDialog):
         is used to check for TemplateVM upgrades
         """
         logger.info(f"Signal: upgrade_status {str(result)}")
+        self.progress_timer.stop()
         self.progress = 100
         self.progressBar.setProperty("value", self.progress)
+        self.progressBar.setFormat(strings.progress_format)
 
         if result["recommended_action"] == UpdateStatus.REBOOT_REQUIRED:
             logger.info("Reboot required")
@@ -122,31 +114,46 @@ class UpdaterApp(QDialog, Ui_UpdaterDialog):
         self.progress = current_progress
         self.progressBar.setProperty("value", self.progress)
 
+    @pyqtSlot(int)
+    def update_time_remaining(self, seconds: int) -> None:
+        """
+        This slot will receive the estimated number of seconds until updates
+        complete from UpgradeThread, and show it on the progressBar.
+        """
+        self.progressBar.setFormat(_format_time_remaining(seconds))
+
+    def open_inbox(self) -> None:
+        """
+        Launch the SecureDrop Inbox and exit. The dialog is hidden first, as
+        the launch waits until the inbox qubes are ready.
+        """
+        self.hide()
+        QApplication.processEvents()
+        launch_securedrop_inbox()
+
     def _check_network_and_update(self) -> None:
         """
-        Wrapper for `apply_all_updates` that ensures network connectivity
-        before updating, else stops the update and shows a connectivity error
-        message to the user.
+        Wrapper for `apply_all_updates`. The UpgradeThread ensures network
+        connectivity before updating, as part of its pre-flight checks (see
+        `Preflight.run_preflight`), else stops the update and shows a
+        connectivity error message to the user.
 
         Because this check happens before updates begin, an error at this stage
         simply stops the update attempt and does not affect the last
         UpdateStatus or affect the update timestamp.
         """
-
         if self._skip_netcheck:
             logger.info("Network check skipped; launching updater")
-            self.apply_all_updates()
-        elif _is_netcheck_successful():
-            logger.info("Network check successful; checking for updates.")
-            self.apply_all_updates()
-        else:
-            logger.error("Network connectivity check failed; cannot check for updates.")
-            self._show_network_error()
+        self.apply_all_updates()
 
+    @pyqtSlot()
     def _show_network_error(self) -> None:
         """
         Show the network error dialog state.
         """
+        if hasattr(self, "progress_timer"):
+            self.progress_timer.stop()
+        self.progressBar.hide()
         self.headline.setText(strings.headline_error_network)
         self.proposedActionDescription.setText(strings.description_error_network)
         self.cancelButton.setEnabled(True)
@@ -166,10 +173,15 @@ class UpdaterApp(QDialog, Ui_UpdaterDialog):
         self.applyUpdatesButton.setEnabled(False)
         self.applyUpdatesButton.hide()
         self.cancelButton.setEnabled(False)
-        self.upgrade_thread = UpgradeThread()
-        self.upgrade_thread.start()
+        self.upgrade_thread = UpgradeThread(self._skip_netcheck)
         self.upgrade_thread.upgrade_signal.connect(self.upgrade_status)
         self.upgrade_thread.progress_signal.connect(self.update_progress_bar)
+        self.upgrade_thread.eta_signal.connect(self.update_time_remaining)
+        self.upgrade_thread.network_error_signal.connect(self._show_network_error)
+        self.progress_timer = QTimer(self)
+        self.progress_timer.timeout.connect(self.upgrade_thread.emit_progress)
+        self.progress_timer.start(PROGRESS_REFRESH_INTERVAL_MS)
+        self.upgrade_thread.start()
 
     def reboot_workstation(self) -> None:
         """
@@ -193,123 +205,53 @@ class UpdaterApp(QDialog, Ui_UpdaterDialog):
         sys.exit()
 
 
-def _is_netcheck_successful() -> bool:
+def _format_time_remaining(seconds: int) -> str:
     """
-    Helper function to assess network connectivity before launching updater.
-
-    Assess network connectivity by checking connection status (via nmcli) in
-    sys-net.
+    Progress bar format showing the percentage and the estimated time remaining,
+    rounded up to whole minutes.
     """
-    command = b"nmcli networking connectivity check"
-
-    if not Util.get_qubes_version():
-        logger.error("QubesOS not detected, cannot check network.")
-        return False
-    try:
-        # Use of `--pass-io` is required to check on network status, since
-        # nmcli returns 0 for all connection states we need to report back to dom0.
-        result = subprocess.check_output(["qvm-run", "-p", "sys-net", command])
-        return result.decode("utf-8").strip() == "full"
-    except subprocess.CalledProcessError as e:
-        logger.error(
-            "{} (connectivity check) failed; state reported as {}".format(
-                command.decode("utf-8"), e.output
-            )
-        )
-        return False
+    minutes = math.ceil(seconds / 60)
+    if minutes <= 1:
+        return strings.progress_format_less_than_a_minute
+    return strings.progress_format_minutes.format(minutes=minutes)
 
 
 class UpgradeThread(QThread):
     """
-    This thread will apply updates for TemplateVMs based on the VM list
-    specified in the object's contructor
+    This thread runs the pre-flight checks and the update pipeline (see
+    `Pipeline.UpdatePipeline`), relaying their progress and results to the
+    dialog as signals
     """
 
     upgrade_signal = pyqtSignal("PyQt_PyObject")
     progress_signal = pyqtSignal("int")
+    eta_signal = pyqtSignal("int")
+    network_error_signal = pyqtSignal()
 
-    def __init__(self) -> None:
+    def __init__(self, should_skip_netcheck: bool = False) -> None:
         QThread.__init__(self)
+        self.should_skip_netcheck = should_skip_netcheck
+        self.pipeline = Pipeline.UpdatePipeline(
+            progress_callback=self._emit_progress, serve_status=True
+        )
 
     def run(self) -> None:
-        results = self.run_full_update()
-
-        # write flags to disk
-        run_results = Updater.overall_update_status(results)
-        Updater._write_updates_status_flag_to_disk(run_results)
-        # Write the "last updated" date to disk if the system is up-to-date
-        # after applying upgrades, regardless of whether a reboot is still pending.
-        if run_results in {UpdateStatus.UPDATES_OK, UpdateStatus.REBOOT_REQUIRED}:
-            Updater._write_last_updated_flags_to_disk()
-        # populate signal results
-        message = results  # copy all information from updater call
-        message["recommended_action"] = run_results
-        self.upgrade_signal.emit(message)
-
-    def run_full_update(self) -> dict[str, Any]:
-        # Pre-populate results with all available steps for early exits
-        results = {
-            "dom0": UpdateStatus.UPDATES_REQUIRED,
-            "apply_dom0": UpdateStatus.UPDATES_REQUIRED,
-            "apply_all": UpdateStatus.UPDATES_REQUIRED,
-            "templates": UpdateStatus.UPDATES_REQUIRED,
-        }
-
-        # Update dom0 first, then apply dom0 state. If full state run
-        # is required, the dom0 state will drop a flag.
-        self.progress_signal.emit(5)
-        results["dom0"] = Updater.apply_updates_dom0()
-        if results["dom0"] == UpdateStatus.UPDATES_FAILED:
-            return results  # Fail early
-
-        # apply dom0 state
-        self.progress_signal.emit(10)
-        # add to results dict, if it fails it will show error message
-        results["apply_dom0"] = Updater.apply_dom0_state()
-        if results["apply_dom0"] == UpdateStatus.UPDATES_FAILED:
-            return results  # Fail early
-
-        self.progress_signal.emit(15)
-        # rerun full config if dom0 checks determined it's required
-        if Updater.migration_is_required():
-            # Progress bar will freeze for ~15m during full state run
-            self.progress_signal.emit(35)
-            # add to results dict, if it fails it will show error message
-            results["apply_all"] = Updater.run_full_install()
-            if results["apply_all"] == UpdateStatus.UPDATES_FAILED:
-                return results  # Fail early
-
-            self.progress_signal.emit(75)
-
-            templates_progress_callback = self.templates_progress_callback_factory(
-                progress_start=75,
-                progress_end=90,
-            )
-        else:
-            results["apply_all"] = UpdateStatus.UPDATES_OK  # No updates
-            templates_progress_callback = self.templates_progress_callback_factory(
-                progress_start=15,
-                progress_end=90,
-            )
-
-        results["templates"] = Updater.apply_updates_templates(
-            templates_progress_callback,
-        )
+        preflight = Preflight.run_preflight(self.should_skip_netcheck)
+        if not preflight.should_update:
+            self.network_error_signal.emit()
+            return
 
-        return results
+        self.upgrade_signal.emit(self.pipeline.run())
 
-    def templates_progress_callback_factory(
-        self, progress_start: int, progress_end: int
-    ) -> Callable[[int], None]:
-        def bump_progress(templates_total_progress: int) -> None:
-            """
-            Figure out how much the progress bar should be bumped
-            """
-            template_prog_percentage = (progress_end - progress_start) / 100
-            total_progress = int(
-                progress_start + template_prog_percentage * templates_total_progress
-            )
+    def run_full_update(self) -> dict[str, Any]:
+        return self.pipeline.run_full_update()
 
-            self.progress_signal.emit(total_progress)
+    def emit_progress(self) -> None:
+        """
+        Emit the current progress and estimated time remaining
+        """
+        self.pipeline.report_progress()
 
-        return bump_progress
+    def _emit_progress(self, percent: int, remaining: int) -> None:
+        self.progress_signal.emit(percent)
+        self.eta_signal.emit(remaining)
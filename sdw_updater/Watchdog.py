@@ -0,0 +1,114 @@
+"""
+Stall detection for template updates.
+
+`StallWatchdog` follows the progress qubes-vm-update reports for each template,
+from the time the template is dispatched to qubes-vm-update. A template that
+reports no progress for `stall_timeout` seconds (e.g. on a stuck Tor circuit or
+apt lock, or while starting, before its first progress report), is flagged as
+stalled. Templates queued behind others (see `--max-concurrency`) may only
+start once another template is done, so their timeout restarts whenever one
+is. Once every template still being updated has stalled, or the overall
+deadline has passed, the watchdog asks for the update to be stopped, so that
+stalled templates can be retried or failed cleanly. An update may also be
+cancelled, e.g. a background update once the updater is started.
+"""
+
+from __future__ import annotations
+
+import time
+from collections.abc import Callable, Iterable
+
+from sdw_util import Util
+
+sdlog = Util.get_logger(module=__name__)
+
+
+class StallWatchdog:
+    """
+    Watchdog for a single run of qubes-vm-update. `deadline` is a time as
+    returned by `clock`, or None for no deadline. The update is cancelled once
+    `cancel`, if given, returns True.
+    """
+
+    def __init__(
+        self,
+        stall_timeout: float,
+        deadline: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        cancel: Callable[[], bool] | None = None,
+    ) -> None:
+        self.stall_timeout = stall_timeout
+        self.deadline = deadline
+        self.clock = clock
+        self.cancel = cancel
+        self.stalled: set[str] = set()
+        # Set once the watchdog has asked for the update to be stopped
+        self.stopped = False
+        self.cancelled = False
+        # Time of the last progress report of each template being updated, or
+        # of the time it may have started, if it has not reported progress yet
+        self._last_progress: dict[str, float] = {}
+        self._waiting: set[str] = set()
+
+    def dispatched(self, templates: Iterable[str]) -> None:
+        """
+        Start following `templates`, passed to qubes-vm-update.
+        """
+        now = self.clock()
+        for template in templates:
+            self._last_progress[template] = now
+            self._waiting.add(template)
+
+    def progress(self, template: str) -> None:
+        """
+        Record a progress report for `template`.
+        """
+        self._last_progress[template] = self.clock()
+        self._waiting.discard(template)
+        if template in self.stalled:
+            self.stalled.discard(template)
+            sdlog.info(f"Update of template '{template}' is progressing again")
+
+    def done(self, template: str) -> None:
+        self._last_progress.pop(template, None)
+        self._waiting.discard(template)
+        self.stalled.discard(template)
+        # A queued template may start updating now
+        now = self.clock()
+        for waiting in self._waiting:
+            self._last_progress[waiting] = now
+            self.stalled.discard(waiting)
+
+    @property
+    def deadline_expired(self) -> bool:
+        return self.deadline is not None and self.clock() >= self.deadline
+
+    def check(self) -> bool:
+        """
+        Flag templates that have stalled. Returns False if the update should
+        be stopped: all templates still being updated have stalled, the
+        deadline has passed, or the update was cancelled.
+        """
+        now = self.clock()
+        for template, last_progress in self._last_progress.items():
+            if template not in self.stalled and now - last_progress >= self.stall_timeout:
+                self.stalled.add(template)
+                sdlog.warning(
+                    f"Stall detected: no progress updating template '{template}' "
+                    f"for {now - last_progress:.0f}s"
+                )
+
+        if self.deadline_expired:
+            sdlog.error("Template updates did not complete in time, stopping")
+            self.stopped = True
+        elif self.cancel is not None and self.cancel():
+            sdlog.info("Template updates cancelled, stopping")
+            self.cancelled = self.stopped = True
+        elif self._last_progress and self.stalled >= self._last_progress.keys():
+            sdlog.error(
+                "Stopping template updates, all remaining updates have stalled: {}".format(
+                    ", ".join(sorted(self.stalled))
+                )
+            )
+            self.stopped = True
+        return not self.stopped
@@ -17,6 +17,11 @@ description_status_applying_updates = (
     "The screensaver will not affect it.</p>"
 )
 
+# Progress bar text; "%p%" is replaced with the percentage
+progress_format = "%p%"
+progress_format_minutes = "%p% (about {minutes} minutes remaining)"
+progress_format_less_than_a_minute = "%p% (less than a minute remaining)"
+
 headline_status_updates_complete = "All updates complete!"
 description_status_updates_complete = (
     "Click <em>Continue</em> to launch the SecureDrop Inbox. No reboot is necessary."
@@ -0,0 +1,208 @@
+"""
+The updater state, shared by the updater, the launcher and the notifier.
+
+The status of the last updater run, and the time of the last successful
+update, are kept in a single versioned JSON file (STATE_FILE). It is replaced
+atomically: written to a temporary file, synced to disk, and renamed over the
+previous state, so that a crash while writing leaves either the previous or
+the new state, never a truncated file.
+
+Earlier versions kept the status and the time of the last successful update in
+separate files (LEGACY_STATUS_FILE, LEGACY_LAST_UPDATED_FILE). These are
+migrated to STATE_FILE, and removed, the first time the state is read.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import tempfile
+from datetime import datetime
+from typing import Any
+
+from sdw_util import Util
+
+STATE_FILE = "sdw-state.json"
+STATE_VERSION = 1
+LEGACY_STATUS_FILE = "sdw-update-status"
+LEGACY_LAST_UPDATED_FILE = "sdw-last-updated"
+
+sdlog = Util.get_logger(module=__name__)
+
+
+class UpdaterState:
+    """
+    The state recorded by the updater. Values that have not been recorded
+    (yet) are None.
+    """
+
+    def __init__(
+        self,
+        status: str | None = None,
+        status_updated: datetime | None = None,
+        last_updated: datetime | None = None,
+    ) -> None:
+        # Overall status of the last updater run (an `UpdateStatus` value), and
+        # when it was recorded
+        self.status = status
+        self.status_updated = status_updated
+        # Time of the last run after which the system was up to date
+        self.last_updated = last_updated
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "version": STATE_VERSION,
+            "status": self.status,
+            "status_updated": _format_date(self.status_updated),
+            "last_updated": _format_date(self.last_updated),
+        }
+
+    @classmethod
+    def from_dict(cls, contents: dict[str, Any]) -> UpdaterState:
+        """
+        Raises ValueError if `contents` are not state of the current version.
+        """
+        if contents.get("version") != STATE_VERSION:
+            raise ValueError(f"Unsupported state version: {contents.get('version')}")
+        status = contents["status"]
+        if status is not None and not isinstance(status, str):
+            raise ValueError(f"Invalid status: {status}")
+        return cls(
+            status=status,
+            status_updated=_parse_date(contents["status_updated"]),
+            last_updated=_parse_date(contents["last_updated"]),
+        )
+
+
+def get_state_path(basename: str = STATE_FILE) -> str:
+    # Resolved on each call rather than from Util.BASE_DIRECTORY, like the
+    # updater's other state files (see Updater.get_dom0_path)
+    return os.path.join(os.path.expanduser("~"), Util.BASE_DIRECTORY_NAME, basename)
+
+
+def read() -> UpdaterState:
+    """
+    Returns the current updater state. State that cannot be read is logged,
+    and treated as not recorded.
+    """
+    state_file = get_state_path()
+    try:
+        with open(state_file) as f:
+            contents = json.load(f)
+    except FileNotFoundError:
+        return _migrate()
+    except (OSError, ValueError) as e:
+        sdlog.error(f"Cannot read updater state from {state_file}")
+        sdlog.error(str(e))
+        return UpdaterState()
+
+    try:
+        return UpdaterState.from_dict(contents)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        sdlog.error(f"Data in {state_file} not in the expected format. Ignoring updater state.")
+        return UpdaterState()
+
+
+def write(state: UpdaterState) -> None:
+    """
+    Atomically replace the updater state with `state`. Raises OSError if it
+    cannot be written, in which case the previous state is left in place.
+    """
+    state_file = get_state_path()
+    state_dir = os.path.dirname(state_file)
+    os.makedirs(state_dir, exist_ok=True)
+
+    fd, temp_file = tempfile.mkstemp(dir=state_dir, prefix=f".{STATE_FILE}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(state.to_dict(), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, state_file)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_file)
+        raise
+
+    # Persist the rename itself
+    dir_fd = os.open(state_dir, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def write_status(status: str) -> None:
+    """
+    Record `status` as the status of the last updater run.
+    """
+    state = read()
+    state.status = status
+    state.status_updated = datetime.now()
+    write(state)
+
+
+def write_last_updated() -> None:
+    """
+    Record that the system is up to date as of now.
+    """
+    state = read()
+    state.last_updated = datetime.now()
+    write(state)
+
+
+def _migrate() -> UpdaterState:
+    """
+    Returns the state recorded in the files used by earlier versions, and
+    replaces them with STATE_FILE. Values that cannot be read are skipped.
+    """
+    state = UpdaterState()
+    legacy_files = []
+
+    status_file = get_state_path(LEGACY_STATUS_FILE)
+    try:
+        with open(status_file) as f:
+            legacy_files.append(status_file)
+            contents = json.load(f)
+        state.status = str(contents["status"])
+        state.status_updated = _parse_date(contents["last_status_update"])
+    except FileNotFoundError:
+        pass
+    except Exception:
+        sdlog.warning(f"Cannot migrate update status from {status_file}, skipping")
+        state.status = state.status_updated = None
+
+    last_updated_file = get_state_path(LEGACY_LAST_UPDATED_FILE)
+    try:
+        with open(last_updated_file) as f:
+            legacy_files.append(last_updated_file)
+            state.last_updated = _parse_date(f.readline().strip())
+    except FileNotFoundError:
+        pass
+    except Exception:
+        sdlog.warning(f"Cannot migrate last updated time from {last_updated_file}, skipping")
+
+    if not legacy_files:
+        return state  # Nothing recorded yet
+
+    try:
+        write(state)
+    except OSError as e:
+        sdlog.error("Error migrating updater state")
+        sdlog.error(str(e))
+        return state
+
+    for legacy_file in legacy_files:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(legacy_file)
+    sdlog.info(f"Migrated updater state to {get_state_path()}")
+    return state
+
+
+def _format_date(date: datetime | None) -> str | None:
+    return date.strftime(Util.DATE_FORMAT) if date is not None else None
+
+
+def _parse_date(date: str | None) -> datetime | None:
+    return datetime.strptime(date, Util.DATE_FORMAT) if date is not None else None
@@ -11,8 +11,12 @@ from collections.abc import Iterable
 from logging.handlers import TimedRotatingFileHandler
 from typing import IO
 
-# The directory where status files and logs are stored
-BASE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".securedrop_updater")
+# The directory where status files and logs are stored, in the home directory
+BASE_DIRECTORY_NAME = ".securedrop_updater"
+BASE_DIRECTORY = os.path.join(os.path.expanduser("~"), BASE_DIRECTORY_NAME)
+
+# Format of the dates recorded in status files
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 # Directory for lock files to avoid contention or multiple instantiation.
 LOCK_DIRECTORY = os.path.join("/run/user", str(os.getuid()))
@@ -85,13 +89,14 @@ def obtain_lock(basename: str) -> IO[str] | None:
     return lh
 
 
-def can_obtain_lock(basename: str) -> bool:
+def can_obtain_lock(basename: str, log: bool = True) -> bool:
     """
     We temporarily obtain a shared, nonblocking lock to a lockfile to determine
     whether the associated process is currently running. Returns True if it is
     safe to continue execution (no lock conflict), False if not.
 
     `basename` is the basename of a lockfile situated in the LOCK_DIRECTORY.
+    `log` - if False, a lock conflict is expected, and not logged as an error
     """
     lock_file = os.path.join(LOCK_DIRECTORY, basename)
     try:
@@ -104,12 +109,28 @@ def can_obtain_lock(basename: str) -> bool:
         # Obtain a nonblocking, shared lock
         fcntl.lockf(lh, fcntl.LOCK_SH | fcntl.LOCK_NB)
     except OSError:
-        sdlog.error(LOCK_ERROR.format(lock_file))
+        if log:
+            sdlog.error(LOCK_ERROR.format(lock_file))
         return False
 
     return True
 
 
+def wait_for_lock(basename: str) -> None:
+    """
+    Block until no other process holds an exclusive lock on the lockfile
+    `basename` in the LOCK_DIRECTORY. Returns immediately if the lockfile
+    does not exist.
+    """
+    lock_file = os.path.join(LOCK_DIRECTORY, basename)
+    try:
+        with open(lock_file) as lh:
+            # A blocking, shared lock is granted once the exclusive lock is released
+            fcntl.lockf(lh, fcntl.LOCK_SH)
+    except FileNotFoundError:
+        pass
+
+
 def is_conflicting_process_running(names: Iterable[str]) -> bool:
     """
     Check if any process of the given name is currently running. Aborts on the
@@ -5,10 +5,16 @@
 #
 # Layout mirrors the runtime package so import paths resolve identically at
 # type-check and run time, e.g. `from qubesadmin.vm import QubesVM`.
-from qubesadmin.app import VMCollection
+from collections.abc import Mapping
+
+from qubesadmin.app import QubesHost, VMCollection
+from qubesadmin.storage import Pool
 from qubesadmin.vm import QubesVM
 
 class Qubes:
     domains: VMCollection
+    host: QubesHost
     default_dispvm: QubesVM
+    default_pool: str
+    pools: Mapping[str, Pool]
     def __init__(self) -> None: ...
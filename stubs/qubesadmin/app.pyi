@@ -8,3 +8,7 @@ class VMCollection:
     def __getitem__(self, key: str) -> QubesVM: ...
     def __contains__(self, key: object) -> bool: ...
     def get(self, key: str, default: QubesVM | None = ...) -> QubesVM | None: ...
+
+class QubesHost:
+    # KiB
+    def get_free_xen_memory(self) -> int: ...
@@ -0,0 +1,7 @@
+# Type stubs for the `qubesadmin.storage` module.
+
+class Pool:
+    name: str
+    # Bytes; None if the pool driver does not report them
+    size: int | None
+    usage: int | None
@@ -25,7 +25,14 @@ class Features:
 
 class Volume:
     name: str
+    pool: str
+    # Bytes
     size: int
+    usage: int
+    # Oldest first
+    revisions: list[str]
+    revisions_to_keep: int
+    def revert(self, revision: str) -> None: ...
 
 class QubesVM:
     name: str
@@ -37,6 +44,9 @@ class QubesVM:
     netvm: QubesVM | None
     default_dispvm: QubesVM | None
     virt_mode: str
+    # MiB; maxmem is 0 if memory balancing is disabled
+    memory: int
+    maxmem: int
     kernel: str
     autostart: bool
     provides_network: bool
@@ -51,6 +61,8 @@ class QubesVM:
     def start(self) -> None: ...
     def shutdown(self) -> None: ...
     def kill(self) -> None: ...
+    # Current memory (KiB)
+    def get_mem(self) -> int: ...
     def property_is_default(self, name: str) -> bool: ...
     # Returns (stdout, stderr) from a qrexec call into the VM.
     def run(self, command: str, user: str | None = ...) -> tuple[bytes, bytes]: ...